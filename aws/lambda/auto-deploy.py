@@ -1,22 +1,20 @@
 import json
-import pandas as pd
-import numpy as np
-from io import StringIO
-import snowflake.connector
-from snowflake.connector import DictCursor
-import io
-import datetime
-import string
-import boto3
-from urllib.request import Request, urlopen
 from urllib.parse import unquote
 import base64
 
+from wormhole.aws import BUCKET
+from wormhole.catalog import invalidate_schema_catalog
+from wormhole.config import load_config
+from wormhole.ddl_queue import claim, move, release
+from wormhole.instrumentation import instrumented
+from wormhole.notify import sent_to_slack
+from wormhole.sql import copy_held_files, run_ddl
+
+@instrumented('auto-deploy')
 def lambda_handler(event, context):
     try:
         #build connection to snowflake
-        config_df = read_file_from_s3('wormholeltd-bucket', 'config/config-snowflake.csv')
-        config = config_df.to_dict(orient='records')
+        config = load_config()
         
         #get response infomation from slack
         body_event = unquote(base64.b64decode(event['body']).decode('utf8'))
@@ -25,34 +23,50 @@ def lambda_handler(event, context):
         res_content = json.loads(res)
         is_approve = res_content["approve"]
         id_change = res_content['id_change']
+        # Claim the change by ID, so a second click or a redelivered request does not deploy it again
+        claimed = claim('pending approval', context.aws_request_id, config, ddl_id=id_change)
+        if not claimed:
+            print(f"DDL {id_change} is not pending approval or is being handled by another request")
+            return None
+        change = claimed[0]
+        # Block Kit approvals (block_actions) only carry the ID: the change is read from DDL_HISTORY
+        res_content.update(database_name=change['DATABASE_NAME'], schema_name=change['SCHEMA_NAME'], table_name=change['TABLE_NAME'], ddl=change['DDL_STATEMENT'])
         database_name = res_content['database_name']
         schema_name = res_content['schema_name']
         table_name = res_content['table_name']
         ddl = res_content['ddl']
-        action_ts = payload['action_ts']
-        response_by = payload['user']['name']
+        action_ts = payload['actions'][0].get('action_ts') or payload.get('action_ts')
+        response_by = payload['user'].get('name') or payload['user'].get('username')
         
+        copy_error = None
         #Check response
         if is_approve: 
             action = ':successful:   Approved'
             status = 'done deployment'
             
-            #deploy ddl to production
-            for i in ddl.split(";"):
-                run_query(i, config)
-            
-            #execute ingestion pipeline
-            QUERY = f"""call INGESTION.COPY_SP('{schema_name}.{table_name}');"""
-            run_query(QUERY, config)
+            #deploy ddl to production; on failure the lease is given back so the approval can be retried
+            try:
+                run_ddl(ddl, config)
+            except Exception:
+                release([id_change], context.aws_request_id, config)
+                raise
+            # The DDL is applied: record it before loading, so a failed COPY does not leave it to be deployed again
+            invalidate_schema_catalog(BUCKET)
+            move([id_change], context.aws_request_id, status, config)
+
+            #execute ingestion pipeline: load the files held back while the change waited for approval
+            try:
+                copy_held_files(f'{schema_name}.{table_name}', config, change['FILES'])
+            except Exception as e:
+                print(f"Error when loading the files held back by DDL {id_change}: {e}")
+                copy_error = str(e)
                 
         else: 
             action = ":error-deny:   Denied"
             status = 'deny deployment'
         
-       
-        #update status on snowflake database
-        query_update_status = "UPDATE WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY SET STATUS = '{}' WHERE ID = {};".format(status, id_change)
-        request_approval_tbl = run_query(query_update_status, config)
+            #update status on snowflake database
+            move([id_change], context.aws_request_id, status, config)
         
         #Send noti to slack
         slack_message = {
@@ -60,9 +74,9 @@ def lambda_handler(event, context):
                     [
                         {
         
-                            "color": "#36a64f",
+                            "color": "#36a64f" if copy_error is None else "#e01e5a",
                             "pretext":"Having a detected schema change for `{}.{}.{}`".format(database_name,schema_name,table_name),
-                            "text": "_Status_: `{}`\n_DDL Statement_:\n```{}```".format(status, ddl),
+                            "text": "_Status_: `{}`\n_DDL Statement_:\n```{}```".format(status, ddl) + ("" if copy_error is None else "\n_Load failed_: `{}`".format(copy_error)),
                             "footer": "{} by {}".format(action, response_by),
                             "ts": action_ts
                         }
@@ -74,62 +88,3 @@ def lambda_handler(event, context):
     except Exception as e:
         print('Error')
         raise e
-
-
-
-
-def read_file_from_s3(bucket_name, file_key) -> None:
-    try:
-        s3_resource = boto3.resource('s3')
-        s3_client = s3_resource.meta.client
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        csv_data = io.BytesIO(response['Body'].read())
-        df = pd.read_csv(csv_data)
-        return df
-    except Exception as e:
-        print("Error when get file from S3")
-        raise e
-     
-def snowflake_credential(config):
-    try:
-        snowflake_secret = {
-            "user": config[0]['user'] ,
-            "password": config[0]['password'],
-            "account": config[0]['account'],
-            "schema": config[0]['schema'],
-            "warehouse": config[0]['warehouse'],
-            "database": config[0]['database'],
-            "role": config[0]['role']
-        }
-        return snowflake_secret
-
-    except Exception as e:
-        print('Error')
-        raise e
-
-
-def run_query(query, config):
-    try:
-        snowflake_secret = snowflake_credential(config)
-        with snowflake.connector.connect(**snowflake_secret) as con:
-            print("connect successfully!")
-            print(f"SQL query: {query}")
-            cur = con.cursor(DictCursor).execute(query)
-            return cur
-            
-    except Exception as e:
-        print("Error")
-        raise e
-        
-def sent_to_slack(slack_message):
-    try: 
-        config_df = read_file_from_s3('wormholeltd-bucket', 'config/config-snowflake.csv')
-        config = config_df.to_dict(orient='records')
-        slack_webhook_url = config[0]['slack_webhook_url']
-        req = Request(slack_webhook_url, json.dumps(slack_message).encode('utf-8'))
-        response = urlopen(req)
-        response.read()
-        return None
-    except Exception as e:
-        print('Error')
-        raise e
\ No newline at end of file
@@ -1,47 +1,164 @@
-import boto3
 import pandas as pd
-from io import StringIO
-import snowflake.connector
-from snowflake.connector import DictCursor
+import numpy as np
 import io
 import datetime
+from time import monotonic
 import string
+import difflib
+import hashlib
 import json
+import os
+import csv
+import re
+import multiprocessing
+from botocore.exceptions import ClientError
 from urllib.parse import unquote_plus
 
+from wormhole.aws import BUCKET, client, lambda_arn, worker_client
+from wormhole.catalog import load_schema_catalog_snapshot, save_schema_catalog_snapshot, schema_catalog
+from wormhole.config import load_config
+from wormhole.instrumentation import count, instrumented, span
+from wormhole.pipeline import invoke_lambda
+from wormhole.s3file import S3RangeFile
+from wormhole.sizing import parse_policy
+from wormhole.sql import insert_rows, run_copy, run_query
+
+# Schema inference settings: 'exact' scans the whole object, 'sample' reads the header plus a few byte ranges,
+# 'parallel' scans the whole object as SCHEMA_PARALLEL_WORKERS newline-aligned byte ranges in worker processes
+SCHEMA_INFERENCE_MODE = os.environ.get('SCHEMA_INFERENCE_MODE', 'exact')
+SCHEMA_SAMPLE_RANGES = int(os.environ.get('SCHEMA_SAMPLE_RANGES', '8'))
+SCHEMA_SAMPLE_BYTES = int(os.environ.get('SCHEMA_SAMPLE_BYTES', str(1024 * 1024)))
+SCHEMA_CHUNK_BYTES = 1024 * 1024
+# Lambda gives a function more vCPUs as its memory grows; objects smaller than SCHEMA_PARALLEL_MIN_BYTES
+# are scanned in one pass, as starting the workers would cost more than it saves
+SCHEMA_PARALLEL_WORKERS = int(os.environ.get('SCHEMA_PARALLEL_WORKERS', str(os.cpu_count() or 1)))
+SCHEMA_PARALLEL_MIN_BYTES = int(os.environ.get('SCHEMA_PARALLEL_MIN_BYTES', str(32 * 1024 * 1024)))
+# Where rows are read for inference: 'lambda' streams the object from S3, 'snowflake' runs INFER_SCHEMA and
+# one aggregate over the staged file, so no data bytes reach the Lambda. Sample mode reads SCHEMA_SAMPLE_ROWS rows.
+SCHEMA_INFERENCE_BACKEND = os.environ.get('SCHEMA_INFERENCE_BACKEND', 'lambda')
+SCHEMA_SAMPLE_ROWS = int(os.environ.get('SCHEMA_SAMPLE_ROWS', '10000'))
+
+# Data file formats by key suffix; other keys are read as CSV. Parquet and ORC schemas come from the
+# file footer alone, JSON Lines and CSV are inferred from their rows. A .json file is read as a whole
+# document: an array of objects, one object (pretty-printed or not), or objects one per line.
+FILE_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.orc': 'orc', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'json'}
+# FILE_TYPE argument of INGESTION.COPY_SP for each format
+COPY_FILE_TYPES = {'csv': 'CSV', 'parquet': 'PARQUET', 'orc': 'ORC', 'jsonl': 'JSON', 'json': 'JSON'}
+# Key prefix of INGESTION.S3_STAGE; COPY_SP takes file names relative to it
+STAGE_PREFIX = 'data/'
+STAGE = '@WORMHOLE.INGESTION.S3_STAGE'
+# File formats (see snowflake/integration.sql) for INFER_SCHEMA and for the length scan of the staged file
+STAGE_INFERENCE_FORMATS = {'csv': ('WORMHOLE.INGESTION.CSV_INFER_FORMAT', 'WORMHOLE.INGESTION.CSV_SCAN_FORMAT'),
+                           'jsonl': ('WORMHOLE.INGESTION.JSON_FORMAT', 'WORMHOLE.INGESTION.JSON_FORMAT'),
+                           'json': ('WORMHOLE.INGESTION.JSON_FORMAT', 'WORMHOLE.INGESTION.JSON_FORMAT')}
+
+# Values that pd.read_csv treats as missing by default
+NA_VALUES = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+             '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+BOOL_VALUES = {'True', 'TRUE', 'true', 'False', 'FALSE', 'false'}
+
+# Registry of monitored tables, kept next to config/config-snowflake.csv
+MONITORED_TABLES_KEY = 'config/monitored-tables.csv'
+# Cached for the life of the container and only re-parsed when the object's ETag changes
+table_registry = {'etag': None, 'tables': [], 'prefixes': {}, 'patterns': {}, 'varchar_policies': {}}
+
+# Column metadata of all monitored tables is kept per container (see wormhole.catalog);
+# LAST_ALTERED is re-checked every TTL seconds.
+SCHEMA_CATALOG_TTL_SECONDS = int(os.environ.get('SCHEMA_CATALOG_TTL_SECONDS', '300'))
+
+# Schema fingerprint (header + type profile of the first bytes) of the last file that matched each table.
+# A file with the same fingerprint, whose values in those bytes fit the table's VARCHAR lengths, goes straight
+# to COPY_SP; column widths past the prefix are not re-checked, but a COPY that fails sends the files to the full scan.
+SCHEMA_FINGERPRINT_FAST_PATH = os.environ.get('SCHEMA_FINGERPRINT_FAST_PATH', 'on') == 'on'
+SCHEMA_FINGERPRINT_BYTES = int(os.environ.get('SCHEMA_FINGERPRINT_BYTES', str(64 * 1024)))
+
+@instrumented('detect-schema-change')
 def lambda_handler(event, context):
     if event:
-        # Get event from S3 when a new file is added to the S3 bucket
-        bucket_name = str(event["Records"][0]["s3"]["bucket"]["name"])
-        file_key = unquote_plus(str(event["Records"][0]["s3"]["object"]["key"]))
-        print("Filename: ", file_key)
+        # Get every object from the S3 event (or from each S3 event in an SQS batch)
+        files = list(dict.fromkeys(iter_s3_objects(event)))
+        print("Filenames: ", [file_key for bucket_name, file_key in files])
 
-        config_df = read_file_from_s3('wormholeltd-bucket', 'config/config-snowflake.csv')
-        config = config_df.to_dict(orient='records')
+        config = load_config()
         
-        # List the tables needing schema change monitoring
-        table_schema = 'INGESTION'
-        table_list = ['EMPLOYEES']
+        # Route the files to the monitored table(s) they feed and group them by table
+        registry = load_table_registry(BUCKET, MONITORED_TABLES_KEY)
+        table_files = {}
+        for bucket_name, file_key in files:
+            for target in route_file_key(registry, file_key):
+                table_files.setdefault(target, []).append((bucket_name, file_key))
+        if table_files:
+            refresh_schema_catalog(BUCKET, registry['tables'], config)
+
         log_change_union = pd.DataFrame()
+        # Files of the changed tables, which are only loaded once their DDL is deployed
+        held_files = {}
+        file_profiles = {}
+        file_fingerprints = {}
+        fingerprints_changed = False
 
-        for table_name in table_list:
-            if table_name in file_key:
-                QUERY = f"""select COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH from information_schema.columns where table_catalog = 'WORMHOLE' and table_schema = '{table_schema}' and table_name = '{table_name}' ;"""
-                df1 = pd.DataFrame.from_records(iter(run_query(QUERY, config)), columns=[x[0] for x in run_query(QUERY, config).description])
-                df2 = get_schema_from_s3(bucket_name, file_key)
-                log_change = compare(df1, df2, table_schema, table_name)
-                if not log_change.empty:
-                    # insert the change into CHANGES_HISTORY table
-                    log_change.apply(update_table, args=[config], axis=1)
-                    log_change_union = pd.concat([log_change_union, log_change])
+        for (table_schema, table_name), table_file_list in table_files.items():
+            entry = schema_catalog['tables'].get(f'{table_schema}.{table_name}', {})
+            fingerprints = set()
+            if SCHEMA_FINGERPRINT_FAST_PATH:
+                fits = True
+                for file in table_file_list:
+                    if file not in file_fingerprints:
+                        file_fingerprints[file] = get_schema_fingerprint(*file)
+                    fingerprint, lengths = file_fingerprints[file]
+                    fingerprints.add(fingerprint)
+                    fits = fits and fits_declared_lengths(entry, lengths)
+                if fingerprints == {entry.get('fingerprint')} and fits:
+                    # Same header and types as the last files that matched the table: skip the full scan and compare()
+                    count('schema.fingerprint.hit')
+                    try:
+                        copy_into_table(table_schema, table_name, table_file_list, config)
+                        continue
+                    except Exception as e:
+                        # Values past the fingerprinted prefix can be longer or of another type: the full scan
+                        # and compare() find that change; with no change, the COPY below fails again and raises
+                        print(f"COPY into {table_schema}.{table_name} failed on a fingerprint match, scanning the files: {e}")
+                        count('schema.fingerprint.copy_failed')
                 else:
-                    # If there are no schema changes, then call the procedure to load data into the table
-                    QUERY = f"""call INGESTION.COPY_SP('{table_schema}.{table_name}');"""
-                    run_query(QUERY, config)
+                    count('schema.fingerprint.miss')
+
+            # Scan each file once, then merge the files of the table into one schema
+            profiles = None
+            for file in table_file_list:
+                if file not in file_profiles:
+                    file_profiles[file] = get_profiles_from_s3(*file)
+                profiles = file_profiles[file] if profiles is None else merge_profiles(profiles, file_profiles[file])
+            df1 = get_table_schema(table_schema, table_name)
+            df2 = profiles_to_schema(profiles)
+            with span('schema.diff', table=f'{table_schema}.{table_name}', columns=len(df2)) as attributes:
+                log_change = compare(df1, df2, table_schema, table_name)
+                attributes['changes'] = len(log_change)
+            if not log_change.empty:
+                log_change_union = pd.concat([log_change_union, log_change])
+                held_files[f'{table_schema}.{table_name}'] = {file_type: files for file_type, files in staged_files(table_file_list).items() if files}
+            else:
+                # If there are no schema changes, then call the procedure to load data into the table
+                copy_into_table(table_schema, table_name, table_file_list, config)
+                if len(fingerprints) == 1 and entry:
+                    entry['fingerprint'] = fingerprints.pop()
+                    fingerprints_changed = True
 
-        # If any schema changes occur, invoke lambda generate-ddl to generate a DDL query for the change.
+        if fingerprints_changed:
+            save_schema_catalog_snapshot(BUCKET)
         if not log_change_union.empty:
-            invoke_lambda('arn:aws:lambda:ap-southeast-2:316920261407:function:generate-ddl', log_change_union.to_json(orient='records'))
+            # insert the changes of the whole batch into CHANGES_HISTORY table at once
+            insert_change_history(log_change_union, config)
+
+        # If any schema changes occur, invoke lambda generate-ddl once for the whole batch to generate the DDL queries.
+        if not log_change_union.empty:
+            # The idempotency key identifies the triggering S3 objects, so retried deliveries of the same batch are
+            # processed once, while a later file with the same schema difference starts a new change set
+            changes = json.loads(log_change_union.to_json(orient='records'))
+            idempotency_key = event_idempotency_key(event)
+            changed_tables = {f"{change['TableSchema']}.{change['TableName']}" for change in changes}
+            varchar_policies = {table: policy for table, policy in registry['varchar_policies'].items() if table in changed_tables}
+            invoke_lambda(lambda_arn('generate-ddl'), json.dumps({'idempotency_key': idempotency_key, 'changes': changes, 'varchar_policies': varchar_policies,
+                                                                  'held_files': held_files}))
             return {
                             'statusCode': 200,
                             'body': log_change_union.to_json(orient='records')
@@ -53,144 +170,791 @@ def lambda_handler(event, context):
                         }
        
                         
-def invoke_lambda(FunctionName, Payload):
-    client = boto3.client('lambda')
+def copy_into_table(table_schema, table_name, table_file_list, config):
+    # Load only the files of this event: one COPY_SP call per file format among them.
+    # Files outside the stage fall back to the table's not yet loaded files.
+    for file_type, files in sorted(staged_files(table_file_list).items()):
+        run_copy(f'{table_schema}.{table_name}', config, file_type, files or None)
 
-    res = client.invoke(
-        	FunctionName = FunctionName,
-        	InvocationType = 'RequestResponse',
-        	Payload = Payload
-        )
-    return Payload
+def staged_files(table_file_list):
+    # {COPY_SP file type: file keys relative to the stage}; the files outside the stage are left out
+    file_types = {}
+    for bucket_name, file_key in table_file_list:
+        files = file_types.setdefault(COPY_FILE_TYPES[file_format(file_key)], [])
+        if file_key.startswith(STAGE_PREFIX):
+            files.append(file_key[len(STAGE_PREFIX):])
+    return file_types
 
-def read_file_from_s3(bucket_name, file_key) -> None:
+def file_format(file_key):
+    return FILE_FORMATS.get(os.path.splitext(file_key.lower())[1], 'csv')
+
+def iter_s3_objects(event):
+    for s3 in iter_s3_records(event):
+        yield str(s3['bucket']['name']), unquote_plus(str(s3['object']['key']))
+
+def iter_s3_records(event):
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            # SQS message bodies hold S3 notifications (test events have no Records and are skipped)
+            yield from iter_s3_records(json.loads(record['body']))
+        elif 's3' in record:
+            yield record['s3']
+
+def event_idempotency_key(event):
+    # Hash of the object versions in the event: key plus sequencer (or ETag), which differ for every upload
+    objects = sorted({(str(s3['bucket']['name']), str(s3['object']['key']), str(s3['object'].get('sequencer') or s3['object'].get('eTag') or ''))
+                      for s3 in iter_s3_records(event)})
+    return hashlib.sha256(json.dumps(objects).encode('utf-8')).hexdigest()
+
+def load_table_registry(bucket_name, file_key):
+    # Conditional GET: S3 answers 304 without a body when the registry has not changed since the last load
     try:
-        s3_resource = boto3.resource('s3')
-        s3_client = s3_resource.meta.client
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        csv_data = io.BytesIO(response['Body'].read())
-        df = pd.read_csv(csv_data)
-        return df
-    except Exception as e:
+        s3_client = client('s3')
+        if table_registry['etag']:
+            response = s3_client.get_object(Bucket=bucket_name, Key=file_key, IfNoneMatch=table_registry['etag'])
+        else:
+            response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+    except ClientError as e:
+        if e.response['ResponseMetadata']['HTTPStatusCode'] == 304:
+            return table_registry
         print("Error when get file from S3")
         raise e
 
-def get_schema_from_s3(bucket_name, file_key) -> None:
-    df = read_file_from_s3(bucket_name, file_key)
-    schema_type = {column: str(df[column].dtype) for column in df.columns}
-    schema_type_df = pd.DataFrame({'S3_COLUMN_NAME' : schema_type.keys() , 'S3_DATA_TYPE' : schema_type.values() })
-    schema_length = {column: df[column].astype(str).str.len().max() for column in df}
-    schema_length_df = pd.DataFrame({'S3_COLUMN_NAME' : schema_length.keys() , 'S3_DATA_LENGTH' : schema_length.values() })
-    schema_df = schema_type_df.merge(schema_length_df, left_on='S3_COLUMN_NAME', right_on='S3_COLUMN_NAME')
-    return schema_df
+    tables_df = pd.read_csv(io.BytesIO(response['Body'].read()), dtype=str, keep_default_na=False)
+    table_registry.update(build_table_index(tables_df.to_dict(orient='records')))
+    table_registry['etag'] = response['ETag']
+    return table_registry
 
-def snowflake_credential(config):
-    try:
-        snowflake_secret = {
-            "user": config[0]['user'] ,
-            "password": config[0]['password'],
-            "account": config[0]['account'],
-            "schema": config[0]['schema'],
-            "warehouse": config[0]['warehouse'],
-            "database": config[0]['database'],
-            "role": config[0]['role'],
-        }
-        return snowflake_secret
+# Regex metacharacters; a key_pattern is literal up to the first of them
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+def build_table_index(tables):
+    # Prefix entries go into a dict keyed by S3 prefix. Regex entries are compiled and keyed by the directory
+    # their literal start is in, so routing only tries the patterns that can match under the key's directories.
+    prefixes = {}
+    patterns = {}
+    varchar_policies = {}
+    for table in tables:
+        target = (table['table_schema'].upper(), table['table_name'].upper())
+        if table.get('varchar_policy'):
+            # How generate-ddl sizes the table's widened VARCHAR columns (see wormhole.sizing). A bad policy is
+            # logged and the table keeps the default one, so one edited row does not fail the DDL of the whole batch.
+            try:
+                parse_policy(table['varchar_policy'])
+                varchar_policies['.'.join(target)] = table['varchar_policy']
+            except ValueError as e:
+                print(f"Ignoring the varchar_policy of {'.'.join(target)} in {MONITORED_TABLES_KEY}: {e}")
+        if table.get('key_pattern'):
+            patterns.setdefault(pattern_directory(table['key_pattern']), []).append((re.compile(table['key_pattern']), target))
+        else:
+            prefix = table.get('key_prefix') or f"data/{target[1]}/"
+            prefixes.setdefault(prefix, []).append(target)
+    tables = list(dict.fromkeys([target for targets in prefixes.values() for target in targets] +
+                                [target for entries in patterns.values() for pattern, target in entries]))
+    return {'tables': tables, 'prefixes': prefixes, 'patterns': patterns, 'varchar_policies': varchar_policies}
+
+def pattern_directory(key_pattern):
+    # 'data/sales/\d+\.csv' -> 'data/sales/'; '' when the pattern has no literal directory (or is an alternation)
+    if '|' in key_pattern:
+        return ''
+    literal = ''
+    for character in key_pattern:
+        if character in REGEX_METACHARACTERS:
+            if character in '?*{':
+                # The quantifier makes the previous character optional
+                literal = literal[:-1]
+            break
+        literal += character
+    return literal[:literal.rfind('/') + 1]
 
+def route_file_key(registry, file_key):
+    # Look up every parent "directory" of the key, so the cost depends on the key depth, not on the number of tables.
+    # A key goes to every table whose prefix or key_pattern matches it.
+    targets = []
+    parts = file_key.split('/')
+    for depth in range(len(parts)):
+        directory = '/'.join(parts[:depth]) + '/' if depth else ''
+        if depth:
+            targets.extend(registry['prefixes'].get(directory, []))
+        for pattern, target in registry['patterns'].get(directory, []):
+            if pattern.fullmatch(file_key):
+                targets.append(target)
+    return list(dict.fromkeys(targets))
+
+def refresh_schema_catalog(bucket_name, tables, config):
+    # Bring the in-memory catalog up to date with as few Snowflake round trips as possible:
+    # none while it is fresh, one bulk information_schema query when tables are missing or have been altered
+    with span('catalog.refresh', tables=len(tables)) as attributes:
+        load_schema_catalog_snapshot(bucket_name)
+        catalog = schema_catalog['tables']
+        stale = [table for table in tables if '.'.join(table) not in catalog]
+
+        if monotonic() - schema_catalog['checked_at'] > SCHEMA_CATALOG_TTL_SECONDS:
+            known = [table for table in tables if '.'.join(table) in catalog]
+            if known:
+                for row in query_last_altered(known, config):
+                    key = f"{row['TABLE_SCHEMA']}.{row['TABLE_NAME']}"
+                    if key in catalog and catalog[key]['last_altered'] != str(row['LAST_ALTERED']):
+                        stale.append((row['TABLE_SCHEMA'], row['TABLE_NAME']))
+            schema_catalog['checked_at'] = monotonic()
+
+        attributes['stale'] = len(stale)
+        if stale:
+            for key, entry in fetch_schema_catalog(stale, config).items():
+                # LAST_ALTERED also moves on loads; keep the fingerprint while the columns are unchanged
+                if key in catalog and catalog[key]['columns'] == entry['columns'] and 'fingerprint' in catalog[key]:
+                    entry['fingerprint'] = catalog[key]['fingerprint']
+                catalog[key] = entry
+            save_schema_catalog_snapshot(bucket_name)
+        return catalog
+
+def fetch_schema_catalog(tables, config):
+    # One query for the columns of every requested table; schemas are filtered server-side, tables client-side
+    wanted = {'.'.join(table) for table in tables}
+    schemas = sorted({table_schema for table_schema, table_name in tables})
+    QUERY = f"""select c.TABLE_SCHEMA, c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.CHARACTER_MAXIMUM_LENGTH, t.LAST_ALTERED
+                from information_schema.columns c
+                join information_schema.tables t on t.table_catalog = c.table_catalog and t.table_schema = c.table_schema and t.table_name = c.table_name
+                where c.table_catalog = 'WORMHOLE' and c.table_schema in ({', '.join(['%s'] * len(schemas))})
+                order by c.table_schema, c.table_name, c.ordinal_position;"""
+    fetched = {key: {'last_altered': None, 'columns': []} for key in wanted}
+    with span('catalog.fetch', tables=len(wanted), schemas=len(schemas)):
+        for row in run_query(QUERY, config, schemas):
+            key = f"{row['TABLE_SCHEMA']}.{row['TABLE_NAME']}"
+            if key in wanted:
+                fetched[key]['last_altered'] = str(row['LAST_ALTERED'])
+                fetched[key]['columns'].append([row['COLUMN_NAME'], row['DATA_TYPE'], row['CHARACTER_MAXIMUM_LENGTH']])
+    return fetched
+
+def query_last_altered(tables, config):
+    schemas = sorted({table_schema for table_schema, table_name in tables})
+    QUERY = f"""select TABLE_SCHEMA, TABLE_NAME, LAST_ALTERED from information_schema.tables
+                where table_catalog = 'WORMHOLE' and table_schema in ({', '.join(['%s'] * len(schemas))});"""
+    return run_query(QUERY, config, schemas)
+
+def get_table_schema(table_schema, table_name):
+    entry = schema_catalog['tables'].get(f'{table_schema}.{table_name}', {'columns': []})
+    return pd.DataFrame(entry['columns'], columns=['COLUMN_NAME', 'DATA_TYPE', 'CHARACTER_MAXIMUM_LENGTH'])
+
+def get_schema_fingerprint(bucket_name, file_key):
+    # Hash of the header and the column types seen in the first SCHEMA_FINGERPRINT_BYTES of the object
+    # (or in the footer, for columnar formats, or in the whole JSON document, which cannot be cut at a byte offset),
+    # and the longest value of each column in those bytes
+    file_type = file_format(file_key)
+    try:
+        with span('s3.read', file=file_key, format=file_type, purpose='fingerprint') as attributes:
+            if file_type not in LINE_SCANNERS:
+                profiles = SCHEMA_READERS[file_type](client('s3'), bucket_name, file_key, 'exact', attributes)
+            else:
+                response = client('s3').get_object(Bucket=bucket_name, Key=file_key, Range=f'bytes=0-{SCHEMA_FINGERPRINT_BYTES - 1}')
+                prefix = response['Body'].read()
+                attributes['bytes'] = len(prefix)
     except Exception as e:
-        print('Error')
+        print("Error when get file from S3")
         raise e
+    if file_type in LINE_SCANNERS:
+        is_whole_object = int(response['ContentRange'].split('/')[-1]) <= len(prefix)
+        profiles = LINE_SCANNERS[file_type](iter_lines([prefix], drop_partial_last=not is_whole_object))
+    type_profile = [[column, finalize_type(profile)] for column, profile in profiles.items()]
+    lengths = {column: profile['length'] for column, profile in profiles.items()}
+    return hashlib.sha256(json.dumps(type_profile).encode('utf-8')).hexdigest(), lengths
+
+def fits_declared_lengths(entry, lengths):
+    # False when a value is longer than its text column, so compare() has to run and widen the column.
+    # File columns are looked up by their exact name, then with the punctuation stripped, as trim() does.
+    declared = {name: length for name, data_type, length in entry.get('columns', []) if data_type == 'TEXT' and length}
+    trans = str.maketrans('', '', string.punctuation)
+    for column, length in lengths.items():
+        limit = declared.get(column, declared.get(column.translate(trans)))
+        if limit is not None and length > limit:
+            return False
+    return True
 
+def get_schema_from_s3(bucket_name, file_key, mode=SCHEMA_INFERENCE_MODE) -> None:
+    return profiles_to_schema(get_profiles_from_s3(bucket_name, file_key, mode))
 
-def run_query(query, config):
+def get_profiles_from_s3(bucket_name, file_key, mode=SCHEMA_INFERENCE_MODE):
+    # The reader is picked by file format; the object is parsed while it streams in, so the S3 read
+    # and the inference share one span
+    file_type = file_format(file_key)
+    if SCHEMA_INFERENCE_BACKEND == 'snowflake' and file_type in STAGE_INFERENCE_FORMATS and file_key.startswith(STAGE_PREFIX):
+        try:
+            with span('schema.infer', file=file_key, format=file_type, mode=mode, backend='snowflake') as attributes:
+                profiles = stage_profiles(file_key[len(STAGE_PREFIX):], file_type, mode, load_config())
+                attributes.update(columns=len(profiles), bytes=0)
+        except Exception as e:
+            print("Error when infer schema in Snowflake")
+            raise e
+        return profiles
     try:
-        snowflake_secret = snowflake_credential(config)
-        with snowflake.connector.connect(**snowflake_secret) as con:
-            print("connect successfully!")
-            print(f"SQL query: {query}")
-            cur = con.cursor(DictCursor).execute(query)
-            return cur
-            
+        s3_client = client('s3')
+        with span('schema.infer', file=file_key, format=file_type, mode=mode) as attributes:
+            profiles = SCHEMA_READERS[file_type](s3_client, bucket_name, file_key, mode, attributes)
+            attributes['columns'] = len(profiles)
     except Exception as e:
-        print("Error")
+        print("Error when get file from S3")
         raise e
+    return profiles
+
+def csv_profiles_from_s3(s3_client, bucket_name, file_key, mode, attributes):
+    # Stream the object instead of loading it into memory, so memory use does not grow with the file size
+    if mode == 'sample':
+        return sample_profiles_from_s3(s3_client, bucket_name, file_key, attributes)
+    if mode == 'parallel':
+        profiles = parallel_profiles_from_s3(s3_client, bucket_name, file_key, 'csv', attributes)
+        if profiles is not None:
+            return profiles
+    response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+    attributes['bytes'] = response['ContentLength']
+    return scan_profiles(iter_lines(response['Body'].iter_chunks(SCHEMA_CHUNK_BYTES)))
 
-def classify_change_type(row):
-    if pd.notna(row['S3_COLUMN_NAME']) and row['S3_COLUMN_NAME_TRIM'] != row['S3_COLUMN_NAME']:
-        return 'RENAME COLUMN'
-    if pd.notna(row['S3_COLUMN_NAME_TRIM']) and pd.isna(row['COLUMN_NAME']):
-        return 'ADD NEW COLUMN'
-    if pd.notna(row['COLUMN_NAME']) and pd.isna(row['S3_COLUMN_NAME_TRIM']):
-        return 'REMOVE COLUMN'
+def jsonl_profiles_from_s3(s3_client, bucket_name, file_key, mode, attributes):
+    # One JSON object per line; in sample mode the ranges are read like CSV ones, whole lines only
+    if mode == 'parallel':
+        profiles = parallel_profiles_from_s3(s3_client, bucket_name, file_key, 'jsonl', attributes)
+        if profiles is not None:
+            return profiles
+    if mode == 'sample':
+        line_groups = iter_sample_lines(s3_client, bucket_name, file_key, attributes)
     else:
-        return None
+        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+        attributes['bytes'] = response['ContentLength']
+        line_groups = [iter_lines(response['Body'].iter_chunks(SCHEMA_CHUNK_BYTES))]
+    profiles = {}
+    for lines in line_groups:
+        scan_json_profiles(lines, profiles)
+    return profiles
+
+def json_profiles_from_s3(s3_client, bucket_name, file_key, mode, attributes):
+    # A JSON document has no row boundaries to read ranges at, so the whole object is read in any mode
+    response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+    attributes['bytes'] = response['ContentLength']
+    return scan_json_records(iter_json_documents(response['Body'].read().decode('utf-8')))
+
+def iter_json_documents(text):
+    # The objects of a JSON document: the elements of a top-level array (as STRIP_OUTER_ARRAY loads them),
+    # or each of the top-level values, which may be pretty-printed or one per line
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == len(text):
+            return
+        value, position = decoder.raw_decode(text, position)
+        if isinstance(value, list):
+            yield from value
+        else:
+            yield value
+
+def parquet_profiles_from_s3(s3_client, bucket_name, file_key, mode, attributes):
+    # Only the footer is read, in any mode. Parquet keeps no string lengths, so the length of a text
+    # column is the longest min/max value of its row group statistics (a lower bound of the real maximum)
+    import pyarrow.parquet as pq
+    f = S3RangeFile(s3_client, bucket_name, file_key)
+    metadata = pq.ParquetFile(f).metadata
+    lengths = {}
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        for j in range(row_group.num_columns):
+            chunk = row_group.column(j)
+            statistics = chunk.statistics
+            if statistics is not None and statistics.has_min_max and isinstance(statistics.max, str):
+                lengths[chunk.path_in_schema] = max(lengths.get(chunk.path_in_schema, 0), len(statistics.min), len(statistics.max))
+    attributes['bytes'] = f.bytes_read
+    attributes['requests'] = f.requests
+    return {field.name: {'type': arrow_type(field.type), 'length': lengths.get(field.name, 0), 'nulls': False}
+            for field in metadata.schema.to_arrow_schema()}
+
+def orc_profiles_from_s3(s3_client, bucket_name, file_key, mode, attributes):
+    # Only the footer is read, in any mode; text lengths are not available from it
+    import pyarrow.orc
+    f = S3RangeFile(s3_client, bucket_name, file_key)
+    schema = pyarrow.orc.ORCFile(f).schema
+    attributes['bytes'] = f.bytes_read
+    attributes['requests'] = f.requests
+    return {field.name: {'type': arrow_type(field.type), 'length': 0, 'nulls': False} for field in schema}
 
-def classify_change_data_type(row):
-    if (row['DATA_TYPE'] == 'TEXT') & (row['CHARACTER_MAXIMUM_LENGTH'] < row['S3_DATA_LENGTH']):
-        return 'CHANGED DATA TYPE'
-    if (row['DATA_TYPE'] != row['S3_DATA_TYPE'] != 'int64'):
-        return 'CHANGED DATA TYPE'
+def arrow_type(data_type):
+    # Columnar types keep their nulls, so unlike CSV an integer column with nulls stays int64
+    import pyarrow as pa
+    if pa.types.is_boolean(data_type):
+        return 'bool'
+    if pa.types.is_integer(data_type):
+        return 'int64'
+    if pa.types.is_floating(data_type) or pa.types.is_decimal(data_type):
+        return 'float64'
+    return 'object'
+
+SCHEMA_READERS = {'csv': csv_profiles_from_s3, 'jsonl': jsonl_profiles_from_s3, 'json': json_profiles_from_s3, 'parquet': parquet_profiles_from_s3, 'orc': orc_profiles_from_s3}
+
+def stage_profiles(stage_path, file_type, mode, config):
+    # Column names and types from INFER_SCHEMA, then the longest value, the nulls and the non-null count
+    # of every column from one aggregate over the staged file; both run in the warehouse
+    infer_format, scan_format = STAGE_INFERENCE_FORMATS[file_type]
+    location = f"{STAGE}/{stage_path}".replace("'", "''")
+    max_records = f", max_records_per_file => {SCHEMA_SAMPLE_ROWS}" if mode == 'sample' else ''
+    columns = run_query(f"select COLUMN_NAME, TYPE, ORDER_ID from table(infer_schema(location => '{location}', file_format => '{infer_format}'{max_records})) order by ORDER_ID;", config)
+    if not columns:
+        return {}
+    if file_type == 'csv':
+        values = [f"${row['ORDER_ID'] + 1}" for row in columns]
     else:
+        values = ['to_varchar($1:"{}")'.format(row['COLUMN_NAME'].replace('"', '""')) for row in columns]
+    limit = f' limit {SCHEMA_SAMPLE_ROWS}' if mode == 'sample' else ''
+    aggregates = ', '.join(f'max(length(C{i})) as L{i}, count_if(C{i} is null) as N{i}, count(C{i}) as V{i}' for i in range(len(values)))
+    rows = run_query(f"select {aggregates} from (select {', '.join(f'{value} as C{i}' for i, value in enumerate(values))} "
+                     f"from '{location}' (file_format => '{scan_format}'){limit});", config)
+    summary = rows[0] if rows else {}
+    profiles = {}
+    for i, row in enumerate(columns):
+        profiles[row['COLUMN_NAME']] = {
+            'type': stage_column_type(row['TYPE']) if summary.get(f'V{i}') else 'empty',
+            'length': int(summary.get(f'L{i}') or 0),
+            # JSON keys that are missing are not nulls, as in scan_json_profiles
+            'nulls': file_type == 'csv' and bool(summary.get(f'N{i}')),
+        }
+    return profiles
+
+def stage_column_type(data_type):
+    # INFER_SCHEMA types as the profile types of the S3 readers: NUMBER(p, 0) holds integers, any other scale decimals
+    match = re.match(r'\s*(\w+)\s*(?:\(\s*\d+\s*(?:,\s*(\d+)\s*)?\))?', data_type.upper())
+    name, scale = match.group(1), match.group(2)
+    if name in ('NUMBER', 'DECIMAL', 'NUMERIC', 'INT', 'INTEGER', 'BIGINT', 'SMALLINT'):
+        return 'int64' if not scale or int(scale) == 0 else 'float64'
+    if name in ('REAL', 'FLOAT', 'DOUBLE'):
+        return 'float64'
+    if name == 'BOOLEAN':
+        return 'bool'
+    return 'object'
+
+def profiles_to_schema(profiles):
+    schema_df = pd.DataFrame({
+        'S3_COLUMN_NAME': list(profiles.keys()),
+        'S3_DATA_TYPE': [finalize_type(profile) for profile in profiles.values()],
+        'S3_DATA_LENGTH': [profile['length'] for profile in profiles.values()],
+    })
+    return schema_df
+
+def iter_lines(chunks, drop_partial_first=False, drop_partial_last=False):
+    # Split raw byte chunks into text lines; splitting on b'\n' is safe for utf-8
+    pending = b''
+    first = True
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        if first and lines and drop_partial_first:
+            lines = lines[1:]
+        if lines:
+            first = False
+        for line in lines:
+            yield line.decode('utf-8') + '\n'
+    if pending and not drop_partial_last and not (first and drop_partial_first):
+        yield pending.decode('utf-8')
+
+def new_profiles(header):
+    header = [column.lstrip('\ufeff') if i == 0 else column for i, column in enumerate(header)]
+    return {column: {'type': 'empty', 'length': 0, 'nulls': False} for column in header}
+
+def scan_json_profiles(lines, profiles=None):
+    # One JSON object per line
+    return scan_json_records((json.loads(line) for line in lines if line.strip()), profiles)
+
+def scan_json_records(records, profiles=None):
+    # Columns are the keys in order of first appearance; a key missing from a record is not a null,
+    # as JSON loads match columns by name
+    if profiles is None:
+        profiles = {}
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError(f'Expected JSON objects, one per row, got a JSON {type(record).__name__}')
+        for column, value in record.items():
+            profile = profiles.get(column)
+            if profile is None:
+                profile = profiles[column] = {'type': 'empty', 'length': 0, 'nulls': False}
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value_type, text = 'bool', str(value)
+            elif isinstance(value, int):
+                value_type, text = 'int64', str(value)
+            elif isinstance(value, float):
+                value_type, text = 'float64', repr(value)
+            elif isinstance(value, str):
+                value_type, text = 'object', value
+            else:
+                value_type, text = 'object', json.dumps(value, separators=(',', ':'))
+            if len(text) > profile['length']:
+                profile['length'] = len(text)
+            profile['type'] = join_types(profile['type'], value_type)
+    return profiles
+
+def scan_profiles(lines, profiles=None):
+    # Read the header (unless profiles are already known) and fold every row into the column profiles
+    reader = csv.reader(lines)
+    if profiles is None:
+        profiles = new_profiles(next(reader, []))
+    for row in reader:
+        update_profiles(profiles, row)
+    return profiles
+
+# Row-based formats: profile a block of text lines
+LINE_SCANNERS = {'csv': scan_profiles, 'jsonl': scan_json_profiles}
+
+def update_profiles(profiles, row):
+    # Blank lines are skipped, as pandas does (skip_blank_lines)
+    if not row:
+        return
+    columns = list(profiles.values())
+    for profile, value in zip(columns, row):
+        if value in NA_VALUES:
+            profile['nulls'] = True
+            continue
+        if len(value) > profile['length']:
+            profile['length'] = len(value)
+        if profile['type'] != 'object':
+            profile['type'] = join_types(profile['type'], infer_value_type(value))
+    for profile in columns[len(row):]:
+        profile['nulls'] = True
+
+def merge_profiles(left, right):
+    # Combine two partial profiles; the result does not depend on the order of the parts.
+    # Columns only present in one side (files of the same table with different headers) are kept.
+    merged = {}
+    for column in list(left) + [column for column in right if column not in left]:
+        profile = left.get(column, {'type': 'empty', 'length': 0, 'nulls': False})
+        other = right.get(column, {'type': 'empty', 'length': 0, 'nulls': False})
+        merged[column] = {
+            'type': join_types(profile['type'], other['type']),
+            'length': max(profile['length'], other['length']),
+            'nulls': profile['nulls'] or other['nulls'],
+        }
+    return merged
+
+def infer_value_type(value):
+    if value in BOOL_VALUES:
+        return 'bool'
+    if '_' in value:
+        return 'object'
+    try:
+        int(value)
+        return 'int64'
+    except ValueError:
+        pass
+    try:
+        float(value)
+        return 'float64'
+    except ValueError:
+        return 'object'
+
+def join_types(left, right):
+    # Type lattice: empty < bool, empty < int64 < float64, and everything < object
+    if left == right or right == 'empty':
+        return left
+    if left == 'empty':
+        return right
+    if {left, right} == {'int64', 'float64'}:
+        return 'float64'
+    return 'object'
+
+def finalize_type(profile):
+    # Mirror the dtype pd.read_csv would pick once missing values are taken into account
+    if profile['type'] == 'empty':
+        return 'float64'
+    if profile['nulls'] and profile['type'] == 'int64':
+        return 'float64'
+    if profile['nulls'] and profile['type'] == 'bool':
+        return 'object'
+    return profile['type']
+
+def iter_sample_lines(s3_client, bucket_name, file_key, attributes):
+    # Lines of the header range, then of SCHEMA_SAMPLE_RANGES evenly spaced ranges, one iterator per range;
+    # partial lines at range edges are dropped
+    response = s3_client.get_object(Bucket=bucket_name, Key=file_key, Range=f'bytes=0-{SCHEMA_SAMPLE_BYTES - 1}')
+    object_size = int(response['ContentRange'].split('/')[-1])
+    head = response['Body'].read()
+    attributes['bytes'] = len(head)
+    if object_size <= SCHEMA_SAMPLE_BYTES * (SCHEMA_SAMPLE_RANGES + 1):
+        # The ranges would cover the object anyway (and overlap): read the rest of it in one request
+        if object_size > len(head):
+            head += s3_client.get_object(Bucket=bucket_name, Key=file_key, Range=f'bytes={len(head)}-{object_size - 1}')['Body'].read()
+            attributes['bytes'] = len(head)
+        yield iter_lines([head])
+        return
+    yield iter_lines([head], drop_partial_last=True)
+    for i in range(1, SCHEMA_SAMPLE_RANGES + 1):
+        start = i * object_size // (SCHEMA_SAMPLE_RANGES + 1)
+        end = min(start + SCHEMA_SAMPLE_BYTES, object_size) - 1
+        body = s3_client.get_object(Bucket=bucket_name, Key=file_key, Range=f'bytes={start}-{end}')['Body'].read()
+        attributes['bytes'] += len(body)
+        yield iter_lines([body], drop_partial_first=True, drop_partial_last=end < object_size - 1)
+
+def parallel_profiles_from_s3(s3_client, bucket_name, file_key, file_type, attributes):
+    # Split the rows into one byte range per worker process and merge the partial profiles. Returns None
+    # when the object should be scanned in one pass instead: it is small, or a quoted CSV field spans lines,
+    # so lines are not rows. Worker processes talk over a Pipe; Lambda has no /dev/shm, which Pool needs.
+    response = s3_client.get_object(Bucket=bucket_name, Key=file_key, Range=f'bytes=0-{SCHEMA_CHUNK_BYTES - 1}')
+    object_size = int(response['ContentRange'].split('/')[-1])
+    head = response['Body'].read()
+    attributes['bytes'] = len(head)
+    workers = min(SCHEMA_PARALLEL_WORKERS, max(1, object_size // SCHEMA_CHUNK_BYTES))
+    if workers < 2 or object_size < SCHEMA_PARALLEL_MIN_BYTES:
         return None
+    if file_type == 'csv':
+        if b'\n' not in head:
+            return None
+        header_line = head[:head.index(b'\n') + 1].decode('utf-8')
+        header, rows_start = next(csv.reader([header_line])), len(header_line.encode('utf-8'))
+    else:
+        header, rows_start = None, 0
+    bounds = [rows_start + i * (object_size - rows_start) // workers for i in range(workers + 1)]
+    processes = []
+    for start, end in zip(bounds, bounds[1:]):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=scan_range_worker, args=(sender, bucket_name, file_key, file_type, header, start, end), daemon=True)
+        process.start()
+        sender.close()
+        processes.append((process, receiver))
+    partials = []
+    try:
+        for process, receiver in processes:
+            partials.append(receiver.recv())
+    finally:
+        for process, receiver in processes:
+            receiver.close()
+            process.join()
+    failed = [partial['error'] for partial in partials if 'error' in partial]
+    if failed:
+        raise RuntimeError(f'Schema scan of {file_key} failed in a worker: {failed[0]}')
+    attributes.update(bytes=attributes['bytes'] + sum(partial['bytes'] for partial in partials), workers=workers)
+    if any(partial['multiline'] for partial in partials):
+        return None
+    # Ranges are merged in file order, so columns keep the order of a single pass
+    profiles = new_profiles(header) if header is not None else {}
+    for partial in partials:
+        profiles = merge_profiles(profiles, partial['profiles'])
+    return profiles
+
+def scan_range_worker(sender, bucket_name, file_key, file_type, header, start, end):
+    # Runs in a worker process: profile the lines that start in [start, end) and send the result to the parent
+    stats = {'bytes': 0, 'multiline': False}
+    try:
+        lines = iter_range_lines(worker_client('s3'), bucket_name, file_key, start, end, stats)
+        if file_type == 'csv':
+            profiles = scan_profiles(iter_checked_lines(lines, stats), new_profiles(header))
+        else:
+            profiles = scan_json_profiles(lines)
+        sender.send({'profiles': profiles, **stats})
+    except csv.Error:
+        # A range that starts inside a quoted field; the parent scans the object in one pass
+        sender.send({'profiles': {}, **stats, 'multiline': True})
+    except Exception as e:
+        sender.send({'error': repr(e)})
+    finally:
+        sender.close()
+
+def iter_range_lines(s3_client, bucket_name, file_key, start, end, stats):
+    # Lines that start in [start, end). Reading begins one byte early, so a line that starts exactly at
+    # start is recognised, and goes past end until the last of those lines is complete.
+    if start:
+        response = s3_client.get_object(Bucket=bucket_name, Key=file_key, Range=f'bytes={start - 1}-')
+    else:
+        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
+    body = response['Body']
+    position = start - 1 if start else 0
+    skipping = bool(start)
+    pending = b''
+    for chunk in body.iter_chunks(SCHEMA_CHUNK_BYTES):
+        stats['bytes'] += len(chunk)
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if skipping:
+                skipping = False
+            elif position >= end:
+                body.close()
+                return
+            else:
+                yield line.decode('utf-8') + '\n'
+            position += len(line) + 1
+    if pending and not skipping and position < end:
+        yield pending.decode('utf-8')
+
+def iter_checked_lines(lines, stats):
+    # An odd number of quotes on a line means a quoted field continues on the next line
+    for line in lines:
+        if line.count('"') % 2:
+            stats['multiline'] = True
+        yield line
+
+def sample_profiles_from_s3(s3_client, bucket_name, file_key, attributes):
+    ranges = iter_sample_lines(s3_client, bucket_name, file_key, attributes)
+    profiles = scan_profiles(next(ranges))
+    for lines in ranges:
+        try:
+            for row in csv.reader(lines):
+                # A range can start inside a quoted field; rows that do not line up with the header are skipped
+                if len(row) == len(profiles):
+                    update_profiles(profiles, row)
+        except csv.Error:
+            continue
+    return profiles
+
+# Names of the compare() output columns, as consumed by generate-ddl
+CHANGE_COLUMNS = {'COLUMN_NAME': 'ORIGINAL_COLUMN_NAME', 'S3_COLUMN_NAME': 'NEW_COLUMN_NAME', 'DATA_TYPE': 'OLD_DATA_TYPE', 'CHARACTER_MAXIMUM_LENGTH': 'OLD_DATA_LENGTH', 'S3_DATA_TYPE': 'NEW_DATA_TYPE', 'S3_DATA_LENGTH': 'NEW_DATA_LENGTH'}
+# pandas dtypes found in S3 files and the matching Snowflake types
+SNOWFLAKE_TYPES = {'object': 'TEXT', 'int64': 'NUMBER', 'float64': 'FLOAT'}
+
+# Fuzzy rename matching between removed and added columns
+RENAME_MATCHING = os.environ.get('RENAME_MATCHING', 'on') == 'on'
+RENAME_MATCH_THRESHOLD = float(os.environ.get('RENAME_MATCH_THRESHOLD', '0.8'))
+# Trigrams shared by more added columns than this (e.g. a common 'COL' prefix) are not used for blocking
+RENAME_BLOCK_MAX = 50
 
 def compare(df1, df2, table_schema, table_name):
 
         # Apply cleaning rules to standardize column names, such as removing prefixes or suffixes.
-        trim(df2)
+        trim(df2, df1['COLUMN_NAME'])
         current_time = datetime.datetime.now()
 
-        # Compare the current schema in S3 against Snowflake versions to detect changes
+        # Compare the current schema in S3 against Snowflake versions to detect changes.
+        # A single outer merge feeds both checks; every mask is computed over the whole frame at once.
+        merged = pd.merge(df1, df2, left_on='COLUMN_NAME', right_on='S3_COLUMN_NAME_TRIM', how='outer')
+        if RENAME_MATCHING:
+            merged = pair_renamed_columns(merged)
+        in_table = merged['COLUMN_NAME'].notna().to_numpy()
+        in_file = merged['S3_COLUMN_NAME'].notna().to_numpy()
+        trimmed = merged['S3_COLUMN_NAME_TRIM'].notna().to_numpy()
+        data_type = merged['DATA_TYPE'].to_numpy()
+        s3_data_type = merged['S3_DATA_TYPE'].to_numpy()
+        longer = (data_type == 'TEXT') & (merged['CHARACTER_MAXIMUM_LENGTH'] < merged['S3_DATA_LENGTH']).to_numpy()
+
         # 1. Detect renaming, deletion, or addition of columns
+        is_changed_col = (merged['COLUMN_NAME'] != merged['S3_COLUMN_NAME']).to_numpy()
+        renamed = in_file & ((merged['S3_COLUMN_NAME_TRIM'] != merged['S3_COLUMN_NAME']) | (merged['COLUMN_NAME'].notna() & (merged['COLUMN_NAME'] != merged['S3_COLUMN_NAME_TRIM']))).to_numpy()
+        change_type_col = np.select([renamed, trimmed & ~in_table, in_table & ~trimmed], ['RENAME COLUMN', 'ADD NEW COLUMN', 'REMOVE COLUMN'], None)
 
-        merged_df_col = pd.merge(df1, df2, left_on='COLUMN_NAME', right_on='S3_COLUMN_NAME_TRIM', how='outer')
-        merged_df_col['Is_changed'] = (merged_df_col['COLUMN_NAME'] != merged_df_col['S3_COLUMN_NAME'])
-        print(merged_df_col)
-        filtered_df_col = merged_df_col.loc[(merged_df_col['Is_changed'] == True)]
-        if not filtered_df_col.empty:
-            filtered_df_col['ChangeType'] = filtered_df_col.apply(classify_change_type, axis=1)
-            filtered_df_col['Database'] = 'WORMHOLE'
-            filtered_df_col['TableSchema'] = table_schema
-            filtered_df_col['TableName'] = table_name
-            filtered_df_col['Created_at'] = current_time
-        filtered_df_col = filtered_df_col.rename(columns={'COLUMN_NAME': 'ORIGINAL_COLUMN_NAME', 'S3_COLUMN_NAME': 'NEW_COLUMN_NAME', 'DATA_TYPE': 'OLD_DATA_TYPE', 'CHARACTER_MAXIMUM_LENGTH':'OLD_DATA_LENGTH', 'S3_DATA_TYPE': 'NEW_DATA_TYPE', 'S3_DATA_LENGTH': 'NEW_DATA_LENGTH'})
-        
-        
         # 2. Detect datatype change
-        merged_df_data_type = pd.merge(df1, df2, left_on='COLUMN_NAME', right_on='S3_COLUMN_NAME_TRIM', how='outer')
-        merged_df_data_type = merged_df_data_type.dropna(subset=['S3_COLUMN_NAME'])
-        merged_df_data_type['Is_changed'] = ((merged_df_data_type['DATA_TYPE'] == 'TEXT') & (merged_df_data_type['CHARACTER_MAXIMUM_LENGTH'] < merged_df_data_type['S3_DATA_LENGTH'])) | ((merged_df_data_type['DATA_TYPE'] == 'NUMBER') & (merged_df_data_type['S3_DATA_TYPE'] != 'int64')) | ((merged_df_data_type['DATA_TYPE'] == 'FLOAT') & (merged_df_data_type['S3_DATA_TYPE'] != 'float64'))
-        filtered_df_data_type = merged_df_data_type.loc[(merged_df_data_type['Is_changed'] == True)]
-        if not filtered_df_data_type.empty:
-            filtered_df_data_type['ChangeType'] = filtered_df_data_type.apply(classify_change_data_type, axis=1)
-            filtered_df_data_type['Database'] = 'WORMHOLE'
-            filtered_df_data_type['TableSchema'] = table_schema
-            filtered_df_data_type['TableName'] = table_name
-            filtered_df_data_type['Created_at'] = current_time
-        
-        filtered_df_data_type = filtered_df_data_type.rename(columns={'COLUMN_NAME': 'ORIGINAL_COLUMN_NAME', 'S3_COLUMN_NAME': 'NEW_COLUMN_NAME', 'DATA_TYPE': 'OLD_DATA_TYPE', 'CHARACTER_MAXIMUM_LENGTH':'OLD_DATA_LENGTH', 'S3_DATA_TYPE': 'NEW_DATA_TYPE', 'S3_DATA_LENGTH': 'NEW_DATA_LENGTH'})
-    
-        
-        filtered_df = pd.concat([filtered_df_col,filtered_df_data_type])
-        
+        is_changed_data_type = in_file & (longer | ((data_type == 'NUMBER') & (s3_data_type != 'int64')) | ((data_type == 'FLOAT') & (s3_data_type != 'float64')))
+        change_type_data_type = np.select([longer, (data_type != s3_data_type) & (s3_data_type != 'int64')], ['CHANGED DATA TYPE', 'CHANGED DATA TYPE'], None)
+
+        # Column changes first, then datatype changes; a column can appear in both
+        rows = np.concatenate([np.flatnonzero(is_changed_col), np.flatnonzero(is_changed_data_type)])
+        filtered_df = merged.iloc[rows].assign(
+            Is_changed=True,
+            ChangeType=np.concatenate([change_type_col[is_changed_col], change_type_data_type[is_changed_data_type]]),
+            Database='WORMHOLE',
+            TableSchema=table_schema,
+            TableName=table_name,
+            Created_at=current_time,
+        )
+        filtered_df = filtered_df.rename(columns=CHANGE_COLUMNS)
+
         if not filtered_df.empty:
             preprocess(filtered_df)
             filtered_df = filtered_df.sort_values(by=['ChangeType'], ascending=True)
 
         return filtered_df
 
-def trim(df):
+def pair_renamed_columns(merged):
+    # Put a removed column and the added column it was renamed to on the same row, so compare() reports
+    # one RENAME COLUMN (plus a datatype change if needed) instead of a REMOVE COLUMN and an ADD NEW COLUMN
+    removed = np.flatnonzero((merged['COLUMN_NAME'].notna() & merged['S3_COLUMN_NAME'].isna()).to_numpy())
+    added = np.flatnonzero((merged['COLUMN_NAME'].isna() & merged['S3_COLUMN_NAME'].notna()).to_numpy())
+    if not len(removed) or not len(added):
+        return merged
+    pairs = match_renames(
+        merged.iloc[removed][['COLUMN_NAME', 'DATA_TYPE', 'CHARACTER_MAXIMUM_LENGTH']].to_dict(orient='records'),
+        merged.iloc[added][['S3_COLUMN_NAME', 'S3_DATA_TYPE', 'S3_DATA_LENGTH']].to_dict(orient='records'),
+    )
+    if not pairs:
+        return merged
+    merged = merged.copy()
+    s3_columns = [merged.columns.get_loc(column) for column in ['S3_COLUMN_NAME', 'S3_DATA_TYPE', 'S3_DATA_LENGTH', 'S3_COLUMN_NAME_TRIM']]
+    old_rows = removed[[i for i, j in pairs]]
+    new_rows = added[[j for i, j in pairs]]
+    merged.iloc[old_rows, s3_columns] = merged.iloc[new_rows, s3_columns].to_numpy()
+    return merged.drop(index=merged.index[new_rows])
+
+def match_renames(removed, added):
+    # Returns (removed index, added index) pairs, each column used at most once.
+    # A trigram index over the added names limits scoring to pairs that share at least one trigram.
+    added_grams = [name_ngrams(column['S3_COLUMN_NAME']) for column in added]
+    index = {}
+    for j, grams in enumerate(added_grams):
+        for gram in grams:
+            index.setdefault(gram, []).append(j)
+
+    candidates = []
+    for i, column in enumerate(removed):
+        grams = name_ngrams(column['COLUMN_NAME'])
+        blocked = set()
+        for gram in grams:
+            if len(index.get(gram, ())) <= RENAME_BLOCK_MAX:
+                blocked.update(index.get(gram, ()))
+        for j in blocked:
+            score = rename_score(column, added[j], grams, added_grams[j])
+            if score >= RENAME_MATCH_THRESHOLD:
+                candidates.append((score, i, j))
+
+    # Greedy assignment, best scores first
+    pairs = []
+    used_removed, used_added = set(), set()
+    for score, i, j in sorted(candidates, key=lambda candidate: (-candidate[0], candidate[1], candidate[2])):
+        if i not in used_removed and j not in used_added:
+            pairs.append((i, j))
+            used_removed.add(i)
+            used_added.add(j)
+    return pairs
+
+def normalize_name(name):
+    return str(name).upper().translate(str.maketrans('', '', string.punctuation))
+
+def name_ngrams(name, n=3):
+    key = f'#{normalize_name(name)}#'
+    return {key[i:i + n] for i in range(max(1, len(key) - n + 1))}
+
+def rename_score(old, new, old_grams, new_grams):
+    # Weighted mix of name similarity (trigram Jaccard and edit-based ratio), type compatibility,
+    # and how well the new column's values fit the old column's declared length
+    # Names that only differ by their numbers (ADDRESS1 / ADDRESS2) are distinct columns, not renames
+    if re.findall(r'\d+', str(old['COLUMN_NAME'])) != re.findall(r'\d+', str(new['S3_COLUMN_NAME'])):
+        return 0.0
+    jaccard = len(old_grams & new_grams) / len(old_grams | new_grams)
+    ratio = difflib.SequenceMatcher(None, normalize_name(old['COLUMN_NAME']), normalize_name(new['S3_COLUMN_NAME'])).ratio()
+    name_similarity = (jaccard + ratio) / 2
+
+    new_type = SNOWFLAKE_TYPES.get(new['S3_DATA_TYPE'], new['S3_DATA_TYPE'])
+    if new_type == old['DATA_TYPE'] or (old['DATA_TYPE'] == 'FLOAT' and new_type == 'NUMBER') or old['DATA_TYPE'] == 'TEXT':
+        type_compatibility = 1.0 if new_type == old['DATA_TYPE'] else 0.5
+    else:
+        type_compatibility = 0.0
+
+    old_length, new_length = old['CHARACTER_MAXIMUM_LENGTH'], new['S3_DATA_LENGTH']
+    if old['DATA_TYPE'] == 'TEXT' and pd.notna(old_length) and pd.notna(new_length) and new_length > old_length:
+        length_fit = old_length / new_length
+    else:
+        length_fit = 1.0
+
+    return 0.6 * name_similarity + 0.25 * type_compatibility + 0.15 * length_fit
+
+def trim(df, table_columns=()):
     trans = str.maketrans('', '', string.punctuation)
     df['S3_COLUMN_NAME_TRIM'] = df['S3_COLUMN_NAME'].str.translate(trans)
+    # A column the table already has under the same name (e.g. FIRST_NAME after a rename) is kept as it is
+    exact = df['S3_COLUMN_NAME'].isin(table_columns)
+    df.loc[exact, 'S3_COLUMN_NAME_TRIM'] = df.loc[exact, 'S3_COLUMN_NAME']
 
 def preprocess(df):
-    df['NEW_DATA_LENGTH'].fillna(0, inplace = True)
-    df['OLD_DATA_LENGTH'].fillna(0, inplace = True)
-    df['NEW_DATA_TYPE'] = df['NEW_DATA_TYPE'].str.replace('object','TEXT')
-    df['NEW_DATA_TYPE'] = df['NEW_DATA_TYPE'].str.replace('int64','NUMBER')
-    df['NEW_DATA_TYPE'] = df['NEW_DATA_TYPE'].str.replace('float64','FLOAT')
-    df['NEW_DATA_LENGTH'] = df['NEW_DATA_LENGTH'].astype('int')
-    df['OLD_DATA_LENGTH'] = df['OLD_DATA_LENGTH'].astype('int')
-
-def update_table(row, config):
-    db_query = f"""insert into SCHEMA_MANAGEMENT.CHANGE_HISTORY (database_name, schema_name, table_name, old_column_name, old_data_type, old_data_length, new_column_name, new_data_type, new_data_length, change_type, created_at, updated_at ) values('{row['Database']}', '{row['TableSchema']}', '{row['TableName']}', '{row['ORIGINAL_COLUMN_NAME']}', '{row['OLD_DATA_TYPE']}', '{row['OLD_DATA_LENGTH']}', '{row['NEW_COLUMN_NAME']}',  '{row['NEW_DATA_TYPE']}', '{row['NEW_DATA_LENGTH']}', '{row['ChangeType']}', '{row['Created_at']}', '{row['Created_at']}');"""
-    run_query(db_query, config)
\ No newline at end of file
+    df['NEW_DATA_LENGTH'] = df['NEW_DATA_LENGTH'].fillna(0).astype('int')
+    df['OLD_DATA_LENGTH'] = df['OLD_DATA_LENGTH'].fillna(0).astype('int')
+    df['NEW_DATA_TYPE'] = df['NEW_DATA_TYPE'].replace(SNOWFLAKE_TYPES)
+
+def insert_change_history(log_change, config):
+    columns = ['database_name', 'schema_name', 'table_name', 'old_column_name', 'old_data_type', 'old_data_length', 'new_column_name', 'new_data_type', 'new_data_length', 'change_type', 'created_at', 'updated_at']
+    df = log_change[['Database', 'TableSchema', 'TableName', 'ORIGINAL_COLUMN_NAME', 'OLD_DATA_TYPE', 'OLD_DATA_LENGTH', 'NEW_COLUMN_NAME', 'NEW_DATA_TYPE', 'NEW_DATA_LENGTH', 'ChangeType', 'Created_at', 'Created_at']]
+    # Missing names/types are stored as NULL rather than the string 'nan'
+    df = df.astype(object).where(pd.notna(df), None)
+    # The connector cannot bind pandas Timestamps (error 255001), so the times go in as plain datetimes
+    rows = [tuple(value.to_pydatetime() if isinstance(value, pd.Timestamp) else value for value in row) for row in df.itertuples(index=False, name=None)]
+    return insert_rows('WORMHOLE.SCHEMA_MANAGEMENT.CHANGE_HISTORY', columns, rows, config)
@@ -1,59 +1,64 @@
 import json
-import pandas as pd
-import numpy as np
-from io import StringIO
-import snowflake.connector
-from snowflake.connector import DictCursor
-import io
 import datetime
-import string
-import boto3
+import hashlib
 
+from wormhole.aws import lambda_arn
+from wormhole.config import load_config
+from wormhole.ddl_queue import enqueue, next_ids
+from wormhole.instrumentation import instrumented, span
+from wormhole.pipeline import claim_idempotency_key, invoke_lambda, release_idempotency_key
+from wormhole.sizing import HISTORY_POLICIES, length_history, parse_policy, widened_length
+from wormhole.sql import copy_held_files, insert_rows
 
+# Relative cost of a plan: statements that only change metadata are cheap, an UPDATE that rewrites
+# every micro-partition of the table is not
+METADATA_STATEMENT_COST = 1
+TABLE_REWRITE_COST = 100
+# Suffix of the column a rewrite copies the converted values into before it replaces the original
+REWRITE_COLUMN_SUFFIX = '__NEW'
+# Types detect-schema-change reports that are spelled differently in Snowflake DDL
+DDL_TYPES = {'bool': 'BOOLEAN'}
+
+
+@instrumented('generate-ddl')
 def lambda_handler(event, context):
+    # Events from detect-schema-change carry the change records, an idempotency key for the change set,
+    # the VARCHAR sizing policy of the tables that set one in config/monitored-tables.csv
+    # and the files each changed table held back
+    varchar_policies, held_files = {}, {}
+    if isinstance(event, dict):
+        changes = event['changes']
+        idempotency_key = event['idempotency_key']
+        varchar_policies = event.get('varchar_policies') or {}
+        held_files = event.get('held_files') or {}
+    else:
+        changes = event
+        idempotency_key = hashlib.sha256(json.dumps(event, sort_keys=True).encode('utf-8')).hexdigest()
+
+    if not claim_idempotency_key('generate-ddl', idempotency_key):
+        print(f"Change set {idempotency_key} was already processed")
+        return {
+            'statusCode': 200,
+            'body': json.dumps('change set already processed')
+        }
+    try:
+        config = load_config()
+        ddl_history, unblocked = generate_ddl(changes, varchar_policies, held_files, config)
+
+        # Insert the DDL queries of all tables into DDL_HISTORY table in one batch
+        insert_ddl_history(ddl_history, config)
+    except Exception as e:
+        # Nothing is written yet, so a retry can process the change set from the start
+        release_idempotency_key('generate-ddl', idempotency_key)
+        raise e
+
+    # The key is kept from here on, even on failure: a retry would insert the DDL rows a second time.
+    # Rows whose next stage was not invoked stay on DDL_QUEUE, where the next noti-and-deploy run claims them.
+    for table_name, files in unblocked.items():
+        copy_held_files(table_name, config, files)
 
-    # Parse the event received from the previous Lambda function to get list of tables having changes
-    df = pd.json_normalize(event)
-    changed_tables = df.TableName.unique()
-    
-    config_df = read_file_from_s3('wormholeltd-bucket', 'config/config-snowflake.csv')
-    config = config_df.to_dict(orient='records')
-
-    for table in changed_tables:
-        df_t = df[df['TableName']==table]
-        schema = ' '.join(df['TableSchema'].unique())
-        alter_statements = ''
-        need_approval = False
-        changes = ''
-        
-        # For each change, we generate a corresponding DDL query and classify whether it requires approval or can be automatically deployed
-        for index, row in df_t.iterrows():
-            if row['ChangeType'] == 'CHANGED DATA TYPE':
-                need_approval = True
-                change = f'{row["ORIGINAL_COLUMN_NAME"]} is changed datatype from {row["OLD_DATA_TYPE"]}({row["OLD_DATA_LENGTH"]}) to {row["NEW_DATA_TYPE"]}({row["NEW_DATA_LENGTH"]})'
-                alter_str = f'alter table {row["Database"]}.{row["TableSchema"]}.{row["TableName"]} alter column {row["ORIGINAL_COLUMN_NAME"]} {row["NEW_DATA_TYPE"]}({row["NEW_DATA_LENGTH"]})'
-            elif row['ChangeType'] == 'ADD NEW COLUMN':
-                change = f'{row["NEW_COLUMN_NAME"]} is added'
-                alter_str = f'alter table {row["Database"]}.{row["TableSchema"]}.{row["TableName"]} add column {row["NEW_COLUMN_NAME"]} {row["NEW_DATA_TYPE"]}'
-            elif row['ChangeType'] == 'RENAME COLUMN':
-                change = f'{row["ORIGINAL_COLUMN_NAME"]} is renamed to {row["NEW_COLUMN_NAME"]}'
-                need_approval = True
-                alter_str = f'alter table {row["Database"]}.{row["TableSchema"]}.{row["TableName"]} rename column {row["ORIGINAL_COLUMN_NAME"]} to {row["NEW_COLUMN_NAME"]}'
-            elif row['ChangeType'] == 'REMOVE COLUMN':
-                change = f'{row["ORIGINAL_COLUMN_NAME"]} is removed'
-                need_approval = True
-                alter_str = f'alter table {row["Database"]}.{row["TableSchema"]}.{row["TableName"]} drop column {row["ORIGINAL_COLUMN_NAME"]}'            
-            alter_statements += alter_str + ';\n'
-            changes += change + ',\n'
-        
-        # Insert DDL query into DDL_HISTORY table
-        if need_approval:
-            insert_ddl_history(schema, table, 'requesting approval', alter_statements, changes, config)
-        else:
-            insert_ddl_history(schema, table, 'pending deployment', alter_statements, changes, config)
-    
     # invoke lambda noti-and-deploy-for-auto-deploy-cases
-    invoke_lambda('arn:aws:lambda:ap-southeast-2:316920261407:function:noti-and-deploy-for-auto-deploy-cases')
+    invoke_lambda(lambda_arn('noti-and-deploy-for-auto-deploy-cases'), json.dumps({'idempotency_key': idempotency_key}))
 
     return {
         'statusCode': 200,
@@ -61,67 +66,171 @@ def lambda_handler(event, context):
     }
 
 
-def read_file_from_s3(bucket_name, file_key) -> None:
-    try:
-        s3_resource = boto3.resource('s3')
-        s3_client = s3_resource.meta.client
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        csv_data = io.BytesIO(response['Body'].read())
-        df = pd.read_csv(csv_data)
-        return df
-    except Exception as e:
-        print("Error when get file from S3")
-        raise e
+def generate_ddl(changes, varchar_policies, held_files, config):
+    # Returns the DDL_HISTORY rows to insert, and the held-back files of the tables that need no DDL
 
-def snowflake_credential(config):
-    try:
-        snowflake_secret = {
-            "user": config[0]['user'] ,
-            "password": config[0]['password'],
-            "account": config[0]['account'],
-            "schema": config[0]['schema'],
-            "warehouse": config[0]['warehouse'],
-            "database": config[0]['database'],
-            "role": config[0]['role'],
-        }
-        return snowflake_secret
+    # Group the changes received from the previous Lambda function by table
+    table_changes = {}
+    for change in changes:
+        table_changes.setdefault((change['Database'], change['TableSchema'], change['TableName']), []).append(change)
 
-    except Exception as e:
-        print('Error')
-        raise e
+    ddl_history = []
+    unblocked = {}
+
+    # Sizing policy per table; the length history is only read for the tables whose policy uses it
+    policies = {key: table_policy(f'{key[1]}.{key[2]}', (varchar_policies or {}).get(f'{key[1]}.{key[2]}')) for key in table_changes}
+    history = length_history([(schema, table) for (database, schema, table), policy in policies.items() if policy[0] in HISTORY_POLICIES], config)
 
+    # For each table, plan the DDL and classify whether it requires approval or can be automatically deployed
+    with span('ddl.plan', tables=len(table_changes), changes=len(changes)) as attributes:
+        for (database, schema, table), rows in table_changes.items():
+            plan = plan_table_ddl(database, schema, table, rows, policies[(database, schema, table)],
+                                  {column: lengths for (history_schema, history_table, column), lengths in history.items()
+                                   if (history_schema, history_table) == (schema, table)})
+            if not plan['statements']:
+                # Nothing to deploy: the files the change held back can be loaded right away
+                if (held_files or {}).get(f'{schema}.{table}'):
+                    unblocked[f'{schema}.{table}'] = held_files[f'{schema}.{table}']
+                continue
+            status = 'requesting approval' if plan['need_approval'] else 'pending deployment'
+            summary = f"Plan: {plan['cost']['statements']} statement(s), {plan['cost']['rewrites']} table rewrite(s), estimated cost {plan['cost']['estimated_cost']}"
+            # The deploying stage loads exactly the files this change held back
+            files = json.dumps((held_files or {}).get(f'{schema}.{table}') or {})
+            ddl_history.append((schema, table, status, ''.join(statement + ';\n' for statement in plan['statements']),
+                                ''.join(change + ',\n' for change in plan['changes']) + summary, plan['cost']['estimated_cost'], files))
+        attributes['statements'] = sum(ddl.count(';\n') for schema, table, status, ddl, summary, cost, files in ddl_history)
+    return ddl_history, unblocked
 
-def run_query(query, config):
+
+def table_policy(table_name, text):
+    # detect-schema-change only sends valid policies; any other event falls back to the default for a bad one
     try:
-        snowflake_secret = snowflake_credential(config)
-        with snowflake.connector.connect(**snowflake_secret) as con:
-            print("connect successfully!")
-            print(f"SQL query: {query}")
-            cur = con.cursor(DictCursor).execute(query)
-            return cur
-            
-    except Exception as e:
-        print("Error")
-        raise e
+        return parse_policy(text)
+    except ValueError as e:
+        print(f"Using the default VARCHAR sizing policy for {table_name}: {e}")
+        return parse_policy(None)
+
+
+def collect_changes(rows):
+    # Deduplicate the change records of one table into one entry per column and kind of change
+    added, removed, renamed, retyped = {}, {}, {}, {}
+    for row in rows:
+        change_type = row['ChangeType']
+        if change_type == 'ADD NEW COLUMN':
+            added[row['NEW_COLUMN_NAME']] = row['NEW_DATA_TYPE']
+        elif change_type == 'REMOVE COLUMN':
+            removed[row['ORIGINAL_COLUMN_NAME']] = True
+        elif change_type == 'RENAME COLUMN':
+            renamed[row['ORIGINAL_COLUMN_NAME']] = row['NEW_COLUMN_NAME']
+        elif change_type == 'CHANGED DATA TYPE':
+            column = retyped.setdefault(row['ORIGINAL_COLUMN_NAME'], {'old_type': row['OLD_DATA_TYPE'], 'old_length': row['OLD_DATA_LENGTH'] or 0,
+                                                                      'type': row['NEW_DATA_TYPE'], 'length': 0})
+            # Text holds any value, so it wins over another target type for the same column
+            if row['NEW_DATA_TYPE'] == 'TEXT':
+                column['type'] = 'TEXT'
+            column['length'] = max(column['length'], row['NEW_DATA_LENGTH'] or 0)
+    return added, removed, renamed, retyped
+
+
+def ddl_type(data_type, length=0):
+    if data_type == 'TEXT' and length:
+        return f'VARCHAR({length})'
+    return DDL_TYPES.get(data_type, data_type)
+
+
+def plan_table_ddl(database, schema, table, rows, policy=None, history=None):
+    # Coalesce the changes of one table into as few statements as possible, in an order that is valid
+    # and rewrites the table at most once:
+    #   1. one ADD for the new columns and the columns that rewrites convert into
+    #   2. one ALTER ... SET DATA TYPE for the VARCHAR columns that only get longer (metadata only)
+    #   3. one UPDATE that fills every rewrite column (the only statement that rewrites the table)
+    #   4. one DROP for the removed columns and the columns that were rewritten
+    #   5. one RENAME per renamed column (Snowflake renames one column per statement)
+    # Text columns get the length the VARCHAR sizing policy picks from the longest value and the
+    # column's length history ({column: lengths}), not just the longest value.
+    policy = policy or parse_policy(None)
+    history = history or {}
+    added, removed, renamed, retyped = collect_changes(rows)
+    name = f'{database}.{schema}.{table}'
+    changes = []
+    add_clauses, widen_clauses, rewrite_assignments, drops = [], [], [], []
+
+    for column, data_type in added.items():
+        add_clauses.append(f'{column} {ddl_type(data_type)}')
+        changes.append(f'{column} is added')
+
+    for column, change in retyped.items():
+        old_type, new_type = change['old_type'], change['type']
+        if column in removed:
+            continue
+        length = change['length']
+        if new_type == 'TEXT' or old_type == 'TEXT':
+            length = widened_length(policy, change['length'], change['old_length'] if old_type == 'TEXT' else 0, history.get(column))
+        if old_type == 'TEXT':
+            # A longer VARCHAR is a metadata-only change; TEXT already accepts numbers
+            if change['length'] <= change['old_length']:
+                continue
+            widen_clauses.append(f'column {column} set data type {ddl_type("TEXT", length)}')
+        elif new_type is None or new_type == old_type or (old_type == 'FLOAT' and new_type == 'NUMBER'):
+            # Nothing to do: the column already holds these values
+            continue
+        else:
+            # Snowflake cannot change NUMBER to FLOAT or to VARCHAR in place: copy into a new column instead
+            target = renamed.pop(column, column)
+            temporary = f'{column}{REWRITE_COLUMN_SUFFIX}'
+            add_clauses.append(f'{temporary} {ddl_type(new_type, length)}')
+            rewrite_assignments.append(f'{temporary} = cast({column} as {ddl_type(new_type, length)})')
+            drops.append(column)
+            renamed[temporary] = target
+            if target != column:
+                changes.append(f'{column} is renamed to {target}')
+        change_text = f'{column} is changed datatype from {change["old_type"]}({change["old_length"]}) to {change["type"]}({change["length"]})'
+        if change['type'] == 'TEXT' and length != change['length']:
+            change_text += f', sized to VARCHAR({length}) by the {policy[0]} policy'
+        changes.append(change_text)
+
+    for column in removed:
+        drops.append(column)
+        changes.append(f'{column} is removed')
+    for column, new_name in renamed.items():
+        if not column.endswith(REWRITE_COLUMN_SUFFIX):
+            changes.append(f'{column} is renamed to {new_name}')
+
+    statements = []
+    if add_clauses:
+        statements.append(f'alter table {name} add column {", ".join(add_clauses)}')
+    if widen_clauses:
+        statements.append(f'alter table {name} alter {", ".join(widen_clauses)}')
+    if rewrite_assignments:
+        statements.append(f'update {name} set {", ".join(rewrite_assignments)}')
+    if drops:
+        statements.append(f'alter table {name} drop column {", ".join(drops)}')
+    for column, new_name in renamed.items():
+        statements.append(f'alter table {name} rename column {column} to {new_name}')
+
+    rewrites = 1 if rewrite_assignments else 0
+    metadata_statements = len(statements) - rewrites
+    return {
+        'statements': statements,
+        'changes': changes,
+        # Only adding columns is deployed without approval
+        'need_approval': bool(widen_clauses or rewrite_assignments or drops or renamed),
+        'cost': {
+            'statements': len(statements),
+            'rewrites': rewrites,
+            'estimated_cost': metadata_statements * METADATA_STATEMENT_COST + rewrites * TABLE_REWRITE_COST,
+        },
+    }
+
 
-    
-def insert_ddl_history(schema, table_name, status, ddl_statement, changes, config):
-    query_insert = f'''
-                    insert into WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY 
-                    (database_name, schema_name, table_name, status, changes, ddl_statement, created_at, updated_at)
-                    values
-                    ('WORMHOLE', '{schema}','{table_name}', '{status}', '{changes}', '{ddl_statement}', sysdate(), sysdate())
-                '''
-    run_query(query_insert, config)
-
-    return query_insert
-
-    
-def invoke_lambda(FunctionName):
-    client = boto3.client('lambda')
-
-    res = client.invoke(
-        	FunctionName = FunctionName,
-        	InvocationType = 'RequestResponse',
-        )
-    return None
\ No newline at end of file
+def insert_ddl_history(ddl_history, config):
+    # ddl_history holds (schema, table_name, status, ddl_statement, changes, estimated_cost, files) tuples.
+    # Every row is also put on DDL_QUEUE, where the next stage claims it.
+    current_time = datetime.datetime.now()
+    ids = next_ids(len(ddl_history), config)
+    columns = ['id', 'database_name', 'schema_name', 'table_name', 'status', 'changes', 'ddl_statement', 'estimated_cost', 'files', 'created_at', 'updated_at']
+    rows = [(ddl_id, 'WORMHOLE', schema, table_name, status, changes, ddl_statement, estimated_cost, files, current_time, current_time)
+            for ddl_id, (schema, table_name, status, ddl_statement, changes, estimated_cost, files) in zip(ids, ddl_history)]
+    inserted = insert_rows('WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY', columns, rows, config)
+    enqueue([(row[0], row[4]) for row in rows], config)
+    return inserted
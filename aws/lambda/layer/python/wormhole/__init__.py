@@ -0,0 +1,6 @@
+"""Shared helpers for the wormhole Lambdas, deployed as a Lambda layer.
+
+The submodules are imported explicitly by the handlers (for example
+``from wormhole.sql import run_query``); nothing is imported here, so a
+handler only loads what it uses.
+"""
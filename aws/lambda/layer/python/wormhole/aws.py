@@ -0,0 +1,33 @@
+"""Cached boto3 clients and the names of the pipeline's AWS resources."""
+import threading
+
+import boto3
+
+BUCKET = 'wormholeltd-bucket'
+LAMBDA_ARN = 'arn:aws:lambda:ap-southeast-2:316920261407:function:{}'
+
+# One client per service for the life of the container. Creating clients on the default session is
+# not thread-safe, so creation is serialized; the clients themselves can be shared between threads.
+clients = {}
+clients_lock = threading.Lock()
+
+
+def client(service_name):
+    if service_name not in clients:
+        with clients_lock:
+            if service_name not in clients:
+                clients[service_name] = boto3.client(service_name)
+    return clients[service_name]
+
+
+def worker_client(service_name):
+    # For a forked worker process: a botocore client would share the parent's pooled connections, so it
+    # is rebuilt in the child (stand-ins without botocore metadata are kept)
+    existing = client(service_name)
+    if hasattr(existing, 'meta'):
+        clients[service_name] = boto3.client(service_name, region_name=existing.meta.region_name)
+    return clients[service_name]
+
+
+def lambda_arn(function_name):
+    return LAMBDA_ARN.format(function_name)
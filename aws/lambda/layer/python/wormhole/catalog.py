@@ -0,0 +1,104 @@
+"""Snapshot of the monitored tables' column metadata, shared between stages.
+
+detect-schema-change keeps the columns of every monitored table in memory and
+mirrors them to a compact JSON snapshot. The deploy stages replace the snapshot
+with an empty one after altering a table, so every container reads the table
+again. Snapshot writes are conditional on the ETag the container last saw, so
+columns read before a DDL can never overwrite a later invalidation.
+"""
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+from wormhole.aws import client
+from wormhole.instrumentation import count
+
+SCHEMA_CATALOG_SNAPSHOT_KEY = 'config/schema-catalog.json'
+# Set to keep the snapshot in a local file instead of S3 (offline runs)
+SCHEMA_CATALOG_SNAPSHOT_PATH = os.environ.get('SCHEMA_CATALOG_SNAPSHOT_PATH')
+schema_catalog = {'tables': {}, 'snapshot_etag': None, 'checked_at': 0.0}
+
+
+def load_schema_catalog_snapshot(bucket_name):
+    # Pick up a snapshot written by another container, or drop everything if a deploy invalidated it
+    try:
+        if SCHEMA_CATALOG_SNAPSHOT_PATH:
+            if not os.path.exists(SCHEMA_CATALOG_SNAPSHOT_PATH):
+                raise FileNotFoundError(SCHEMA_CATALOG_SNAPSHOT_PATH)
+            etag = str(os.path.getmtime(SCHEMA_CATALOG_SNAPSHOT_PATH))
+            if etag == schema_catalog['snapshot_etag']:
+                return
+            with open(SCHEMA_CATALOG_SNAPSHOT_PATH) as f:
+                body = f.read()
+        else:
+            if schema_catalog['snapshot_etag']:
+                response = client('s3').get_object(Bucket=bucket_name, Key=SCHEMA_CATALOG_SNAPSHOT_KEY, IfNoneMatch=schema_catalog['snapshot_etag'])
+            else:
+                response = client('s3').get_object(Bucket=bucket_name, Key=SCHEMA_CATALOG_SNAPSHOT_KEY)
+            etag = response['ETag']
+            body = response['Body'].read()
+    except ClientError as e:
+        status = e.response['ResponseMetadata']['HTTPStatusCode']
+        if status == 304:
+            return
+        if status != 404:
+            print("Error when get file from S3")
+            raise e
+        schema_catalog['tables'] = {}
+        schema_catalog['snapshot_etag'] = None
+        return
+    except FileNotFoundError:
+        schema_catalog['tables'] = {}
+        schema_catalog['snapshot_etag'] = None
+        return
+    schema_catalog['tables'] = json.loads(body)
+    schema_catalog['snapshot_etag'] = etag
+
+
+def save_schema_catalog_snapshot(bucket_name):
+    # Only replace the snapshot this container last read or wrote (or create it if there was none). When a deploy
+    # invalidated it or another container replaced it since, the write is skipped and the next refresh reads it
+    # again; returns whether the snapshot was written.
+    body = json.dumps(schema_catalog['tables'], separators=(',', ':'))
+    if SCHEMA_CATALOG_SNAPSHOT_PATH:
+        current = str(os.path.getmtime(SCHEMA_CATALOG_SNAPSHOT_PATH)) if os.path.exists(SCHEMA_CATALOG_SNAPSHOT_PATH) else None
+        if current != schema_catalog['snapshot_etag']:
+            return skip_stale_snapshot()
+        with open(SCHEMA_CATALOG_SNAPSHOT_PATH, 'w') as f:
+            f.write(body)
+        schema_catalog['snapshot_etag'] = str(os.path.getmtime(SCHEMA_CATALOG_SNAPSHOT_PATH))
+        return True
+    condition = {'IfMatch': schema_catalog['snapshot_etag']} if schema_catalog['snapshot_etag'] else {'IfNoneMatch': '*'}
+    try:
+        response = client('s3').put_object(Bucket=bucket_name, Key=SCHEMA_CATALOG_SNAPSHOT_KEY, Body=body.encode('utf-8'), **condition)
+    except ClientError as e:
+        # 412: the ETag changed; 404: IfMatch on a snapshot that is gone; 409: a concurrent conditional write
+        if e.response['ResponseMetadata']['HTTPStatusCode'] not in (404, 409, 412):
+            print("Error when put file to S3")
+            raise e
+        return skip_stale_snapshot()
+    schema_catalog['snapshot_etag'] = response['ETag']
+    return True
+
+
+def skip_stale_snapshot():
+    # Keep the columns this invocation works with, but read the snapshot again on the next refresh
+    count('catalog.snapshot.conflict')
+    schema_catalog['snapshot_etag'] = None
+    schema_catalog['checked_at'] = 0.0
+    return False
+
+
+def invalidate_schema_catalog(bucket_name):
+    # Replace the snapshot with an empty one, so the altered table is read again by detect-schema-change.
+    # Unlike a delete, this changes the ETag, so a container that read the old snapshot cannot write it back.
+    try:
+        if SCHEMA_CATALOG_SNAPSHOT_PATH:
+            with open(SCHEMA_CATALOG_SNAPSHOT_PATH, 'w') as f:
+                f.write('{}')
+        else:
+            client('s3').put_object(Bucket=bucket_name, Key=SCHEMA_CATALOG_SNAPSHOT_KEY, Body=b'{}')
+    except Exception as e:
+        print("Error when put file to S3")
+        raise e
@@ -0,0 +1,47 @@
+"""Snowflake and Slack settings, loaded once per container."""
+import csv
+import io
+import json
+import os
+from time import monotonic
+
+from botocore.exceptions import ClientError
+
+from wormhole.aws import BUCKET, client
+from wormhole.instrumentation import span
+
+# The settings are revalidated with a conditional GET every CONFIG_TTL_SECONDS. With CONFIG_SECRET_ID
+# set they are read from Secrets Manager instead (a JSON object with the same keys as the CSV).
+CONFIG_KEY = 'config/config-snowflake.csv'
+CONFIG_TTL_SECONDS = int(os.environ.get('CONFIG_TTL_SECONDS', '300'))
+CONFIG_SECRET_ID = os.environ.get('CONFIG_SECRET_ID')
+config_cache = {'config': None, 'etag': None, 'checked_at': 0.0}
+
+
+def load_config(bucket_name=BUCKET, file_key=CONFIG_KEY):
+    # Returns the rows of the config as a list of dicts; handlers use config[0]
+    if config_cache['config'] is not None and monotonic() - config_cache['checked_at'] < CONFIG_TTL_SECONDS:
+        return config_cache['config']
+    with span('config.load', revalidate=config_cache['config'] is not None):
+        try:
+            if CONFIG_SECRET_ID:
+                secret = json.loads(client('secretsmanager').get_secret_value(SecretId=CONFIG_SECRET_ID)['SecretString'])
+                config = secret if isinstance(secret, list) else [secret]
+            else:
+                if config_cache['etag']:
+                    response = client('s3').get_object(Bucket=bucket_name, Key=file_key, IfNoneMatch=config_cache['etag'])
+                else:
+                    response = client('s3').get_object(Bucket=bucket_name, Key=file_key)
+                config = list(csv.DictReader(io.StringIO(response['Body'].read().decode('utf-8'))))
+                config_cache['etag'] = response['ETag']
+        except ClientError as e:
+            if e.response['ResponseMetadata']['HTTPStatusCode'] != 304:
+                print("Error when load config")
+                raise e
+            # Not modified since the last load
+            config = config_cache['config']
+        except Exception as e:
+            print("Error when load config")
+            raise e
+    config_cache.update(config=config, checked_at=monotonic())
+    return config
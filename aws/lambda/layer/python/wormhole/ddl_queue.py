@@ -0,0 +1,94 @@
+"""Work queue over DDL_HISTORY.
+
+DDL_HISTORY keeps every planned DDL. DDL_QUEUE only holds the rows that a
+stage still has to act on, so polling reads the pending work and never the
+whole history. A worker claims rows with a single UPDATE that sets a lease
+(its request ID and an expiry time). Snowflake runs concurrent UPDATEs on a
+table one at a time, so two invocations never hold the same row. If a worker
+dies, its rows can be claimed again once the lease expires. Rows leave the
+queue when they reach a final status.
+"""
+import datetime
+import os
+
+from wormhole.sql import run_query
+
+HISTORY_TABLE = 'WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY'
+QUEUE_TABLE = 'WORMHOLE.SCHEMA_MANAGEMENT.DDL_QUEUE'
+ID_SEQUENCE = 'WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY_ID_SEQ'
+# How long a claim is held before another worker may take the row over
+LEASE_SECONDS = int(os.environ.get('DDL_QUEUE_LEASE_SECONDS', '900'))
+# Rows claimed this many times without moving on are left for an operator
+MAX_ATTEMPTS = int(os.environ.get('DDL_QUEUE_MAX_ATTEMPTS', '5'))
+# Statuses after which a DDL needs no more work
+FINAL_STATUSES = {'done deployment', 'failed deployment', 'deny deployment'}
+# Columns of DDL_HISTORY the stages need from a claimed row
+CLAIM_COLUMNS = ['ID', 'DATABASE_NAME', 'SCHEMA_NAME', 'TABLE_NAME', 'DDL_STATEMENT', 'ESTIMATED_COST', 'FILES']
+
+
+def affected_rows(result):
+    # DML returns one row whose first column is the number of rows inserted, updated or deleted
+    return next(iter(result[0].values())) if result else 0
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def next_ids(count, config):
+    # Take the IDs of new DDL_HISTORY rows from its sequence, so the queue rows can reference them
+    if not count:
+        return []
+    rows = run_query(f"select {ID_SEQUENCE}.nextval as ID from table(generator(rowcount => {int(count)}));", config)
+    return [row['ID'] for row in rows]
+
+
+def enqueue(items, config):
+    # items: (ID, STATUS) of DDL_HISTORY rows that were just inserted
+    if not items:
+        return 0
+    now = datetime.datetime.now()
+    query = f"insert into {QUEUE_TABLE} (ID, STATUS, ATTEMPTS, ENQUEUED_AT) values " + ', '.join(['(%s, %s, 0, %s)'] * len(items))
+    return affected_rows(run_query(query, config, [value for ddl_id, status in items for value in (ddl_id, status, now)]))
+
+
+def claim(status, owner, config, ddl_id=None):
+    # Lease the free rows in this status (or only ddl_id) to owner; returns their CLAIM_COLUMNS in ID order
+    now = datetime.datetime.now()
+    query = (f"update {QUEUE_TABLE} set LEASE_OWNER = %s, LEASE_EXPIRES_AT = %s, ATTEMPTS = ATTEMPTS + 1 "
+             f"where STATUS = %s and ATTEMPTS < %s and (LEASE_EXPIRES_AT is null or LEASE_EXPIRES_AT < %s)")
+    params = [owner, now + datetime.timedelta(seconds=LEASE_SECONDS), status, MAX_ATTEMPTS, now]
+    if ddl_id is not None:
+        query += " and ID = %s"
+        params.append(ddl_id)
+    if not affected_rows(run_query(query + ";", config, params)):
+        return []
+    columns = ', '.join(f'h.{column}' for column in CLAIM_COLUMNS)
+    return run_query(f"select {columns} from {QUEUE_TABLE} q join {HISTORY_TABLE} h on h.ID = q.ID "
+                     f"where q.LEASE_OWNER = %s and q.STATUS = %s order by h.ID;", config, (owner, status))
+
+
+def move(ids, owner, status, config):
+    # Set the status of rows still leased to owner; final rows leave the queue, the others are released
+    if not ids:
+        return 0
+    now = datetime.datetime.now()
+    moved = affected_rows(run_query(
+        f"update {HISTORY_TABLE} set STATUS = %s, UPDATED_AT = %s where ID in "
+        f"(select ID from {QUEUE_TABLE} where LEASE_OWNER = %s and ID in ({placeholders(ids)}));",
+        config, [status, now, owner, *ids]))
+    if status in FINAL_STATUSES:
+        run_query(f"delete from {QUEUE_TABLE} where LEASE_OWNER = %s and ID in ({placeholders(ids)});", config, [owner, *ids])
+    else:
+        run_query(f"update {QUEUE_TABLE} set STATUS = %s, LEASE_OWNER = null, LEASE_EXPIRES_AT = null, ATTEMPTS = 0 "
+                  f"where LEASE_OWNER = %s and ID in ({placeholders(ids)});", config, [status, owner, *ids])
+    return moved
+
+
+def release(ids, owner, config):
+    # Give claimed rows back without changing their status, e.g. the rows after a failed deployment
+    if not ids:
+        return 0
+    return affected_rows(run_query(
+        f"update {QUEUE_TABLE} set LEASE_OWNER = null, LEASE_EXPIRES_AT = null "
+        f"where LEASE_OWNER = %s and ID in ({placeholders(ids)});", config, [owner, *ids]))
@@ -0,0 +1,160 @@
+"""Spans and metrics for the pipeline's remote calls and hot paths.
+
+Every span adds to per-invocation metrics (count, errors, duration, bytes per
+span name), which are exported once at the end of the invocation as a
+CloudWatch Embedded Metric Format (EMF) document. The individual spans, with
+their attributes (bytes, rows, query IDs, ...), are only kept for a sampled
+share of invocations (INSTRUMENTATION_SAMPLE_RATE), so an unsampled span
+costs two clock reads and a dict update.
+
+The exporter is pluggable: set INSTRUMENTATION_EXPORTER to 'emf' (default),
+'json' or 'none', or call set_exporter() with a function taking
+(metrics, spans).
+"""
+import json
+import os
+import random
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter, time
+
+NAMESPACE = os.environ.get('INSTRUMENTATION_NAMESPACE', 'Wormhole')
+INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', '0.1'))
+INSTRUMENTATION_EXPORTER = os.environ.get('INSTRUMENTATION_EXPORTER', 'emf')
+# Spans beyond this are counted in the metrics but not exported, to keep log events small
+MAX_EXPORTED_SPANS = 500
+
+# State of the current invocation; spans can be recorded from worker threads too
+invocation = {'stage': None, 'trace_id': None, 'sampled': False, 'metrics': {}, 'spans': [], 'dropped_spans': 0}
+invocation_lock = threading.Lock()
+span_stack = threading.local()
+# Callables run after every span as hook(name, elapsed_ms, attributes, error)
+hooks = []
+
+
+def add_hook(hook):
+    hooks.append(hook)
+
+
+def start_invocation(stage, trace_id=None, sampled=None):
+    with invocation_lock:
+        invocation.update(stage=stage, trace_id=trace_id, metrics={}, spans=[], dropped_spans=0,
+                          sampled=random.random() < INSTRUMENTATION_SAMPLE_RATE if sampled is None else sampled)
+
+
+def is_sampled():
+    return invocation['sampled']
+
+
+def record_metric(name, value, unit):
+    with invocation_lock:
+        metric = invocation['metrics'].get(name)
+        if metric is None:
+            invocation['metrics'][name] = [value, unit]
+        else:
+            metric[0] += value
+
+
+def count(name, value=1):
+    record_metric(name, value, 'Count')
+
+
+@contextmanager
+def span(name, **attributes):
+    # Yields the attribute dict, so the body can add what it learns (bytes, rows, query_id, ...)
+    sampled = invocation['sampled']
+    if sampled:
+        stack = span_stack.__dict__.setdefault('names', [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        started_at = time()
+    started = perf_counter()
+    error = None
+    try:
+        yield attributes
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        elapsed_ms = (perf_counter() - started) * 1000
+        with invocation_lock:
+            metrics = invocation['metrics']
+            for metric, value, unit in ((f'{name}.Count', 1, 'Count'), (f'{name}.Errors', int(error is not None), 'Count'),
+                                        (f'{name}.Duration', elapsed_ms, 'Milliseconds'), (f'{name}.Bytes', attributes.get('bytes'), 'Bytes')):
+                if value is None:
+                    continue
+                if metric in metrics:
+                    metrics[metric][0] += value
+                else:
+                    metrics[metric] = [value, unit]
+            if sampled:
+                if len(invocation['spans']) < MAX_EXPORTED_SPANS:
+                    invocation['spans'].append(dict(attributes, name=name, parent=parent, start=round(started_at, 6),
+                                                    duration_ms=round(elapsed_ms, 3), error=None if error is None else repr(error)))
+                else:
+                    invocation['dropped_spans'] += 1
+        if sampled:
+            stack.pop()
+        for hook in hooks:
+            hook(name, elapsed_ms, attributes, error)
+
+
+def emf_document(metrics):
+    return {
+        '_aws': {
+            'Timestamp': int(time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['Stage']],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, (value, unit) in sorted(metrics.items())],
+            }],
+        },
+        'Stage': invocation['stage'],
+        'TraceId': invocation['trace_id'],
+        **{name: round(value, 3) for name, (value, unit) in metrics.items()},
+    }
+
+
+def export_emf(metrics, spans):
+    print(json.dumps(emf_document(metrics), default=str))
+    if spans:
+        print(json.dumps({'Stage': invocation['stage'], 'TraceId': invocation['trace_id'], 'Spans': spans,
+                          'DroppedSpans': invocation['dropped_spans']}, default=str))
+
+
+def export_json(metrics, spans):
+    print(json.dumps({'Stage': invocation['stage'], 'TraceId': invocation['trace_id'],
+                      'Metrics': {name: round(value, 3) for name, (value, unit) in metrics.items()},
+                      'Spans': spans, 'DroppedSpans': invocation['dropped_spans']}, default=str))
+
+
+EXPORTERS = {'emf': export_emf, 'json': export_json, 'none': lambda metrics, spans: None}
+exporter = {'export': EXPORTERS[INSTRUMENTATION_EXPORTER]}
+
+
+def set_exporter(export):
+    exporter['export'] = export
+
+
+def flush():
+    with invocation_lock:
+        metrics, spans = invocation['metrics'], invocation['spans'] if invocation['sampled'] else []
+        invocation.update(metrics={}, spans=[])
+    if metrics or spans:
+        exporter['export'](metrics, spans)
+
+
+def instrumented(stage):
+    # Decorator for lambda_handler: one trace per invocation, exported when the handler returns or raises
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(event, context):
+            start_invocation(stage, getattr(context, 'aws_request_id', None))
+            try:
+                with span(f'{stage}.handler'):
+                    return handler(event, context)
+            finally:
+                flush()
+        return wrapper
+    return decorator
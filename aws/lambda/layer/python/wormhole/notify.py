@@ -0,0 +1,67 @@
+"""Slack webhook client shared by the approval and deployment stages."""
+import http.client
+import json
+import os
+from time import sleep
+from urllib.parse import urlsplit
+
+from wormhole.config import load_config
+from wormhole.instrumentation import span
+
+# The HTTP connection is kept alive across messages and warm invocations
+SLACK_MAX_RETRIES = int(os.environ.get('SLACK_MAX_RETRIES', '3'))
+SLACK_TIMEOUT_SECONDS = 10
+slack_client = {'connection': None, 'netloc': None}
+
+
+def get_slack_webhook_url():
+    return load_config()[0]['slack_webhook_url']
+
+
+def get_slack_connection(url):
+    if slack_client['connection'] is None or slack_client['netloc'] != url.netloc:
+        close_slack_connection()
+        # http:// is only expected for a local stub webhook
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        slack_client['connection'] = connection_class(url.netloc, timeout=SLACK_TIMEOUT_SECONDS)
+        slack_client['netloc'] = url.netloc
+    return slack_client['connection']
+
+
+def close_slack_connection():
+    if slack_client['connection'] is not None:
+        slack_client['connection'].close()
+    slack_client['connection'] = None
+
+
+def sent_to_slack(slack_message):
+    try:
+        url = urlsplit(get_slack_webhook_url())
+        path = url.path + ('?' + url.query if url.query else '')
+        body = json.dumps(slack_message).encode('utf-8')
+        with span('slack.post', bytes=len(body)) as attributes:
+            for attempt in range(SLACK_MAX_RETRIES + 1):
+                attributes['attempts'] = attempt + 1
+                try:
+                    con = get_slack_connection(url)
+                    con.request('POST', path, body, {'Content-Type': 'application/json'})
+                    response = con.getresponse()
+                    response_body = response.read()
+                except (http.client.HTTPException, OSError):
+                    # The server closed the kept-alive connection: reconnect and send again
+                    close_slack_connection()
+                    if attempt == SLACK_MAX_RETRIES:
+                        raise
+                    continue
+                if response.will_close:
+                    close_slack_connection()
+                if response.status == 429 and attempt < SLACK_MAX_RETRIES:
+                    # Rate limited: wait as long as Slack asks, or back off exponentially
+                    sleep(float(response.getheader('Retry-After') or 2 ** attempt))
+                    continue
+                if response.status >= 400:
+                    raise Exception(f"Slack webhook returned {response.status}: {response_body.decode('utf-8', 'replace')}")
+                return None
+    except Exception as e:
+        print('Error')
+        raise e
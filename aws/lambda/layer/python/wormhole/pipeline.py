@@ -0,0 +1,58 @@
+"""Hand-offs between the stages and per-stage idempotency.
+
+Stages are chained with asynchronous 'Event' invokes. When PIPELINE_QUEUE_DIR
+is set, each message is written to that directory instead, so the chain can be
+run offline with tools/step_runner.py.
+"""
+import os
+from time import time_ns
+
+from botocore.exceptions import ClientError
+
+from wormhole.aws import BUCKET, client
+from wormhole.instrumentation import span
+
+PIPELINE_QUEUE_DIR = os.environ.get('PIPELINE_QUEUE_DIR')
+
+
+def invoke_lambda(FunctionName, Payload):
+    if PIPELINE_QUEUE_DIR:
+        function_name = FunctionName.split(':')[-1]
+        with open(os.path.join(PIPELINE_QUEUE_DIR, f'{time_ns()}-{function_name}.json'), 'w') as f:
+            f.write(Payload)
+        return Payload
+
+    with span('lambda.invoke', function=FunctionName.split(':')[-1], bytes=len(Payload)):
+        client('lambda').invoke(
+            FunctionName = FunctionName,
+            InvocationType = 'Event',
+            Payload = Payload
+        )
+    return Payload
+
+
+def claim_idempotency_key(stage, idempotency_key):
+    # Atomically record that this stage has started on the change set; False if another invocation already did
+    try:
+        if PIPELINE_QUEUE_DIR:
+            os.makedirs(os.path.join(PIPELINE_QUEUE_DIR, 'idempotency'), exist_ok=True)
+            open(os.path.join(PIPELINE_QUEUE_DIR, 'idempotency', f'{stage}-{idempotency_key}'), 'x').close()
+        else:
+            client('s3').put_object(Bucket=BUCKET, Key=f'config/idempotency/{stage}/{idempotency_key}', Body=b'', IfNoneMatch='*')
+        return True
+    except FileExistsError:
+        return False
+    except ClientError as e:
+        if e.response['ResponseMetadata']['HTTPStatusCode'] in (409, 412):
+            return False
+        raise e
+
+
+def release_idempotency_key(stage, idempotency_key):
+    # Called when the stage fails, so that a retry of the same change set is not skipped
+    if PIPELINE_QUEUE_DIR:
+        path = os.path.join(PIPELINE_QUEUE_DIR, 'idempotency', f'{stage}-{idempotency_key}')
+        if os.path.exists(path):
+            os.remove(path)
+    else:
+        client('s3').delete_object(Bucket=BUCKET, Key=f'config/idempotency/{stage}/{idempotency_key}')
@@ -0,0 +1,70 @@
+"""Seekable, read-only file over an S3 object, backed by ranged GETs.
+
+Columnar formats keep their schema in a footer at the end of the object, so a
+reader such as pyarrow only needs a few small reads. The first request is a
+suffix range, which returns the object size and its last TAIL_BYTES at once;
+for most Parquet and ORC files the whole footer is in it.
+"""
+import io
+
+# Bytes fetched from the end of the object when the file is opened
+TAIL_BYTES = 64 * 1024
+# Minimum size of any other ranged GET, so several small reads share one request
+READ_AHEAD_BYTES = 64 * 1024
+
+
+class S3RangeFile(io.RawIOBase):
+    def __init__(self, s3_client, bucket_name, file_key):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.file_key = file_key
+        self.position = 0
+        self.requests = 0
+        self.bytes_read = 0
+        response = self.get_range(f'bytes=-{TAIL_BYTES}')
+        self.size = int(response['ContentRange'].split('/')[-1])
+        self.buffer = response['Body'].read()
+        self.buffer_start = self.size - len(self.buffer)
+        self.bytes_read += len(self.buffer)
+
+    def get_range(self, byte_range):
+        self.requests += 1
+        return self.s3_client.get_object(Bucket=self.bucket_name, Key=self.file_key, Range=byte_range)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        else:
+            raise ValueError(f'invalid whence: {whence}')
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if end <= self.position:
+            return b''
+        if not (self.buffer_start <= self.position and end <= self.buffer_start + len(self.buffer)):
+            fetch_end = min(max(end, self.position + READ_AHEAD_BYTES), self.size)
+            self.buffer = self.get_range(f'bytes={self.position}-{fetch_end - 1}')['Body'].read()
+            self.buffer_start = self.position
+            self.bytes_read += len(self.buffer)
+        data = self.buffer[self.position - self.buffer_start:end - self.buffer_start]
+        self.position += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
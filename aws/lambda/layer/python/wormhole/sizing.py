@@ -0,0 +1,143 @@
+"""VARCHAR sizing policies for widened text columns.
+
+Widening a column to exactly the longest value seen means the next, slightly
+longer value needs another detect, approve and deploy cycle. A policy picks
+the new length instead, with some headroom:
+
+- exact: the longest value seen (the old behaviour)
+- geometric[:factor]: the current length times factor (default 2) until it fits
+- percentile[:p[:margin]]: the p-th percentile (default 95) of the lengths
+  recorded for the column in CHANGE_HISTORY, plus margin (default 0.25)
+- max: VARCHAR(16777216), so the column never needs widening again
+
+Policies are written as in the varchar_policy column of
+config/monitored-tables.csv; VARCHAR_SIZING_POLICY is the default.
+replay() runs a policy over CHANGE_HISTORY to count the approvals it saves.
+"""
+import math
+import os
+
+from wormhole.sql import run_query
+
+MAX_VARCHAR_LENGTH = 16777216
+DEFAULT_POLICY = os.environ.get('VARCHAR_SIZING_POLICY', 'geometric')
+# Policies that look at the column's length history
+HISTORY_POLICIES = {'percentile'}
+
+
+def exact_length(observed, current, history):
+    return observed
+
+
+def geometric_length(observed, current, history, factor=2.0):
+    length = max(current, 1)
+    while length < observed:
+        length = math.ceil(length * factor)
+    return length
+
+
+def percentile_length(observed, current, history, p=95.0, margin=0.25):
+    lengths = sorted(history or [observed])
+    rank = lengths[max(0, min(len(lengths) - 1, math.ceil(len(lengths) * p / 100) - 1))]
+    return math.ceil(max(rank, observed) * (1 + margin))
+
+
+def max_length(observed, current, history):
+    return MAX_VARCHAR_LENGTH
+
+
+POLICIES = {
+    'exact': exact_length,
+    'geometric': geometric_length,
+    'percentile': percentile_length,
+    'max': max_length,
+}
+
+
+# Arguments each policy takes, in order, as (name, rule, check)
+POLICY_ARGUMENTS = {
+    'exact': [],
+    'geometric': [('factor', 'greater than 1', lambda factor: factor > 1)],
+    'percentile': [('p', 'in (0, 100]', lambda p: 0 < p <= 100), ('margin', 'at least 0', lambda margin: margin >= 0)],
+    'max': [],
+}
+
+
+def parse_policy(text):
+    # 'percentile:90:0.5' -> ('percentile', [90.0, 0.5]); empty means the default policy.
+    # Policies come from an editable CSV, so bad arguments are rejected here (a geometric factor <= 1 never grows).
+    name, *arguments = (text or DEFAULT_POLICY).strip().lower().split(':')
+    if name not in POLICIES:
+        raise ValueError(f'Unknown VARCHAR sizing policy: {text}')
+    if len(arguments) > len(POLICY_ARGUMENTS[name]):
+        raise ValueError(f'Too many arguments for VARCHAR sizing policy {name}: {text}')
+    try:
+        values = [float(argument) for argument in arguments]
+    except ValueError:
+        raise ValueError(f'VARCHAR sizing policy arguments must be numbers: {text}')
+    for value, (argument, rule, check) in zip(values, POLICY_ARGUMENTS[name]):
+        if not math.isfinite(value) or not check(value):
+            raise ValueError(f'VARCHAR sizing policy {name}: {argument} must be {rule}, got {text}')
+    return name, values
+
+
+def widened_length(policy, observed, current=0, history=None):
+    # New declared length for a text column whose longest value is observed; never shorter than the values
+    name, arguments = policy
+    length = POLICIES[name](observed, current or 0, history, *arguments)
+    return min(max(length, observed), MAX_VARCHAR_LENGTH)
+
+
+def length_history(tables, config):
+    # Lengths that made each column of these (schema, table) pairs wider, from CHANGE_HISTORY:
+    # {(schema, table, column): [lengths]}
+    if not tables:
+        return {}
+    conditions = ' or '.join(['(SCHEMA_NAME = %s and TABLE_NAME = %s)'] * len(tables))
+    rows = run_query(
+        "select SCHEMA_NAME, TABLE_NAME, OLD_COLUMN_NAME, NEW_DATA_LENGTH from WORMHOLE.SCHEMA_MANAGEMENT.CHANGE_HISTORY "
+        f"where CHANGE_TYPE = 'CHANGED DATA TYPE' and NEW_DATA_TYPE = 'TEXT' and ({conditions}) order by ID;",
+        config, [value for table in tables for value in table])
+    history = {}
+    for row in rows:
+        history.setdefault((row['SCHEMA_NAME'], row['TABLE_NAME'], row['OLD_COLUMN_NAME']), []).append(int(row['NEW_DATA_LENGTH'] or 0))
+    return history
+
+
+def replay(change_history, policy):
+    # change_history: CHANGE_HISTORY rows as dicts, in ID order. Each detection run wrote the changes of a
+    # table with one CREATED_AT and needed one approval if any change was more than an added column.
+    # Replaying the policy, a run is saved when all its text widenings already fit the replayed length.
+    declared, history = {}, {}
+    runs = {}
+    for row in change_history:
+        runs.setdefault((row['DATABASE_NAME'], row['SCHEMA_NAME'], row['TABLE_NAME'], row['CREATED_AT']), []).append(row)
+    approvals = replayed_approvals = widenings = 0
+    for (database, schema, table, created_at), rows in runs.items():
+        needs_approval = False
+        for row in rows:
+            change_type = row['CHANGE_TYPE']
+            if change_type == 'ADD NEW COLUMN':
+                continue
+            if change_type != 'CHANGED DATA TYPE' or row['OLD_DATA_TYPE'] != 'TEXT':
+                needs_approval = True
+                continue
+            column = (database, schema, table, row['OLD_COLUMN_NAME'])
+            observed = int(float(row['NEW_DATA_LENGTH'] or 0))
+            history.setdefault(column, []).append(observed)
+            current = declared.get(column, int(float(row['OLD_DATA_LENGTH'] or 0)))
+            if observed > current:
+                needs_approval = True
+                widenings += 1
+                declared[column] = widened_length(policy, observed, current, history[column])
+        approvals += 1 if any(row['CHANGE_TYPE'] != 'ADD NEW COLUMN' for row in rows) else 0
+        replayed_approvals += needs_approval
+    return {
+        'policy': ':'.join([policy[0], *(f'{argument:g}' for argument in policy[1])]),
+        'runs': len(runs),
+        'approvals': approvals,
+        'replayed_approvals': replayed_approvals,
+        'approvals_saved': approvals - replayed_approvals,
+        'widenings': widenings,
+        'largest_length': max(declared.values(), default=0),
+    }
@@ -0,0 +1,216 @@
+"""Pooled Snowflake sessions and the statement helpers used by every stage.
+
+snowflake.connector (and pandas, for bulk inserts) are imported on first
+use, so a cold start only pays for them when SQL is actually run.
+"""
+import json
+import threading
+from time import monotonic
+
+from wormhole.instrumentation import count, is_sampled, span
+
+# Reuse one Snowflake session per thread (a handler's main thread or a worker) instead of logging in for every statement
+SESSION_HEALTH_CHECK_SECONDS = 300
+# Error codes Snowflake returns when a session or its token has expired
+SESSION_EXPIRED_ERRNOS = {390111, 390112, 390114}
+snowflake_session = threading.local()
+# Statement text kept on sampled spans is cut to this length
+SPAN_QUERY_LENGTH = 200
+
+# Batches larger than this are staged with write_pandas (PUT + COPY) instead of a bound multi-row insert
+BULK_INSERT_STAGE_THRESHOLD = 1000
+
+
+def snowflake_credential(config):
+    return {
+        "user": config[0]['user'],
+        "password": config[0]['password'],
+        "account": config[0]['account'],
+        "schema": config[0]['schema'],
+        "warehouse": config[0]['warehouse'],
+        "database": config[0]['database'],
+        "role": config[0]['role'],
+    }
+
+
+def get_connection(config):
+    import snowflake.connector
+    con = getattr(snowflake_session, 'connection', None)
+    if con is not None and not con.is_closed() and is_session_healthy(con):
+        count('snowflake.session.reused')
+    else:
+        close_connection()
+        with span('snowflake.connect'):
+            con = snowflake.connector.connect(**snowflake_credential(config), client_session_keep_alive=True)
+        snowflake_session.connection = con
+    snowflake_session.last_used = monotonic()
+    return con
+
+
+def is_session_healthy(con):
+    # Only ping the server when the session has been idle for a while
+    if monotonic() - getattr(snowflake_session, 'last_used', 0.0) < SESSION_HEALTH_CHECK_SECONDS:
+        return True
+    try:
+        with con.cursor() as cur:
+            cur.execute('select 1')
+        return True
+    except Exception:
+        return False
+
+
+def close_connection():
+    con = getattr(snowflake_session, 'connection', None)
+    snowflake_session.connection = None
+    if con is not None:
+        try:
+            con.close()
+        except Exception:
+            pass
+
+
+def with_session(config, action):
+    # Run action(connection); if the session expired after the health check, log in again once and retry
+    import snowflake.connector
+    try:
+        return action(get_connection(config))
+    except snowflake.connector.errors.DatabaseError as e:
+        if e.errno not in SESSION_EXPIRED_ERRNOS:
+            raise
+        close_connection()
+        count('snowflake.session.reconnected')
+        return action(get_connection(config))
+
+
+def fetch_rows(con, query, params=None, attributes=None):
+    from snowflake.connector import DictCursor
+    with con.cursor(DictCursor) as cur:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        if attributes is not None:
+            attributes.update(query_id=cur.sfqid, rows=len(rows))
+        return rows
+
+
+def run_query(query, config, params=None):
+    # Returns the result rows as dicts; the cursor is closed before returning
+    try:
+        with span('snowflake.query', query=query[:SPAN_QUERY_LENGTH]) as attributes:
+            return with_session(config, lambda con: fetch_rows(con, query, params, attributes))
+    except Exception as e:
+        print("Error")
+        raise e
+
+
+def run_copy(table_name, config, file_type=None, files=None):
+    # Load staged files into SCHEMA.TABLE with INGESTION.COPY_SP, which skips files Snowflake has already loaded.
+    # files are keys relative to the stage (data/); without them the table's files not loaded yet are.
+    # Returns the procedure's result: {'files': [{'file', 'status', 'rows_parsed', 'rows_loaded', ...}],
+    # 'rows_loaded', 'elapsed_ms', 'query_ids'}
+    if files:
+        query = f"call INGESTION.COPY_SP(%s, %s, array_construct({', '.join(['%s'] * len(files))}));"
+        params = [table_name, file_type or 'CSV', *files]
+    elif file_type:
+        query, params = "call INGESTION.COPY_SP(%s, %s);", [table_name, file_type]
+    else:
+        query, params = "call INGESTION.COPY_SP(%s);", [table_name]
+    with span('snowflake.copy', table=table_name, file_type=file_type, requested_files=len(files or ())) as attributes:
+        result = next(iter(run_query(query, config, params)[0].values()))
+        # VARIANT values come back as JSON text
+        result = json.loads(result) if isinstance(result, str) else result
+        attributes.update(files=len(result['files']), rows_loaded=result['rows_loaded'], query_ids=result['query_ids'])
+    return result
+
+
+def copy_held_files(table_name, config, files):
+    # Load the files a queued DDL held back: files is the FILES column of DDL_HISTORY, {file type: keys relative
+    # to the stage} as JSON. Rows queued before FILES was recorded load the table's files not loaded yet.
+    files = json.loads(files) if isinstance(files, str) else files
+    if not files:
+        return [run_copy(table_name, config)]
+    return [run_copy(table_name, config, file_type, keys) for file_type, keys in sorted(files.items())]
+
+
+def split_statements(ddl):
+    # DDL_STATEMENT holds generated ALTER statements separated by ';' (no quoted ';' inside)
+    return [statement.strip() for statement in ddl.split(";") if statement.strip()]
+
+
+def execute_statements(con, statements):
+    # One multi-statement request; each statement has its own result set, in order
+    from snowflake.connector import DictCursor
+    with con.cursor(DictCursor) as cur:
+        cur.execute(";\n".join(statements) + ";", num_statements=len(statements))
+        results = []
+        for statement in statements:
+            results.append({'statement': statement, 'query_id': cur.sfqid, 'rows': cur.fetchall()})
+            cur.nextset()
+        return results
+
+
+def run_ddl(ddl, config):
+    # Send every statement of a stored DDL in one multi-statement request instead of one round trip each.
+    # Snowflake commits each DDL statement on its own, so a failing statement stops the batch but
+    # the statements before it stay applied.
+    statements = split_statements(ddl)
+    if not statements:
+        return []
+    try:
+        with span('snowflake.ddl', statements=len(statements)) as attributes:
+            results = with_session(config, lambda con: execute_statements(con, statements))
+            attributes['query_ids'] = [result['query_id'] for result in results]
+            if is_sampled():
+                # Server-side time per statement in one extra lookup, only for traced invocations
+                attributes['statements'] = statement_timings(results, config)
+    except Exception as e:
+        print("Error")
+        raise e
+    return results
+
+
+def statement_timings(results, config):
+    query_ids = [result['query_id'] for result in results]
+    try:
+        history = run_query(
+            "select QUERY_ID, TOTAL_ELAPSED_TIME from table(information_schema.query_history_by_session(result_limit => 100)) where QUERY_ID in (%s)" % ", ".join(["%s"] * len(query_ids)),
+            config, query_ids)
+    except Exception as e:
+        print(f"Could not read DDL timing: {e}")
+        history = []
+    elapsed_ms = {row['QUERY_ID']: row['TOTAL_ELAPSED_TIME'] for row in history}
+    return [{'query_id': result['query_id'], 'elapsed_ms': elapsed_ms.get(result['query_id']), 'statement': result['statement'][:SPAN_QUERY_LENGTH]}
+            for result in results]
+
+
+def insert_rows(table_name, columns, rows, config):
+    # Write all rows in one round trip; table_name is fully qualified as DATABASE.SCHEMA.TABLE
+    if not rows:
+        return 0
+    try:
+        with span('snowflake.insert', table=table_name, rows=len(rows)) as attributes:
+            if len(rows) > BULK_INSERT_STAGE_THRESHOLD:
+                attributes['staged'] = True
+                return with_session(config, lambda con: write_rows(con, table_name, columns, rows))
+            query = f"insert into {table_name} ({', '.join(columns)}) values ({', '.join(['%s'] * len(columns))})"
+            return with_session(config, lambda con: execute_many(con, query, rows, attributes))
+    except Exception as e:
+        print("Error")
+        raise e
+
+
+def execute_many(con, query, rows, attributes=None):
+    # executemany rewrites a bound INSERT into a single multi-row INSERT
+    with con.cursor() as cur:
+        cur.executemany(query, rows)
+        if attributes is not None:
+            attributes['query_id'] = cur.sfqid
+        return cur.rowcount
+
+
+def write_rows(con, table_name, columns, rows):
+    import pandas as pd
+    from snowflake.connector.pandas_tools import write_pandas
+    database, schema, table = table_name.split('.')
+    df = pd.DataFrame(rows, columns=[column.upper() for column in columns])
+    success, nchunks, nrows, output = write_pandas(con, df, table, database=database, schema=schema, quote_identifiers=False)
+    return nrows
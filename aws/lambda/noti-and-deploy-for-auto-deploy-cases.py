@@ -1,140 +1,109 @@
 import json
-import pandas as pd
-import numpy as np
-from io import StringIO
-import snowflake.connector
-from snowflake.connector import DictCursor
-import io
-from datetime import datetime
-import string
-import boto3
-from urllib.request import Request, urlopen
-from urllib.parse import unquote
-import base64
 from time import time
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from wormhole.aws import BUCKET, lambda_arn
+from wormhole.catalog import invalidate_schema_catalog
+from wormhole.config import load_config
+from wormhole.ddl_queue import claim, move, release
+from wormhole.instrumentation import instrumented
+from wormhole.notify import sent_to_slack
+from wormhole.pipeline import claim_idempotency_key, invoke_lambda, release_idempotency_key
+from wormhole.sql import copy_held_files, run_ddl
+
+# Number of tables deployed at the same time; the rows of one table are always deployed in order
+DEPLOY_CONCURRENCY = int(os.environ.get('DEPLOY_CONCURRENCY', '4'))
+# Created once per container so the worker threads, and their Snowflake sessions, survive warm invocations
+deploy_pool = None
  
+@instrumented('noti-and-deploy-for-auto-deploy-cases')
 def lambda_handler(event, context):
+    idempotency_key = (event or {}).get('idempotency_key')
+    if idempotency_key and not claim_idempotency_key('noti-and-deploy-for-auto-deploy-cases', idempotency_key):
+        print(f"Change set {idempotency_key} was already processed")
+        return None
     try:
-        #get tables that need request approval from Snowflake
-        config_df = read_file_from_s3('wormholeltd-bucket', 'config/config-snowflake.csv')
-        config = config_df.to_dict(orient='records')
+        #claim the tables that can be deployed automatically
+        config = load_config()
         
-        query_table_auto_deploy = "SELECT * FROM WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY WHERE STATUS = 'pending deployment';" 
-        request_auto_deploy = run_query(query_table_auto_deploy, config)
+        request_auto_deploy = claim('pending deployment', context.aws_request_id, config)
         
-        #perform deployment for auto-deploy cases
-        if request_auto_deploy.rowcount != 0:
-            status = 'done deployment'
+        #perform deployment for auto-deploy cases, one worker per table
+        if request_auto_deploy:
+            table_rows = {}
             for i in request_auto_deploy:
-                id_change = i['ID']
-                database_name = i['DATABASE_NAME']
-                schema_name = i['SCHEMA_NAME']
-                table_name = i['TABLE_NAME']
-                ddl = i['DDL_STATEMENT']
-                
-                #deploy ddl to production
-                for x in ddl.split(";"):
-                    run_query(x, config)
-                
-                #execute ingestion pipeline
-                QUERY = f"""call INGESTION.COPY_SP('{schema_name}.{table_name}');"""
-                run_query(QUERY, config)
-                
-                current_timestamp = int(time() * 1000)
+                table_rows.setdefault((i['DATABASE_NAME'], i['SCHEMA_NAME'], i['TABLE_NAME']), []).append(i)
+            results = [future.result() for future in [get_deploy_pool().submit(deploy_table, rows, context.aws_request_id, config) for rows in table_rows.values()]]
 
-                # Send noti to slack for completed deploymnet
-                slack_message = {
-                    "attachments": 
-                            [
-                                {
-                                    "color": "#36a64f",
-                                    "pretext":"Having a detected schema change for `{}.{}.{}`".format(database_name,schema_name,table_name),
-                                    "text": "_Status_: `{}`\n_DDL Statement_:\n```{}```".format(status, ddl),
-                                    "footer": ':successful:   Auto deployment',
-                                    "ts": current_timestamp
-                              
-                                }
-                            ]
-                        }
-                        
-                sent_to_slack(slack_message)
-                    
-                #update status in snowflake database after deploy
-                query_update_status = "UPDATE WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY SET STATUS = '{}' WHERE ID = {};".format(status, id_change)
-                request_approval_tbl = run_query(query_update_status, config)
+            # Send noti to slack for every deployed or failed row
+            for table_results in results:
+                for i, row_status, error, copy_error in table_results:
+                    slack_message = {
+                        "attachments": 
+                                [
+                                    {
+                                        "color": "#36a64f" if error is None and copy_error is None else "#e01e5a",
+                                        "pretext":"Having a detected schema change for `{}.{}.{}`".format(i['DATABASE_NAME'], i['SCHEMA_NAME'], i['TABLE_NAME']),
+                                        "text": "_Status_: `{}`\n_DDL Statement_:\n```{}```".format(row_status, i['DDL_STATEMENT']) + ("" if error is None else "\n_Error_: `{}`".format(error))
+                                                + ("" if copy_error is None else "\n_Load failed_: `{}`".format(copy_error)),
+                                        "footer": ':successful:   Auto deployment' if error is None else ':error-deny:   Auto deployment failed',
+                                        "ts": int(time() * 1000)
+                                  
+                                    }
+                                ]
+                            }
+                    sent_to_slack(slack_message)
         
         #Invoke request approval lambda to resolve for needed-approval cases
-        invoke_lambda('arn:aws:lambda:ap-southeast-2:316920261407:function:request-approval')
+        invoke_lambda(lambda_arn('request-approval'), json.dumps({'idempotency_key': idempotency_key}))
         
         return  None
     except Exception as e:
         print('Error')
+        if idempotency_key:
+            release_idempotency_key('noti-and-deploy-for-auto-deploy-cases', idempotency_key)
         raise e
 
 
 
 
-def read_file_from_s3(bucket_name, file_key) -> None:
-    try:
-        s3_resource = boto3.resource('s3')
-        s3_client = s3_resource.meta.client
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        csv_data = io.BytesIO(response['Body'].read())
-        df = pd.read_csv(csv_data)
-        return df
-    except Exception as e:
-        print("Error when get file from S3")
-        raise e
-     
-def snowflake_credential(config):
-    try:
-        snowflake_secret = {
-            "user": config[0]['user'] ,
-            "password": config[0]['password'],
-            "account": config[0]['account'],
-            "schema": config[0]['schema'],
-            "warehouse": config[0]['warehouse'],
-            "database": config[0]['database'],
-            "role": config[0]['role']
-        }
-        return snowflake_secret
-
-    except Exception as e:
-        print('Error')
-        raise e
+def get_deploy_pool():
+    global deploy_pool
+    if deploy_pool is None:
+        deploy_pool = ThreadPoolExecutor(max_workers=DEPLOY_CONCURRENCY, thread_name_prefix='deploy')
+    return deploy_pool
 
+def deploy_table(rows, owner, config):
+    # Runs in a worker thread. The rows of one table are deployed in ID order; after a failed DDL the
+    # remaining rows of that table are released and stay 'pending deployment', and the other tables are not affected.
+    # A DDL that was applied is 'done deployment' even if loading its held-back files fails; that error is reported on its own.
+    results = []
+    rows = sorted(rows, key=lambda row: row['ID'])
+    for position, i in enumerate(rows):
+        try:
+            #deploy ddl to production
+            run_ddl(i['DDL_STATEMENT'], config)
+            # The table changed: the cached column metadata is dropped before anything else can fail
+            invalidate_schema_catalog(BUCKET)
+            status, error = 'done deployment', None
+        except Exception as e:
+            print(f"Error when deploy DDL {i['ID']} for {i['SCHEMA_NAME']}.{i['TABLE_NAME']}: {e}")
+            status, error = 'failed deployment', str(e)
 
-def run_query(query, config):
-    try:
-        snowflake_secret = snowflake_credential(config)
-        with snowflake.connector.connect(**snowflake_secret) as con:
-            print("connect successfully!")
-            print(f"SQL query: {query}")
-            cur = con.cursor(DictCursor).execute(query)
-            return cur
-            
-    except Exception as e:
-        print("Error")
-        raise e
-        
-def sent_to_slack(slack_message):
-    try: 
-        config_df = read_file_from_s3('wormholeltd-bucket', 'config/config-snowflake.csv')
-        config = config_df.to_dict(orient='records')
-        slack_webhook_url = config[0]['slack_webhook_url']
-        req = Request(slack_webhook_url, json.dumps(slack_message).encode('utf-8'))
-        response = urlopen(req)
-        response.read()
-        return None
-    except Exception as e:
-        print('Error')
-        raise e
-        
-def invoke_lambda(FunctionName):
-    client = boto3.client('lambda')
+        #update status in snowflake database after deploy
+        move([i['ID']], owner, status, config)
+        if error is not None:
+            results.append((i, status, error, None))
+            release([row['ID'] for row in rows[position + 1:]], owner, config)
+            break
 
-    res = client.invoke(
-        	FunctionName = FunctionName,
-        	InvocationType = 'RequestResponse',
-        )
-    return None
\ No newline at end of file
+        #execute ingestion pipeline: the files held back by this change
+        copy_error = None
+        try:
+            copy_held_files(f"{i['SCHEMA_NAME']}.{i['TABLE_NAME']}", config, i['FILES'])
+        except Exception as e:
+            print(f"Error when loading the files held back by DDL {i['ID']} for {i['SCHEMA_NAME']}.{i['TABLE_NAME']}: {e}")
+            copy_error = str(e)
+        results.append((i, status, error, copy_error))
+    return results
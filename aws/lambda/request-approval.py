@@ -1,140 +1,103 @@
 import json
-import pandas as pd
-import numpy as np
-from io import StringIO
-import snowflake.connector
-from snowflake.connector import DictCursor
-import io
-import datetime
-import string
-import boto3
-from urllib.request import Request, urlopen
 
+from wormhole.config import load_config
+from wormhole.ddl_queue import claim, move, release
+from wormhole.instrumentation import instrumented
+from wormhole.notify import sent_to_slack
+from wormhole.pipeline import claim_idempotency_key, release_idempotency_key
 
+
+@instrumented('request-approval')
 def lambda_handler(event, context):
+    idempotency_key = (event or {}).get('idempotency_key')
+    if idempotency_key and not claim_idempotency_key('request-approval', idempotency_key):
+        print(f"Change set {idempotency_key} was already processed")
+        return "Already requested"
     try:
-        #get tables that need request approval from Snowflake
-        config_df = read_file_from_s3('wormholeltd-bucket', 'config/config-snowflake.csv')
-        config = config_df.to_dict(orient='records')
+        #claim the tables that need request approval, so overlapping invocations never send the same DDL twice
+        config = load_config()
         
-        query_table_request_approval = "SELECT * FROM WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY WHERE STATUS = 'requesting approval';" 
-        request_approval_tbl = run_query(query_table_request_approval, config)
+        request_approval_tbl = claim('requesting approval', context.aws_request_id, config)
         
-        if request_approval_tbl.rowcount != 0:
-            # sent request to slack 
-            for i in request_approval_tbl:
-                id_change = i['ID']
-                database_name = i['DATABASE_NAME']
-                schema_name = i['SCHEMA_NAME']
-                table_name = i['TABLE_NAME']
-                ddl = i['DDL_STATEMENT']
-                
-                slack_message = {
-                    "text": "Having a detected schema change for `{}.{}.{}`\nProposed DDL:```{}```".format(database_name, schema_name, table_name, ddl),
-                    "attachments": [
-                        {
-                            "pretext": "Would you like to deploy the proposed DDL to production?",
-                            "fallback": "You are unable to promote a build",
-                            "callback_id": "get_res",
-                            "color": "#36a64f",
-                            "attachment_type": "default",
-                            "response_type": "in_channel",
-                            "replace_original": False,
-                            "delete_original": False,
-                            "actions": [
-                                {
-                                    "name": "deployment",
-                                    "text": "Yes",
-                                    "style": "danger",
-                                    "type": "button",
-                                    "value": json.dumps({"approve": True, "id_change":id_change, "database_name": database_name, "schema_name": schema_name, "table_name": table_name, "ddl": ddl, "replace_original": False,
-              "delete_original": False}),
-                                    "confirm": {
-                                        "title": "Are you sure?",
-                                        "text": "This will deploy the build to production",
-                                        "ok_text": "Yes",
-                                        "dismiss_text": "No"
-                                    }
-                                },
-                                {
-                                    "name": "deployment",
-                                    "text": "No",
-                                    "type": "button",
-                                    "value": json.dumps({"approve": False, "id_change":id_change, "database_name": database_name, "schema_name": schema_name, "table_name": table_name, "ddl": ddl, "replace_original": False,
-              "delete_original": False})
-                                }  
-                            ]
-                        }
-                    ]
-                }
-                sent_to_slack(slack_message)
+        if request_approval_tbl:
+            ids = [i['ID'] for i in request_approval_tbl]
+            try:
+                # sent request to slack, grouping the pending DDLs into as few messages as possible
+                for slack_message in build_approval_messages(request_approval_tbl):
+                    sent_to_slack(slack_message)
+            except Exception:
+                release(ids, context.aws_request_id, config)
+                raise
                 
-                
-            #update after sending request
-            query_update_status = "UPDATE WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY SET STATUS = 'pending approval' WHERE STATUS = 'requesting approval';"
-            request_approval_tbl = run_query(query_update_status, config)
+            #update only the rows that were sent
+            move(ids, context.aws_request_id, 'pending approval', config)
             return "requested successfully"
             
         return "No tables need approval"
         
     except Exception as e:
         print('Error')
+        if idempotency_key:
+            release_idempotency_key('request-approval', idempotency_key)
         raise e
     
 
 
-def read_file_from_s3(bucket_name, file_key) -> None:
-    try:
-        s3_resource = boto3.resource('s3')
-        s3_client = s3_resource.meta.client
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        csv_data = io.BytesIO(response['Body'].read())
-        df = pd.read_csv(csv_data)
-        return df
-    except Exception as e:
-        print("Error when get file from S3")
-        raise e
-     
-def snowflake_credential(config):
-    try:
-        snowflake_secret = {
-            "user": config[0]['user'] ,
-            "password": config[0]['password'],
-            "account": config[0]['account'],
-            "schema": config[0]['schema'],
-            "warehouse": config[0]['warehouse'],
-            "database": config[0]['database'],
-            "role": config[0]['role']
-        }
-        return snowflake_secret
-
-    except Exception as e:
-        print('Error')
-        raise e
+# Slack accepts at most 50 blocks per message; each pending DDL takes 3 and the header 1
+SLACK_MAX_BLOCKS = 50
+APPROVALS_PER_MESSAGE = (SLACK_MAX_BLOCKS - 1) // 3
+# Section text is limited to 3000 characters
+SLACK_MAX_TEXT = 3000
 
+def build_approval_messages(rows):
+    messages = []
+    for start in range(0, len(rows), APPROVALS_PER_MESSAGE):
+        batch = rows[start:start + APPROVALS_PER_MESSAGE]
+        blocks = [{
+            "type": "section",
+            "text": {"type": "mrkdwn", "text": "*{} detected schema change(s) need approval.* Would you like to deploy the proposed DDL to production?".format(len(batch))}
+        }]
+        for i in batch:
+            blocks.extend(approval_blocks(i))
+        messages.append({
+            "text": "{} detected schema change(s) need approval".format(len(batch)),
+            "blocks": blocks
+        })
+    return messages
 
-def run_query(query, config):
-    try:
-        snowflake_secret = snowflake_credential(config)
-        with snowflake.connector.connect(**snowflake_secret) as con:
-            print("connect successfully!")
-            print(f"SQL query: {query}")
-            cur = con.cursor(DictCursor).execute(query)
-            return cur
-            
-    except Exception as e:
-        print("Error")
-        raise e
-        
-def sent_to_slack(slack_message):
-    try: 
-        config_df = read_file_from_s3('wormholeltd-bucket', 'config/config-snowflake.csv')
-        config = config_df.to_dict(orient='records')
-        slack_webhook_url = config[0]['slack_webhook_url']
-        req = Request(slack_webhook_url, json.dumps(slack_message).encode('utf-8'))
-        response = urlopen(req)
-        response.read()
-        return None
-    except Exception as e:
-        print('Error')
-        raise e
\ No newline at end of file
+def approval_blocks(i):
+    # The button value only carries the ID: auto-deploy reads the DDL back from DDL_HISTORY
+    # (button values are limited to 2000 characters)
+    id_change = i['ID']
+    text = "Having a detected schema change for `{}.{}.{}` (estimated cost {})\nProposed DDL:```{}```".format(i['DATABASE_NAME'], i['SCHEMA_NAME'], i['TABLE_NAME'], i.get('ESTIMATED_COST'), i['DDL_STATEMENT'])
+    if len(text) > SLACK_MAX_TEXT:
+        text = text[:SLACK_MAX_TEXT - 4] + "…```"
+    return [
+        {"type": "section", "text": {"type": "mrkdwn", "text": text}},
+        {
+            "type": "actions",
+            "block_id": "deployment-{}".format(id_change),
+            "elements": [
+                {
+                    "type": "button",
+                    "action_id": "approve",
+                    "text": {"type": "plain_text", "text": "Yes"},
+                    "style": "danger",
+                    "value": json.dumps({"approve": True, "id_change": id_change}),
+                    "confirm": {
+                        "title": {"type": "plain_text", "text": "Are you sure?"},
+                        "text": {"type": "plain_text", "text": "This will deploy the build to production"},
+                        "confirm": {"type": "plain_text", "text": "Yes"},
+                        "deny": {"type": "plain_text", "text": "No"}
+                    }
+                },
+                {
+                    "type": "button",
+                    "action_id": "deny",
+                    "text": {"type": "plain_text", "text": "No"},
+                    "value": json.dumps({"approve": False, "id_change": id_change})
+                }
+            ]
+        },
+        {"type": "divider"}
+    ]
@@ -0,0 +1,222 @@
+"""Check that compare() classifies changes as the original row-wise version did.
+
+compare() in detect-schema-change was rewritten as one vectorized pass over a
+single merge. This script keeps the original implementation (two merges,
+DataFrame.apply with classify_change_type / classify_change_data_type, and the
+str.replace passes of preprocess) as the baseline, and diffs the two outputs,
+row order included, on:
+
+- the scenario files in aws/s3/data against the EMPLOYEES table of
+  snowflake/DDL.sql
+- randomized table and file schemas (added, removed, renamed, punctuated,
+  retyped and wider columns)
+
+Fuzzy rename matching is a later, deliberate change of the output, so it is
+turned off for the check (RENAME_MATCHING). The baseline's trim() has one
+deliberate change too: a file column whose exact name the table already has
+(FIRST_NAME after a rename) is matched as it is, not with its punctuation
+stripped. The script exits with status 1 on
+the first schemas whose outputs differ and prints both frames.
+
+Usage:
+    python benchmark/compare_equivalence.py [--cases 500] [--width 30] [--seed 1]
+"""
+import argparse
+import datetime
+import glob
+import importlib.util
+import os
+import random
+import string
+import sys
+import warnings
+
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.join(BENCHMARK_DIR, '..', 'aws', 'lambda')
+DATA_DIR = os.path.join(BENCHMARK_DIR, '..', 'aws', 's3', 'data')
+# The shared wormhole package is deployed as a Lambda layer (/opt/python); load it from the repo instead
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'layer', 'python'))
+
+# INGESTION.EMPLOYEES as created by snowflake/DDL.sql
+EMPLOYEES = [('EMPLOYEEID', 'NUMBER', None), ('FIRSTNAME', 'TEXT', 20), ('LASTNAME', 'TEXT', 20),
+             ('DEPARTMENT', 'TEXT', 20), ('POSITION', 'TEXT', 50), ('SALARY', 'NUMBER', None)]
+TABLE_TYPES = ['TEXT', 'NUMBER', 'FLOAT']
+FILE_TYPES = ['object', 'int64', 'float64']
+# Output columns that are compared; Created_at is the wall clock of each run
+OUTPUT_COLUMNS = ['ORIGINAL_COLUMN_NAME', 'OLD_DATA_TYPE', 'OLD_DATA_LENGTH', 'NEW_COLUMN_NAME', 'S3_COLUMN_NAME_TRIM',
+                  'NEW_DATA_TYPE', 'NEW_DATA_LENGTH', 'Is_changed', 'ChangeType', 'Database', 'TableSchema', 'TableName']
+
+
+def load_detect_module():
+    path = os.path.join(LAMBDA_DIR, 'detect-schema-change.py')
+    spec = importlib.util.spec_from_file_location('detect_schema_change', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# The original implementation, kept as it was before the vectorized rewrite (apart from baseline_trim, see above)
+
+def baseline_classify_change_type(row):
+    if pd.notna(row['S3_COLUMN_NAME']) and row['S3_COLUMN_NAME_TRIM'] != row['S3_COLUMN_NAME']:
+        return 'RENAME COLUMN'
+    if pd.notna(row['S3_COLUMN_NAME_TRIM']) and pd.isna(row['COLUMN_NAME']):
+        return 'ADD NEW COLUMN'
+    if pd.notna(row['COLUMN_NAME']) and pd.isna(row['S3_COLUMN_NAME_TRIM']):
+        return 'REMOVE COLUMN'
+    else:
+        return None
+
+
+def baseline_classify_change_data_type(row):
+    if (row['DATA_TYPE'] == 'TEXT') & (row['CHARACTER_MAXIMUM_LENGTH'] < row['S3_DATA_LENGTH']):
+        return 'CHANGED DATA TYPE'
+    if (row['DATA_TYPE'] != row['S3_DATA_TYPE'] != 'int64'):
+        return 'CHANGED DATA TYPE'
+    else:
+        return None
+
+
+def baseline_trim(df, table_columns):
+    trans = str.maketrans('', '', string.punctuation)
+    df['S3_COLUMN_NAME_TRIM'] = df['S3_COLUMN_NAME'].str.translate(trans)
+    exact = df['S3_COLUMN_NAME'].isin(table_columns)
+    df.loc[exact, 'S3_COLUMN_NAME_TRIM'] = df.loc[exact, 'S3_COLUMN_NAME']
+
+
+def baseline_preprocess(df):
+    df['NEW_DATA_LENGTH'] = df['NEW_DATA_LENGTH'].fillna(0)
+    df['OLD_DATA_LENGTH'] = df['OLD_DATA_LENGTH'].fillna(0)
+    df['NEW_DATA_TYPE'] = df['NEW_DATA_TYPE'].str.replace('object', 'TEXT')
+    df['NEW_DATA_TYPE'] = df['NEW_DATA_TYPE'].str.replace('int64', 'NUMBER')
+    df['NEW_DATA_TYPE'] = df['NEW_DATA_TYPE'].str.replace('float64', 'FLOAT')
+    df['NEW_DATA_LENGTH'] = df['NEW_DATA_LENGTH'].astype('int')
+    df['OLD_DATA_LENGTH'] = df['OLD_DATA_LENGTH'].astype('int')
+
+
+def baseline_compare(df1, df2, table_schema, table_name):
+    baseline_trim(df2, df1['COLUMN_NAME'])
+    current_time = datetime.datetime.now()
+    renames = {'COLUMN_NAME': 'ORIGINAL_COLUMN_NAME', 'S3_COLUMN_NAME': 'NEW_COLUMN_NAME', 'DATA_TYPE': 'OLD_DATA_TYPE',
+               'CHARACTER_MAXIMUM_LENGTH': 'OLD_DATA_LENGTH', 'S3_DATA_TYPE': 'NEW_DATA_TYPE', 'S3_DATA_LENGTH': 'NEW_DATA_LENGTH'}
+
+    merged_df_col = pd.merge(df1, df2, left_on='COLUMN_NAME', right_on='S3_COLUMN_NAME_TRIM', how='outer')
+    merged_df_col['Is_changed'] = (merged_df_col['COLUMN_NAME'] != merged_df_col['S3_COLUMN_NAME'])
+    filtered_df_col = merged_df_col.loc[(merged_df_col['Is_changed'] == True)]  # noqa: E712
+    if not filtered_df_col.empty:
+        filtered_df_col['ChangeType'] = filtered_df_col.apply(baseline_classify_change_type, axis=1)
+        filtered_df_col['Database'] = 'WORMHOLE'
+        filtered_df_col['TableSchema'] = table_schema
+        filtered_df_col['TableName'] = table_name
+        filtered_df_col['Created_at'] = current_time
+    filtered_df_col = filtered_df_col.rename(columns=renames)
+
+    merged_df_data_type = pd.merge(df1, df2, left_on='COLUMN_NAME', right_on='S3_COLUMN_NAME_TRIM', how='outer')
+    merged_df_data_type = merged_df_data_type.dropna(subset=['S3_COLUMN_NAME'])
+    merged_df_data_type['Is_changed'] = ((merged_df_data_type['DATA_TYPE'] == 'TEXT') & (merged_df_data_type['CHARACTER_MAXIMUM_LENGTH'] < merged_df_data_type['S3_DATA_LENGTH'])) | ((merged_df_data_type['DATA_TYPE'] == 'NUMBER') & (merged_df_data_type['S3_DATA_TYPE'] != 'int64')) | ((merged_df_data_type['DATA_TYPE'] == 'FLOAT') & (merged_df_data_type['S3_DATA_TYPE'] != 'float64'))
+    filtered_df_data_type = merged_df_data_type.loc[(merged_df_data_type['Is_changed'] == True)]  # noqa: E712
+    if not filtered_df_data_type.empty:
+        filtered_df_data_type['ChangeType'] = filtered_df_data_type.apply(baseline_classify_change_data_type, axis=1)
+        filtered_df_data_type['Database'] = 'WORMHOLE'
+        filtered_df_data_type['TableSchema'] = table_schema
+        filtered_df_data_type['TableName'] = table_name
+        filtered_df_data_type['Created_at'] = current_time
+    filtered_df_data_type = filtered_df_data_type.rename(columns=renames)
+
+    filtered_df = pd.concat([filtered_df_col, filtered_df_data_type])
+    if not filtered_df.empty:
+        baseline_preprocess(filtered_df)
+        filtered_df = filtered_df.sort_values(by=['ChangeType'], ascending=True)
+    return filtered_df
+
+
+def table_frame(columns):
+    # Lengths are numeric with NaN for non-text columns, as the catalog gives them
+    df = pd.DataFrame(columns, columns=['COLUMN_NAME', 'DATA_TYPE', 'CHARACTER_MAXIMUM_LENGTH'])
+    return df.astype({'CHARACTER_MAXIMUM_LENGTH': float})
+
+
+def file_frame(columns):
+    return pd.DataFrame(columns, columns=['S3_COLUMN_NAME', 'S3_DATA_TYPE', 'S3_DATA_LENGTH'])
+
+
+def scenario_cases(detect):
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, '*.csv'))):
+        with open(path, 'rb') as f:
+            profiles = detect.scan_profiles(detect.iter_lines([f.read()]))
+        yield os.path.basename(path), table_frame(EMPLOYEES), detect.profiles_to_schema(profiles)
+
+
+def random_name(rng):
+    return ''.join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(3, 10)))
+
+
+def random_case(rng, width):
+    table = []
+    for _ in range(rng.randint(1, width)):
+        data_type = rng.choice(TABLE_TYPES)
+        name = random_name(rng)
+        if rng.random() < 0.1:
+            # a column renamed by an earlier deployment (FIRSTNAME -> FIRST_NAME)
+            name = f'{name[:2]}_{name[2:]}'
+        table.append((name, data_type, rng.randint(1, 60) if data_type == 'TEXT' else None))
+    table = list({column[0]: column for column in table}.values())
+    file = []
+    for name, data_type, length in table:
+        kind = rng.random()
+        if kind < 0.1:
+            continue  # removed
+        if kind < 0.2 and '_' not in name:
+            # renamed with punctuation, which trim() strips again (FIRST_NAME -> FIRSTNAME)
+            cut = rng.randint(1, len(name) - 1)
+            name = f'{name[:cut]}{rng.choice("_-.")}{name[cut:]}'
+        file_type = rng.choice(FILE_TYPES) if rng.random() < 0.3 else {'TEXT': 'object', 'NUMBER': 'int64', 'FLOAT': 'float64'}[data_type]
+        file_length = rng.randint(0, 80) if file_type == 'object' else rng.randint(1, 12)
+        file.append((name, file_type, file_length))
+    for _ in range(rng.randint(0, 3)):
+        file.append((random_name(rng), rng.choice(FILE_TYPES), rng.randint(0, 80)))  # added
+    rng.shuffle(file)
+    file = list({column[0]: column for column in file}.values())
+    return table_frame(table), file_frame(file)
+
+
+def outputs_match(detect, df1, df2):
+    expected = baseline_compare(df1.copy(), df2.copy(), 'INGESTION', 'EMPLOYEES')
+    actual = detect.compare(df1.copy(), df2.copy(), 'INGESTION', 'EMPLOYEES')
+    if expected.empty and actual.empty:
+        return True, expected, actual
+    expected = expected[OUTPUT_COLUMNS].reset_index(drop=True).astype(object).where(lambda df: df.notna(), None)
+    actual = actual[OUTPUT_COLUMNS].reset_index(drop=True).astype(object).where(lambda df: df.notna(), None)
+    return expected.equals(actual), expected, actual
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cases', type=int, default=500, help='randomized schemas to check')
+    parser.add_argument('--width', type=int, default=30, help='most columns per random table')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv[1:])
+
+    detect = load_detect_module()
+    detect.RENAME_MATCHING = False
+    rng = random.Random(args.seed)
+    cases = list(scenario_cases(detect)) + [(f'random #{i}', *random_case(rng, args.width)) for i in range(args.cases)]
+    with warnings.catch_warnings():
+        # The baseline assigns to filtered slices, as the original did
+        warnings.simplefilter('ignore')
+        for name, df1, df2 in cases:
+            matches, expected, actual = outputs_match(detect, df1, df2)
+            if not matches:
+                print(f'{name}: compare() output differs from the baseline')
+                print('table:', df1.to_dict(orient='records'))
+                print('file:', df2.to_dict(orient='records'))
+                print('baseline:', expected, 'compare():', actual, sep='\n')
+                return 1
+    print(f'{len(cases)} schemas checked, compare() matches the baseline on all of them')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
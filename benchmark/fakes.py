@@ -0,0 +1,619 @@
+"""Local stand-ins for S3, Snowflake and the Slack webhook.
+
+FileS3 serves a directory as buckets and keys, FakeSnowflake runs the
+handlers' SQL against SQLite, and SlackSink records webhook posts over
+real HTTP. Each one counts its round trips so the benchmark can report them.
+"""
+import base64
+import csv
+import datetime
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+from urllib.parse import quote_plus
+
+from botocore.exceptions import ClientError
+from snowflake.connector.converter import SnowflakeConverter
+
+
+def client_error(status, code, operation):
+    return ClientError({'Error': {'Code': code, 'Message': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+
+class Body:
+    # The parts of botocore's StreamingBody the handlers use
+    def __init__(self, f, length):
+        self.f = f
+        self.remaining = length
+
+    def read(self, amt=None):
+        if not self.remaining:
+            return b''
+        amt = self.remaining if amt is None else min(amt, self.remaining)
+        data = self.f.read(amt)
+        self.remaining -= len(data)
+        if not self.remaining:
+            self.f.close()
+        return data
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self.f.close()
+
+
+class FileS3:
+    """boto3 S3 client stand-in backed by <root>/<bucket>/<key> files."""
+
+    def __init__(self, root):
+        self.root = root
+        self.calls = Counter()
+        self.bytes_read = 0
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def etag(self, path):
+        stat = os.stat(path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None, **kwargs):
+        self.calls['get_object'] += 1
+        path = self.path(Bucket, Key)
+        if not os.path.exists(path):
+            raise client_error(404, 'NoSuchKey', 'GetObject')
+        etag = self.etag(path)
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            raise client_error(304, 'NotModified', 'GetObject')
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        response = {'ETag': etag}
+        if Range and Range.startswith('bytes=-'):
+            # Suffix range: the last n bytes
+            start = max(size - int(Range[len('bytes=-'):]), 0)
+            response['ContentRange'] = f'bytes {start}-{end}/{size}'
+        elif Range:
+            start, end = Range[len('bytes='):].split('-')
+            # An open range (bytes=n-) runs to the end of the object
+            start, end = int(start), min(int(end) if end else size - 1, size - 1)
+            response['ContentRange'] = f'bytes {start}-{end}/{size}'
+        f = open(path, 'rb')
+        f.seek(start)
+        length = max(end - start + 1, 0)
+        self.bytes_read += length
+        response.update(Body=Body(f, length), ContentLength=length)
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.calls['head_object'] += 1
+        path = self.path(Bucket, Key)
+        if not os.path.exists(path):
+            raise client_error(404, 'NotFound', 'HeadObject')
+        return {'ETag': self.etag(path), 'ContentLength': os.path.getsize(path)}
+
+    def put_object(self, Bucket, Key, Body=b'', IfNoneMatch=None, IfMatch=None, **kwargs):
+        self.calls['put_object'] += 1
+        path = self.path(Bucket, Key)
+        if IfNoneMatch == '*' and os.path.exists(path):
+            raise client_error(412, 'PreconditionFailed', 'PutObject')
+        if IfMatch is not None and not os.path.exists(path):
+            raise client_error(404, 'NoSuchKey', 'PutObject')
+        if IfMatch is not None and IfMatch != self.etag(path):
+            raise client_error(412, 'PreconditionFailed', 'PutObject')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(Body.encode('utf-8') if isinstance(Body, str) else Body)
+        return {'ETag': self.etag(path)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.calls['delete_object'] += 1
+        path = self.path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+
+# Tables of WORMHOLE.SCHEMA_MANAGEMENT (see snowflake/DDL.sql); SQLite fills ID like autoincrement
+FAKE_SCHEMA = """
+create table SCHEMA_MANAGEMENT__CHANGE_HISTORY (
+    ID integer primary key autoincrement, DATABASE_NAME text, SCHEMA_NAME text, TABLE_NAME text,
+    OLD_COLUMN_NAME text, OLD_DATA_TYPE text, OLD_DATA_LENGTH integer, NEW_COLUMN_NAME text, NEW_DATA_TYPE text,
+    NEW_DATA_LENGTH integer, CHANGE_TYPE text, CREATED_AT text, UPDATED_AT text);
+create table SCHEMA_MANAGEMENT__DDL_HISTORY (
+    ID integer primary key autoincrement, DATABASE_NAME text, SCHEMA_NAME text, TABLE_NAME text, STATUS text,
+    CHANGES text, DDL_STATEMENT text, ESTIMATED_COST integer, FILES text, CREATED_AT text, UPDATED_AT text);
+create table SCHEMA_MANAGEMENT__DDL_QUEUE (
+    ID integer primary key, STATUS text, LEASE_OWNER text, LEASE_EXPIRES_AT text, ATTEMPTS integer default 0, ENQUEUED_AT text);
+create table INFORMATION_SCHEMA__TABLES (
+    TABLE_CATALOG text, TABLE_SCHEMA text, TABLE_NAME text, LAST_ALTERED text);
+create table INFORMATION_SCHEMA__COLUMNS (
+    TABLE_CATALOG text, TABLE_SCHEMA text, TABLE_NAME text, COLUMN_NAME text, DATA_TYPE text,
+    CHARACTER_MAXIMUM_LENGTH integer, ORDINAL_POSITION integer);
+create table QUERY_HISTORY (QUERY_ID text, TOTAL_ELAPSED_TIME integer);
+"""
+
+# Snowflake reports these type names in information_schema
+TYPE_ALIASES = {'VARCHAR': 'TEXT', 'STRING': 'TEXT', 'INT': 'NUMBER', 'INTEGER': 'NUMBER', 'DOUBLE': 'FLOAT', 'REAL': 'FLOAT'}
+MAX_TEXT_LENGTH = 16777216
+
+QUALIFIED_NAME = re.compile(r'\b(?:WORMHOLE\.)?(SCHEMA_MANAGEMENT|INGESTION)\.(\w+)\b', re.I)
+INFORMATION_SCHEMA = re.compile(r'\binformation_schema\.(tables|columns)\b', re.I)
+QUERY_HISTORY = re.compile(r'table\(\s*information_schema\.query_history_by_session\([^)]*\)\s*\)', re.I)
+CALL = re.compile(r'^\s*call\s+(?:WORMHOLE\.)?INGESTION\.(\w+)\s*\((.*)\)\s*;?\s*$', re.I | re.S)
+ALTER_TABLE = re.compile(r'^\s*alter\s+table\s+(?:(\w+)\.)?(\w+)\.(\w+)\s+(.*?)\s*;?\s*$', re.I | re.S)
+NEXTVAL = re.compile(r'^\s*select\s+(?:\w+\.)*(\w+)\.nextval\s+as\s+(\w+)\s+from\s+table\(\s*generator\(\s*rowcount\s*=>\s*(\d+)\s*\)\s*\)', re.I)
+INFER_SCHEMA = re.compile(r"table\(\s*infer_schema\(\s*location\s*=>\s*'@WORMHOLE\.INGESTION\.S3_STAGE/((?:[^']|'')*)'\s*,\s*file_format\s*=>\s*'([\w.]+)'"
+                          r"(?:\s*,\s*max_records_per_file\s*=>\s*(\d+))?", re.I)
+STAGE_SCAN = re.compile(r"from\s*\(\s*select\s+(.*?)\s+from\s+'@WORMHOLE\.INGESTION\.S3_STAGE/((?:[^']|'')*)'\s*\(\s*file_format\s*=>\s*'([\w.]+)'\s*\)"
+                        r"(?:\s*limit\s+(\d+))?\s*\)", re.I | re.S)
+STAGE_COLUMN = re.compile(r'^\s*(?:\$(\d+)|to_varchar\(\$1:"((?:[^"]|"")*)"\))\s+as\s+(\w+)\s*$', re.I)
+# NULL_IF of CSV_INFER_FORMAT and CSV_SCAN_FORMAT (snowflake/integration.sql)
+STAGE_NULL_IF = {'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                 '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'}
+# NULL_IF of CSV_FORMAT, which COPY_SP loads CSV files with
+LOAD_NULL_IF = {'', 'NULL', 'null'}
+NUMERIC_VALUE = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*')
+UPDATE_TABLE = re.compile(r'^\s*update\s+(?:(\w+)\.)?INGESTION\.(\w+)\s', re.I)
+# Bind values are checked by the connector's own converter, so the fake rejects what Snowflake rejects
+CONVERTER = SnowflakeConverter()
+
+
+def split_top_level(text, separator=','):
+    # Split on separators outside parentheses, so NUMBER(38,0) stays in one piece
+    parts, depth, current = [], 0, ''
+    for char in text:
+        depth += (char == '(') - (char == ')')
+        if char == separator and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return [part.strip() for part in parts if part.strip()]
+
+
+def parse_type(text):
+    match = re.match(r'^\s*(\w+)\s*(?:\(\s*(\d+)\s*(?:,\s*\d+\s*)?\))?', text)
+    data_type = TYPE_ALIASES.get(match.group(1).upper(), match.group(1).upper())
+    if data_type == 'TEXT':
+        return data_type, int(match.group(2)) if match.group(2) else MAX_TEXT_LENGTH
+    return data_type, None
+
+
+def json_records(text):
+    # The rows of a staged JSON file: top-level values, with the elements of an outer array as rows
+    decoder = json.JSONDecoder()
+    records, position = [], 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == len(text):
+            return records
+        value, position = decoder.raw_decode(text, position)
+        records.extend(value if isinstance(value, list) else [value])
+
+
+def stage_text(value):
+    # to_varchar of a JSON value
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return json.dumps(value, separators=(',', ':'))
+
+
+def stage_value_type(values):
+    if not values:
+        return 'TEXT'
+    if all(isinstance(value, bool) or str(value).lower() in ('true', 'false') for value in values):
+        return 'BOOLEAN'
+    texts = [stage_text(value) for value in values]
+    if all(re.fullmatch(r'[+-]?\d+', text) for text in texts):
+        return 'NUMBER(38, 0)'
+    if all(re.fullmatch(r'[+-]?\d*\.?\d+', text) for text in texts):
+        return f"NUMBER(38, {max(len(text.partition('.')[2]) for text in texts)})"
+    if all(isinstance(value, (int, float)) for value in values):
+        return 'REAL'
+    return 'TEXT'
+
+
+class FakeSnowflake:
+    """In-process Snowflake: SQLite for the pipeline's own tables, an emulated
+    information_schema for the monitored tables, and COPY_SP calls recorded
+    instead of executed."""
+
+    def __init__(self, copy_seconds=0.0, csv_match_by_column_name=True):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(FAKE_SCHEMA)
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.loads = []
+        self.loaded_files = set()
+        self.sequences = Counter()
+        self.copy_seconds = copy_seconds
+        # COPY_SP loads CSV files by header name (PARSE_HEADER and MATCH_BY_COLUMN_NAME); False loads them by position
+        self.csv_match_by_column_name = csv_match_by_column_name
+        self.load_check_seconds = 0.0
+        # Files of a table in the stage, for COPY_SP calls without a file list
+        self.stage_files = lambda table_name: []
+        # Bytes of a staged file, by path relative to the stage, for INFER_SCHEMA and stage scans
+        self.stage_reader = None
+
+    # --- connector API -------------------------------------------------------
+    def connect(self, **kwargs):
+        self.calls['connect'] += 1
+        return FakeConnection(self)
+
+    # --- setup ----------------------------------------------------------------
+    def create_table(self, table_schema, table_name, columns):
+        # columns: [(name, data_type, length)]
+        with self.lock:
+            self.db.execute('delete from INFORMATION_SCHEMA__TABLES where TABLE_SCHEMA = ? and TABLE_NAME = ?', (table_schema, table_name))
+            self.db.execute('delete from INFORMATION_SCHEMA__COLUMNS where TABLE_SCHEMA = ? and TABLE_NAME = ?', (table_schema, table_name))
+            self.db.execute('insert into INFORMATION_SCHEMA__TABLES values (?, ?, ?, ?)', ('WORMHOLE', table_schema, table_name, self.now()))
+            self.db.executemany('insert into INFORMATION_SCHEMA__COLUMNS values (?, ?, ?, ?, ?, ?, ?)',
+                                [('WORMHOLE', table_schema, table_name, name, data_type, length, position)
+                                 for position, (name, data_type, length) in enumerate(columns, 1)])
+
+    def table_columns(self, table_schema, table_name):
+        rows = self.db.execute('select COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH from INFORMATION_SCHEMA__COLUMNS '
+                               'where TABLE_SCHEMA = ? and TABLE_NAME = ? order by ORDINAL_POSITION', (table_schema, table_name))
+        return [tuple(row) for row in rows]
+
+    def now(self):
+        return datetime.datetime.now().isoformat(sep=' ')
+
+    # --- statement execution --------------------------------------------------
+    def execute(self, query, params=None):
+        # Returns (rows as dicts, rowcount)
+        with self.lock:
+            self.calls['statement'] += 1
+            call = CALL.match(query)
+            if call:
+                return self.call_procedure(call.group(1), call.group(2), params)
+            infer = INFER_SCHEMA.search(query)
+            if infer:
+                return self.infer_schema(infer.group(1).replace("''", "'"), infer.group(2), infer.group(3))
+            scan = STAGE_SCAN.search(query)
+            if scan:
+                return self.scan_stage(scan.group(1), scan.group(2).replace("''", "'"), scan.group(4))
+            nextval = NEXTVAL.match(query)
+            if nextval:
+                return self.next_values(nextval.group(1).upper(), nextval.group(2).upper(), int(nextval.group(3)))
+            alter = ALTER_TABLE.match(query)
+            if alter and alter.group(2).upper() == 'INGESTION':
+                self.alter_table(alter.group(3).upper(), alter.group(4))
+                return [{'status': 'Statement executed successfully.'}], 0
+            if UPDATE_TABLE.match(query):
+                # The monitored tables hold no rows here; count the rewrite instead
+                self.calls['table rewrite'] += 1
+                return [{'number of rows updated': 0}], 0
+            sql = QUERY_HISTORY.sub('QUERY_HISTORY', query)
+            sql = INFORMATION_SCHEMA.sub(lambda m: f'INFORMATION_SCHEMA__{m.group(1).upper()}', sql)
+            sql = QUALIFIED_NAME.sub(lambda m: f'{m.group(1).upper()}__{m.group(2).upper()}', sql)
+            sql = sql.replace('%s', '?')
+            cursor = self.db.execute(sql, [self.adapt(value) for value in params or ()])
+            if cursor.description is None:
+                return [{'number of rows affected': cursor.rowcount}], cursor.rowcount
+            rows = [{key.upper(): row[key] for key in row.keys()} for row in cursor.fetchall()]
+            return rows, len(rows)
+
+    def executemany(self, query, rows):
+        with self.lock:
+            self.calls['statement'] += 1
+            sql = QUALIFIED_NAME.sub(lambda m: f'{m.group(1).upper()}__{m.group(2).upper()}', query).replace('%s', '?')
+            return self.db.executemany(sql, [[self.adapt(value) for value in row] for row in rows]).rowcount
+
+    def adapt(self, value):
+        # Bind only what the real connector can bind: it rejects pandas Timestamps, for one, with ProgrammingError 255001
+        CONVERTER.to_snowflake(value)
+        if hasattr(value, 'item'):
+            value = value.item()
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat(sep=' ') if isinstance(value, datetime.datetime) else value.isoformat()
+        if isinstance(value, (list, dict)):
+            return json.dumps(value)
+        return value
+
+    def call_procedure(self, name, arguments, params=None):
+        # COPY_SP(table[, file_type[, files]]): arguments are bound (%s) or quoted literals
+        values = list(params) if params else re.findall(r"'([^']*)'", arguments)
+        table, files = values[0], values[2:]
+        table_schema, table_name = table.upper().split('.')
+        started = perf_counter()
+        while perf_counter() - started < self.copy_seconds:
+            pass
+        # Like Snowflake's load metadata, files that were loaded before are skipped
+        candidates = files or self.stage_files(table_name)
+        loaded = [file for file in candidates if (table.upper(), file) not in self.loaded_files]
+        # Like ON_ERROR = ABORT_STATEMENT, a value that does not fit its column fails the whole COPY
+        rows_loaded = {file: self.load_file(table_schema, table_name, file) for file in loaded}
+        self.loaded_files.update((table.upper(), file) for file in loaded)
+        self.loads.append((name.upper(), table, tuple(loaded)))
+        # A load moves LAST_ALTERED, as it does in Snowflake
+        self.db.execute('update INFORMATION_SCHEMA__TABLES set LAST_ALTERED = ? where TABLE_SCHEMA = ? and TABLE_NAME = ?', (self.now(), table_schema, table_name))
+        result = {'table': table, 'files': [{'file': file, 'status': 'LOADED', 'rows_parsed': rows_loaded[file], 'rows_loaded': rows_loaded[file],
+                                             'errors_seen': 0, 'first_error': None} for file in loaded],
+                  'rows_loaded': sum(rows_loaded.values()), 'elapsed_ms': round((perf_counter() - started) * 1000), 'query_ids': [str(uuid.uuid4())]}
+        return [{name.upper(): json.dumps(result)}], 1
+
+    def load_file(self, table_schema, table_name, path):
+        # Check every value of a staged file against the column COPY would load it into; returns the rows loaded
+        if self.stage_reader is None or path.endswith(('.parquet', '.orc')):
+            return 0
+        started = perf_counter()
+        columns = self.table_columns(table_schema, table_name)
+        text = self.stage_reader(path).decode('utf-8')
+        positions = list(range(len(columns)))
+        if path.endswith(('.jsonl', '.ndjson', '.json')):
+            # JSON is always loaded with MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
+            rows = ([stage_text({key.upper(): value for key, value in record.items()}.get(name)) for name, data_type, length in columns]
+                    for record in json_records(text))
+            first_line, null_if, column_count = 1, (), None
+        else:
+            rows = csv.reader(io.StringIO(text))
+            header = [name.lstrip('\ufeff').upper() for name in next(rows, [])]
+            first_line, null_if, column_count = 2, LOAD_NULL_IF, len(columns)
+            if self.csv_match_by_column_name:
+                # Columns the file does not have are loaded as NULL, and file columns the table does not have are skipped
+                positions = [header.index(name) if name in header else None for name, data_type, length in columns]
+                column_count = None
+            # Otherwise the Nth field goes into the Nth column, whatever the header says
+        rows_loaded = 0
+        for line, row in enumerate(rows, first_line):
+            if column_count is not None and len(row) != column_count:
+                raise ValueError(f"Number of columns in file ({len(row)}) does not match that of the corresponding table ({column_count}) "
+                                 f"File '{path}', line {line}")
+            for position, (name, data_type, length) in zip(positions, columns):
+                value = row[position] if position is not None and position < len(row) else None
+                if value is None or value in null_if:
+                    continue
+                if data_type in ('NUMBER', 'FLOAT') and not NUMERIC_VALUE.fullmatch(value):
+                    raise ValueError(f"Numeric value '{value}' is not recognized File '{path}', line {line}, column {table_name}[\"{name}\"]")
+                if data_type == 'TEXT' and len(value) > length:
+                    raise ValueError(f"User character length limit ({length}) exceeded by string '{value}' File '{path}', line {line}, "
+                                     f"column {table_name}[\"{name}\"]")
+            rows_loaded += 1
+        # Snowflake does this work inside the COPY, so the benchmark can leave it out of the Lambda's time
+        self.load_check_seconds += perf_counter() - started
+        return rows_loaded
+
+    # --- staged files ---------------------------------------------------------
+    def stage_records(self, path, limit=None):
+        # CSV files as (header, rows of values or None), JSON as (None, dicts); JSON_FORMAT strips an outer array
+        text = self.stage_reader(path).decode('utf-8')
+        if path.endswith(('.jsonl', '.ndjson', '.json')):
+            records = json_records(text)
+            return None, records[:limit] if limit else records
+        lines = text.splitlines()
+        reader = csv.reader(lines)
+        header = [column.lstrip('\ufeff') for column in next(reader, [])]
+        rows = [[None if value in STAGE_NULL_IF else value for value in row] for row in reader]
+        return header, rows[:limit] if limit else rows
+
+    def infer_schema(self, path, file_format, max_records=None):
+        # Like INFER_SCHEMA: integers are NUMBER(38, 0), decimals NUMBER(38, scale), anything else TEXT
+        self.calls['stage scan'] += 1
+        header, records = self.stage_records(path, int(max_records) if max_records else None)
+        if header is None:
+            header = list(dict.fromkeys(key for record in records for key in record))
+            columns = [[record.get(name) for record in records] for name in header]
+        else:
+            columns = [[row[i] if i < len(row) else None for row in records] for i in range(len(header))]
+        rows = [{'COLUMN_NAME': name, 'TYPE': stage_value_type([value for value in values if value is not None]), 'NULLABLE': True, 'ORDER_ID': i}
+                for i, (name, values) in enumerate(zip(header, columns))]
+        return rows, len(rows)
+
+    def scan_stage(self, select_list, path, limit=None):
+        # The aggregate of detect-schema-change's stage_profiles: longest value (L), nulls (N) and values (V) per column
+        self.calls['stage scan'] += 1
+        header, records = self.stage_records(path, int(limit) if limit else None)
+        result = {}
+        for item in split_top_level(select_list):
+            position, key, alias = STAGE_COLUMN.match(item).groups()
+            index = alias[1:]
+            if position:
+                values = [row[int(position) - 1] if int(position) - 1 < len(row) else None for row in records]
+            else:
+                values = [stage_text(record.get(key.replace('""', '"'))) for record in records]
+            present = [value for value in values if value is not None]
+            result.update({f'L{index}': max(map(len, present), default=None), f'N{index}': len(values) - len(present), f'V{index}': len(present)})
+        return [result], 1
+
+    def next_values(self, sequence, column, count):
+        # select SEQ.nextval as COLUMN from table(generator(rowcount => count))
+        start = self.sequences[sequence] + 1
+        self.sequences[sequence] += count
+        rows = [{column: value} for value in range(start, start + count)]
+        return rows, len(rows)
+
+    def alter_table(self, table_name, action):
+        columns = self.table_columns('INGESTION', table_name)
+        verb = action.split(None, 1)[0].lower()
+        body = re.sub(r'^\s*\w+\s+(column\s+)?', '', action, flags=re.I)
+        if verb == 'add':
+            for clause in split_top_level(body):
+                name, data_type = re.sub(r'^\s*column\s+', '', clause, flags=re.I).split(None, 1)
+                columns.append((name.upper(), *parse_type(data_type)))
+        elif verb == 'drop':
+            dropped = {re.sub(r'^\s*column\s+', '', name, flags=re.I).strip().upper() for name in split_top_level(body)}
+            columns = [column for column in columns if column[0] not in dropped]
+        elif verb == 'rename':
+            old, new = re.match(r'(\w+)\s+to\s+(\w+)', body, re.I).groups()
+            columns = [(new.upper() if name == old.upper() else name, data_type, length) for name, data_type, length in columns]
+        elif verb in ('alter', 'modify'):
+            for clause in split_top_level(body):
+                clause = re.sub(r'^\s*column\s+', '', clause, flags=re.I)
+                name, data_type = re.match(r'(\w+)\s+(?:set\s+data\s+type\s+|type\s+)?(.*)', clause, re.I).groups()
+                new_type, new_length = parse_type(data_type)
+                for position, (column_name, old_type, old_length) in enumerate(columns):
+                    if column_name != name.upper():
+                        continue
+                    # Like Snowflake, only a VARCHAR can change in place, and only to a longer one
+                    if old_type != new_type or (new_type == 'TEXT' and new_length < old_length):
+                        raise ValueError(f'SQL compilation error: cannot change column {column_name} from type {old_type} to {new_type}')
+                    columns[position] = (column_name, new_type, new_length)
+        else:
+            raise ValueError(f'Unsupported ALTER TABLE action: {action}')
+        self.create_table('INGESTION', table_name, columns)
+
+    def record_query(self, elapsed_ms):
+        query_id = str(uuid.uuid4())
+        with self.lock:
+            self.db.execute('insert into QUERY_HISTORY values (?, ?)', (query_id, round(elapsed_ms)))
+        return query_id
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self.server)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor:
+    def __init__(self, server):
+        self.server = server
+        self.result_sets = []
+        self.rowcount = None
+        self.sfqid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.result_sets = []
+
+    def execute(self, command, params=None, num_statements=None, **kwargs):
+        # One request per execute(), however many statements it carries
+        self.server.calls['request'] += 1
+        statements = [command]
+        if num_statements is not None:
+            statements = [statement for statement in command.split(';') if statement.strip()]
+            if num_statements and len(statements) != num_statements:
+                raise ValueError(f'Expected {num_statements} statements, got {len(statements)}')
+        self.result_sets = []
+        for statement in statements:
+            started = perf_counter()
+            rows, rowcount = self.server.execute(statement, params)
+            query_id = self.server.record_query((perf_counter() - started) * 1000)
+            self.result_sets.append((query_id, rows, rowcount))
+        self.sfqid, self.rows, self.rowcount = self.result_sets[0]
+        return self
+
+    def executemany(self, command, seqparams, **kwargs):
+        self.server.calls['request'] += 1
+        self.rowcount = self.server.executemany(command, seqparams)
+        self.sfqid = self.server.record_query(0)
+        return self
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def nextset(self):
+        self.result_sets.pop(0)
+        if not self.result_sets:
+            return None
+        self.sfqid, self.rows, self.rowcount = self.result_sets[0]
+        return True
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+
+class SlackSink:
+    """HTTP server that accepts webhook posts and keeps the messages.
+
+    rate_limit_every=n answers every n-th post with 429 and Retry-After: 0."""
+
+    def __init__(self, rate_limit_every=0):
+        sink = self
+        self.messages = []
+        self.posts = 0
+        self.connections = set()
+        self.rate_limit_every = rate_limit_every
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; without this, delayed ACKs add ~40 ms per post
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                sink.posts += 1
+                sink.connections.add(self.client_address)
+                limited = sink.rate_limit_every and sink.posts % sink.rate_limit_every == 0
+                if not limited:
+                    sink.messages.append(json.loads(body))
+                self.send_response(429 if limited else 200)
+                if limited:
+                    self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}/services/benchmark'
+
+    def take_messages(self):
+        messages, self.messages = self.messages, []
+        return messages
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def approval_events(messages, approve=True, user='benchmark'):
+    # Build the API Gateway events Slack would send to auto-deploy when every approval button is clicked
+    for message in messages:
+        for block in message.get('blocks', []):
+            if block.get('type') != 'actions':
+                continue
+            for element in block['elements']:
+                if json.loads(element['value'])['approve'] != approve:
+                    continue
+                payload = {
+                    'type': 'block_actions',
+                    'user': {'id': 'U0', 'username': user, 'name': user},
+                    'actions': [dict(element, block_id=block['block_id'], action_ts=f'{datetime.datetime.now().timestamp():.6f}')],
+                }
+                # Slack posts the payload form-encoded, with '+' for spaces
+                body = 'payload=' + quote_plus(json.dumps(payload, separators=(',', ':')))
+                yield {'body': base64.b64encode(body.encode('utf-8')).decode('ascii')}
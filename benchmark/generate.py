@@ -0,0 +1,122 @@
+"""Synthetic data files for the pipeline benchmark.
+
+Tables start from the EMPLOYEES columns of aws/s3/data/20231228_scenarios_*.csv
+and are padded with generated columns up to the requested width. Each round
+writes one file per table; with probability change_rate the file's schema is
+changed first, using the same kinds of change as the scenario files: an added
+column, a removed column, a renamed column (FIRSTNAME -> FIRST_NAME), a wider
+text column, or a whole-number column that starts carrying decimals.
+"""
+import csv
+import os
+import random
+import string
+
+BASE_COLUMNS = [('EMPLOYEEID', 'NUMBER'), ('FIRSTNAME', 'TEXT'), ('LASTNAME', 'TEXT'), ('DEPARTMENT', 'TEXT'), ('POSITION', 'TEXT'), ('SALARY', 'NUMBER')]
+COLUMN_TYPES = ['TEXT', 'NUMBER', 'FLOAT']
+CHANGE_KINDS = ['add', 'remove', 'rename', 'widen', 'retype']
+# Declared length of generated text columns, and the length of the values written into them
+TEXT_LENGTH = 50
+TEXT_VALUE_LENGTH = 12
+
+
+class TableSpec:
+    def __init__(self, name, columns):
+        self.name = name
+        # [name, type, value length]; value length only matters for TEXT
+        self.columns = [[column, data_type, TEXT_VALUE_LENGTH] for column, data_type in columns]
+        self.version = 0
+
+    def catalog_columns(self):
+        # Columns as the Snowflake information_schema reports them for the initial table
+        return [(column, data_type, TEXT_LENGTH if data_type == 'TEXT' else None) for column, data_type, length in self.columns]
+
+    @property
+    def key_prefix(self):
+        return f'data/{self.name}/'
+
+
+def make_tables(count, width, rng):
+    tables = []
+    for i in range(count):
+        columns = list(BASE_COLUMNS)
+        for j in range(len(columns), width):
+            # Like the monitored tables, column names carry no punctuation; detection trims it from file headers
+            columns.append((f'COL{j}{rng.choice(string.ascii_uppercase)}', rng.choice(COLUMN_TYPES)))
+        tables.append(TableSpec(f'BENCH_{i:04d}', columns))
+    return tables
+
+
+def mutate(table, rng):
+    # Apply one schema change to the files of the table; returns the kind of change
+    kind = rng.choice(CHANGE_KINDS)
+    table.version += 1
+    if kind == 'add' or len(table.columns) < 3:
+        table.columns.append([f'ADDED{table.version}X{rng.randrange(10 ** 6)}', rng.choice(COLUMN_TYPES), TEXT_VALUE_LENGTH])
+        return 'add'
+    candidates = table.columns[1:]
+    if kind == 'remove':
+        table.columns.remove(rng.choice(candidates))
+    elif kind == 'rename':
+        unrenamed = [column for column in candidates if '_' not in column[0]]
+        if not unrenamed:
+            return mutate(table, rng)
+        # FIRSTNAME -> FIRST_NAME: only punctuation changes, so the rename is recognised after trimming
+        column = rng.choice(unrenamed)
+        column[0] = column[0][:len(column[0]) // 2] + '_' + column[0][len(column[0]) // 2:]
+    elif kind == 'widen':
+        texts = [column for column in candidates if column[1] == 'TEXT']
+        if not texts:
+            return mutate(table, rng)
+        rng.choice(texts)[2] = TEXT_LENGTH + 10 * table.version
+    elif kind == 'retype':
+        numbers = [column for column in candidates if column[1] == 'NUMBER']
+        if not numbers:
+            return mutate(table, rng)
+        rng.choice(numbers)[1] = 'FLOAT'
+    return kind
+
+
+def make_value(data_type, length, rng):
+    if data_type == 'NUMBER':
+        return str(rng.randrange(100000))
+    if data_type == 'FLOAT':
+        return f'{rng.random() * 1000:.2f}'
+    return ''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(1, length - 1))) + 'x' * (rng.random() < 0.05)
+
+
+def write_file(path, table, rows, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([column for column, data_type, length in table.columns])
+        for _ in range(rows):
+            writer.writerow([make_value(data_type, length, rng) for column, data_type, length in table.columns])
+        # Make sure the longest value is present, so wider columns are always detected
+        writer.writerow([make_value(data_type, length, rng) if data_type != 'TEXT' else 'w' * length for column, data_type, length in table.columns])
+    return os.path.getsize(path)
+
+
+def write_round(root, bucket, tables, round_number, rows, change_rate, rng):
+    # Returns the keys written and the changes applied in this round
+    keys, changes = [], []
+    for table in tables:
+        if rng.random() < change_rate:
+            changes.append((table.name, mutate(table, rng)))
+        key = f'{table.key_prefix}20231228_round_{round_number:04d}.csv'
+        write_file(os.path.join(root, bucket, *key.split('/')), table, rows, rng)
+        keys.append(key)
+    return keys, changes
+
+
+def write_monitored_tables(path, tables):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['table_schema', 'table_name', 'key_prefix', 'key_pattern'])
+        for table in tables:
+            writer.writerow(['INGESTION', table.name, table.key_prefix, ''])
+
+
+def new_rng(seed):
+    return random.Random(seed)
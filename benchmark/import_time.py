@@ -0,0 +1,95 @@
+"""Measure the cold-start import cost of each Lambda handler.
+
+Every handler file in aws/lambda is loaded in a fresh interpreter started with
+``python -X importtime``. The report shows the wall time to load the module
+and the heaviest top-level imports, using the median of several runs.
+
+Usage:
+    python benchmark/import_time.py [--runs 5] [--top 8] [--json] [function-name ...]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aws', 'lambda')
+LAYER_DIR = os.path.join(LAMBDA_DIR, 'layer', 'python')
+MARKER = 'import-benchmark-start'
+
+# Runs in the child interpreter: everything imported before the marker is interpreter start-up
+CHILD = f"""
+import sys, time, importlib.util
+sys.stderr.write('{MARKER}\\n')
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('handler', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(time.perf_counter() - started)
+"""
+
+
+def function_names():
+    return sorted(name[:-len('.py')] for name in os.listdir(LAMBDA_DIR) if name.endswith('.py'))
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:  self [us] | cumulative | imported package"; only top-level packages are kept
+    imports = {}
+    lines = stderr.splitlines()
+    for line in lines[lines.index(MARKER) + 1:] if MARKER in lines else []:
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if name.startswith(' ') and not name.startswith('  '):
+            imports[name.strip()] = int(cumulative_us)
+    return imports
+
+
+def measure(function_name):
+    path = os.path.join(LAMBDA_DIR, f'{function_name}.py')
+    # The wormhole layer is on sys.path in Lambda (/opt/python); point PYTHONPATH at the repo copy
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [LAYER_DIR, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, path], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f'{function_name} failed to import:\n{result.stderr[-2000:]}')
+    return float(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def benchmark(function_name, runs):
+    load_seconds = []
+    imports = {}
+    for _ in range(runs):
+        seconds, run_imports = measure(function_name)
+        load_seconds.append(seconds)
+        for name, cumulative_us in run_imports.items():
+            imports.setdefault(name, []).append(cumulative_us)
+    return {
+        'function': function_name,
+        'load_ms': round(statistics.median(load_seconds) * 1000, 1),
+        'imports_ms': {name: round(statistics.median(values) / 1000, 1) for name, values in imports.items()},
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('functions', nargs='*', help='handler names (default: every file in aws/lambda)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='number of top-level imports to list')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per handler')
+    args = parser.parse_args(argv[1:])
+
+    for function_name in args.functions or function_names():
+        report = benchmark(function_name, args.runs)
+        if args.json:
+            print(json.dumps(report))
+            continue
+        print(f"{report['function']}: {report['load_ms']} ms")
+        heaviest = sorted(report['imports_ms'].items(), key=lambda item: item[1], reverse=True)[:args.top]
+        for name, ms in heaviest:
+            print(f'    {ms:8.1f} ms  {name}')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
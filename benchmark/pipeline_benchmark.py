@@ -0,0 +1,233 @@
+"""End-to-end benchmark of the Lambda chain against local stand-ins.
+
+The real handlers in aws/lambda are driven through tools/step_runner.py, with
+S3 served from a temporary directory (benchmark.fakes.FileS3), Snowflake
+emulated on SQLite (FakeSnowflake) and the Slack webhook pointed at a local
+HTTP sink. Every round writes one synthetic file per table, sends them to
+detect-schema-change as one S3 event, drains the chain, and approves every
+request that reached Slack through auto-deploy.
+
+For each stage the report gives latency percentiles, round trips per
+invocation (S3 calls, Snowflake requests and logins, Slack posts, Lambda
+hand-offs) and the peak Python memory seen in one extra traced round. It also
+counts the files loaded against the files written; each should load once.
+
+Usage:
+    python benchmark/pipeline_benchmark.py [--tables 20] [--width 40] [--rows 1000] [--rounds 10]
+                                           [--change-rate 0.3] [--seed 1] [--json]
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from collections import defaultdict
+from time import perf_counter
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'tools'))
+
+import fakes  # noqa: E402
+import generate  # noqa: E402
+
+BUCKET = 'wormholeltd-bucket'
+STAGES = ['detect-schema-change', 'generate-ddl', 'noti-and-deploy-for-auto-deploy-cases', 'request-approval', 'auto-deploy']
+ROUND_TRIPS = ['s3', 'snowflake_requests', 'snowflake_logins', 'slack_posts', 'invokes']
+
+
+def percentile(values, q):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered) * q // 100) - 1))]
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='wormhole-bench-')
+        self.queue_dir = os.path.join(self.workdir, 'queue')
+        os.makedirs(self.queue_dir)
+        # Read by the wormhole layer when it is imported
+        os.environ['PIPELINE_QUEUE_DIR'] = self.queue_dir
+
+        import snowflake.connector
+        import step_runner
+        import wormhole.aws
+
+        self.step_runner = step_runner
+        self.s3 = fakes.FileS3(os.path.join(self.workdir, 's3'))
+        self.snowflake = fakes.FakeSnowflake(copy_seconds=args.copy_ms / 1000)
+        self.slack = fakes.SlackSink(rate_limit_every=args.slack_rate_limit_every)
+        wormhole.aws.clients['s3'] = self.s3
+        snowflake.connector.connect = self.snowflake.connect
+        self.snowflake.stage_files = self.stage_files
+        self.snowflake.stage_reader = self.read_stage_file
+
+        self.rng = generate.new_rng(args.seed)
+        self.tables = generate.make_tables(args.tables, args.width, self.rng)
+        self.write_config()
+        generate.write_monitored_tables(self.s3.path(BUCKET, 'config/monitored-tables.csv'), self.tables)
+        for table in self.tables:
+            self.snowflake.create_table('INGESTION', table.name, table.catalog_columns())
+
+        self.devnull = open(os.devnull, 'w')
+        self.tracing = False
+        self.latency_ms = defaultdict(list)
+        self.round_trips = defaultdict(lambda: defaultdict(int))
+        self.peak_bytes = defaultdict(int)
+        self.round_ms = []
+        self.changes = 0
+        self.files_written = 0
+
+    def write_config(self):
+        path = self.s3.path(BUCKET, 'config/config-snowflake.csv')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['user', 'password', 'account', 'schema', 'warehouse', 'database', 'role', 'slack_webhook_url'])
+            writer.writerow(['bench', 'bench', 'local', 'INGESTION', 'BENCH_WH', 'WORMHOLE', 'SYSADMIN', self.slack.url])
+
+    def stage_files(self, table_name):
+        # Keys under data/<table>/, relative to the stage as COPY lists them
+        directory = self.s3.path(BUCKET, f'data/{table_name}/')
+        return sorted(f'{table_name}/{name}' for name in os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def read_stage_file(self, path):
+        # The stage is s3://<bucket>/data/; Snowflake reads the file itself, so it is not counted as an S3 call
+        with open(self.s3.path(BUCKET, f'data/{path}'), 'rb') as f:
+            return f.read()
+
+    def counters(self):
+        return {
+            's3': sum(self.s3.calls.values()),
+            'snowflake_requests': self.snowflake.calls['request'],
+            'snowflake_logins': self.snowflake.calls['connect'],
+            'slack_posts': self.slack.posts,
+            'invokes': len([name for name in os.listdir(self.queue_dir) if name.endswith('.json')]),
+        }
+
+    def run(self, function_name, event):
+        before = self.counters()
+        if self.tracing:
+            tracemalloc.reset_peak()
+        started, load_check_seconds = perf_counter(), self.snowflake.load_check_seconds
+        # Handler logs go to /dev/null unless --verbose; they are still formatted, as in Lambda
+        with contextlib.redirect_stdout(sys.stdout if self.args.verbose else self.devnull):
+            result = self.step_runner.run_stage(function_name, event)
+        # The fake's checks of the loaded values stand in for Snowflake's own work, which --copy-ms models
+        elapsed_ms = (perf_counter() - started - (self.snowflake.load_check_seconds - load_check_seconds)) * 1000
+        after = self.counters()
+        if self.tracing:
+            self.peak_bytes[function_name] = max(self.peak_bytes[function_name], tracemalloc.get_traced_memory()[1])
+        else:
+            self.latency_ms[function_name].append(elapsed_ms)
+            for name in ROUND_TRIPS:
+                self.round_trips[function_name][name] += after[name] - before[name]
+        return result
+
+    def run_round(self, round_number):
+        keys, changes = generate.write_round(self.s3.root, BUCKET, self.tables, round_number, self.args.rows, self.args.change_rate, self.rng)
+        self.changes += len(changes)
+        self.files_written += len(keys)
+        event = {'Records': [{'eventSource': 'aws:s3', 's3': {'bucket': {'name': BUCKET}, 'object': {'key': key}}} for key in keys]}
+        started, load_check_seconds = perf_counter(), self.snowflake.load_check_seconds
+        self.run('detect-schema-change', event)
+        self.step_runner.drain(self.queue_dir, run=self.run)
+        for approval in fakes.approval_events(self.slack.take_messages()):
+            self.run('auto-deploy', approval)
+        return (perf_counter() - started - (self.snowflake.load_check_seconds - load_check_seconds)) * 1000
+
+    def run_all(self):
+        for round_number in range(self.args.rounds):
+            self.round_ms.append(self.run_round(round_number))
+        # One more round under tracemalloc for peak memory; it slows the code down, so it is not timed
+        self.tracing = True
+        tracemalloc.start()
+        try:
+            self.run_round(self.args.rounds)
+        finally:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def report(self):
+        stages = {}
+        for stage in STAGES + sorted(set(self.latency_ms) - set(STAGES)):
+            values = self.latency_ms.get(stage)
+            if not values:
+                continue
+            stages[stage] = {
+                'invocations': len(values),
+                'p50_ms': round(percentile(values, 50), 2),
+                'p95_ms': round(percentile(values, 95), 2),
+                'p99_ms': round(percentile(values, 99), 2),
+                'mean_ms': round(sum(values) / len(values), 2),
+                'round_trips_per_invocation': {name: round(self.round_trips[stage][name] / len(values), 2) for name in ROUND_TRIPS},
+                'peak_memory_mib': round(self.peak_bytes[stage] / 2 ** 20, 2),
+            }
+        statuses = self.snowflake.db.execute('select STATUS, count(*) from SCHEMA_MANAGEMENT__DDL_HISTORY group by STATUS').fetchall()
+        return {
+            'parameters': vars(self.args),
+            'rounds': {
+                'p50_ms': round(percentile(self.round_ms, 50), 2),
+                'p95_ms': round(percentile(self.round_ms, 95), 2),
+                'p99_ms': round(percentile(self.round_ms, 99), 2),
+            },
+            'stages': stages,
+            'schema_changes_generated': self.changes,
+            'ddl_history': {status: count for status, count in statuses},
+            'ddl_queue': self.snowflake.db.execute('select count(*) from SCHEMA_MANAGEMENT__DDL_QUEUE').fetchone()[0],
+            'loads': len(self.snowflake.loads),
+            'files_loaded': sum(len(files) for name, table, files in self.snowflake.loads),
+            'files_written': self.files_written,
+            's3_bytes_read': self.s3.bytes_read,
+        }
+
+    def close(self):
+        self.slack.close()
+        self.devnull.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def print_report(report):
+    rounds = report['rounds']
+    print(f"rounds: p50 {rounds['p50_ms']} ms, p95 {rounds['p95_ms']} ms, p99 {rounds['p99_ms']} ms")
+    print(f"{'stage':40} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MiB':>9}  round trips per invocation")
+    for stage, stats in report['stages'].items():
+        trips = ', '.join(f'{name} {value:g}' for name, value in stats['round_trips_per_invocation'].items() if value)
+        print(f"{stage:40} {stats['invocations']:>5} {stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9} {stats['peak_memory_mib']:>9}  {trips}")
+    print(f"schema changes generated: {report['schema_changes_generated']}, DDL_HISTORY: {report['ddl_history']}, DDL_QUEUE: {report['ddl_queue']}, loads: {report['loads']}, "
+          f"files loaded: {report['files_loaded']} of {report['files_written']} written")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tables', type=int, default=20)
+    parser.add_argument('--width', type=int, default=40, help='columns per table')
+    parser.add_argument('--rows', type=int, default=1000, help='rows per file')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--change-rate', type=float, default=0.3, help='share of files that change their table schema')
+    parser.add_argument('--copy-ms', type=float, default=0.0, help='time the fake COPY_SP takes')
+    parser.add_argument('--slack-rate-limit-every', type=int, default=0, help='answer every n-th Slack post with 429')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--verbose', action='store_true', help='show the handlers\' own output')
+    args = parser.parse_args(argv[1:])
+
+    bench = Bench(args)
+    try:
+        bench.run_all()
+        report = bench.report()
+    finally:
+        bench.close()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,127 @@
+"""Compare the schema inference backends and modes of detect-schema-change.
+
+Writes large synthetic CSV files to the local S3 stand-in and infers each one
+with get_profiles_from_s3: with SCHEMA_INFERENCE_BACKEND=lambda in exact mode
+(one pass over the streamed object, the baseline), with the lambda backend in
+--mode if it is not exact (e.g. parallel, with --workers processes), and with
+SCHEMA_INFERENCE_BACKEND=snowflake (INFER_SCHEMA and one aggregate run on the
+staged file). For each variant the report gives the latency, the S3 bytes and
+requests the function made, the Snowflake requests, and whether the schema
+matches the baseline.
+
+Snowflake is emulated on SQLite, so the snowflake backend's latency here is
+the emulator's, not the warehouse's; the bytes moved are what to compare.
+Parallel mode reads from worker processes, whose S3 calls the parent's
+stand-in does not see, so their bytes come from the schema.infer span and
+each worker counts as one request.
+
+Usage:
+    python benchmark/schema_inference_benchmark.py [--files 3] [--rows 200000] [--width 40] [--mode exact|sample|parallel]
+                                                   [--workers 4] [--json]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+from argparse import Namespace
+from time import perf_counter
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'tools'))
+
+import generate  # noqa: E402
+from pipeline_benchmark import BUCKET, Bench, percentile  # noqa: E402
+
+
+
+def load_detect_module():
+    path = os.path.join(BENCHMARK_DIR, '..', 'aws', 'lambda', 'detect-schema-change.py')
+    spec = importlib.util.spec_from_file_location('detect_schema_change', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run(args):
+    bench = Bench(Namespace(tables=args.files, width=args.width, rows=args.rows, rounds=0, change_rate=0.0, copy_ms=0.0,
+                            slack_rate_limit_every=0, seed=args.seed, json=False, verbose=False))
+    try:
+        from wormhole.instrumentation import add_hook
+        detect = load_detect_module()
+        keys = []
+        for table in bench.tables:
+            key = f'{table.key_prefix}20231228_inference.csv'
+            generate.write_file(bench.s3.path(BUCKET, key), table, args.rows, bench.rng)
+            keys.append(key)
+        object_bytes = sum(os.path.getsize(bench.s3.path(BUCKET, key)) for key in keys)
+        # Load the config once, so neither backend pays for it
+        detect.load_config()
+
+        if args.workers:
+            detect.SCHEMA_PARALLEL_WORKERS = args.workers
+        # Parallel mode splits objects of any size here, so small benchmark files are split too
+        detect.SCHEMA_PARALLEL_MIN_BYTES = 0
+        # Attributes of the last schema.infer span
+        inferred = {}
+        add_hook(lambda name, elapsed_ms, attributes, error: name == 'schema.infer' and inferred.update(attributes))
+
+        variants = [('lambda', 'exact')] + ([('lambda', args.mode)] if args.mode != 'exact' else []) + [('snowflake', args.mode)]
+        results = {}
+        schemas = {}
+        for backend, mode in variants:
+            detect.SCHEMA_INFERENCE_BACKEND = backend
+            latency_ms, s3_bytes, s3_requests, snowflake_requests, matches = [], 0, 0, 0, 0
+            for key in keys:
+                s3_before, bytes_before = sum(bench.s3.calls.values()), bench.s3.bytes_read
+                inferred.clear()
+                snowflake_before = bench.snowflake.calls['request']
+                started = perf_counter()
+                schema = detect.profiles_to_schema(detect.get_profiles_from_s3(BUCKET, key, mode))
+                latency_ms.append((perf_counter() - started) * 1000)
+                s3_requests += sum(bench.s3.calls.values()) - s3_before + inferred.get('workers', 0)
+                s3_bytes += inferred['bytes'] if 'workers' in inferred else bench.s3.bytes_read - bytes_before
+                snowflake_requests += bench.snowflake.calls['request'] - snowflake_before
+                records = schema.to_dict(orient='records')
+                schemas.setdefault(key, records)
+                matches += records == schemas[key]
+            results[f'{backend}/{mode}'] = {
+                'p50_ms': round(percentile(latency_ms, 50), 2),
+                'max_ms': round(max(latency_ms), 2),
+                's3_bytes_read': s3_bytes,
+                's3_requests': s3_requests,
+                'snowflake_requests': snowflake_requests,
+                'schemas_matching_baseline': matches,
+            }
+        return {'parameters': vars(args), 'files': len(keys), 'object_bytes': object_bytes, 'variants': results}
+    finally:
+        bench.close()
+
+
+def print_report(report):
+    print(f"{report['files']} files, {report['object_bytes'] / 2 ** 20:.1f} MiB, mode {report['parameters']['mode']}")
+    print(f"{'variant':18} {'p50 ms':>9} {'max ms':>9} {'S3 MiB read':>12} {'S3 requests':>12} {'Snowflake requests':>19} {'same schema':>12}")
+    for variant, stats in report['variants'].items():
+        print(f"{variant:18} {stats['p50_ms']:>9} {stats['max_ms']:>9} {stats['s3_bytes_read'] / 2 ** 20:>12.2f} {stats['s3_requests']:>12} "
+              f"{stats['snowflake_requests']:>19} {stats['schemas_matching_baseline']:>7} of {report['files']}")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=200000, help='rows per file')
+    parser.add_argument('--width', type=int, default=40, help='columns per file')
+    parser.add_argument('--mode', choices=['exact', 'sample', 'parallel'], default='exact', help='SCHEMA_INFERENCE_MODE')
+    parser.add_argument('--workers', type=int, default=0, help='SCHEMA_PARALLEL_WORKERS (default: the number of CPUs)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv[1:])
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -19,19 +19,41 @@ create or replace TABLE WORMHOLE.SCHEMA_MANAGEMENT.CHANGE_HISTORY (
 );
 
 
+-- Existing deployments: run migrate_ddl_queue.sql instead of recreating DDL_HISTORY, DDL_QUEUE and the sequence
+
+-- generate-ddl takes the IDs of new DDL_HISTORY rows from this sequence, so it can queue them in DDL_QUEUE
+create or replace sequence WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY_ID_SEQ start = 1 increment = 1 order;
+
 create or replace TABLE WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY (
-	ID NUMBER(38,0) NOT NULL autoincrement start 1 increment 1 order,
+	ID NUMBER(38,0) NOT NULL default WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY_ID_SEQ.nextval,
 	DATABASE_NAME VARCHAR(50),
 	SCHEMA_NAME VARCHAR(50),
 	TABLE_NAME VARCHAR(50),
 	STATUS VARCHAR(50),
 	CHANGES VARCHAR(16777216),
 	DDL_STATEMENT VARCHAR(16777216),
+	ESTIMATED_COST NUMBER(38,0),
+	-- Files the change held back, as JSON {file type: [keys relative to the stage]}; deployment loads exactly these
+	FILES VARCHAR(16777216),
 	CREATED_AT TIMESTAMP_NTZ(9),
 	UPDATED_AT TIMESTAMP_NTZ(9),
 	primary key (ID)
 );
 
+-- Rows of DDL_HISTORY that still need work ('pending deployment', 'requesting approval', 'pending approval').
+-- Stages claim rows by setting LEASE_OWNER (the Lambda request ID) and LEASE_EXPIRES_AT in one UPDATE;
+-- rows leave the table when they reach a final status, so it only grows with the pending work.
+create or replace TABLE WORMHOLE.SCHEMA_MANAGEMENT.DDL_QUEUE (
+	ID NUMBER(38,0) NOT NULL,
+	STATUS VARCHAR(50),
+	LEASE_OWNER VARCHAR(64),
+	LEASE_EXPIRES_AT TIMESTAMP_NTZ(9),
+	ATTEMPTS NUMBER(38,0) DEFAULT 0,
+	ENQUEUED_AT TIMESTAMP_NTZ(9),
+	primary key (ID)
+)
+cluster by (STATUS);
+
 create schema WORMHOLE.INGESTION;
 
 create or replace table WORMHOLE.INGESTION.EMPLOYEES (
@@ -12,13 +12,52 @@ DESC INTEGRATION integration_s3;
 
 
 -- Create file format
+
+-- COPY_SP loads CSV files by header name (MATCH_BY_COLUMN_NAME needs PARSE_HEADER), not by position: a column
+-- whose type change rewrites it moves to the end of the table, and a column removed from the files leaves a gap.
+-- Columns a file does not have are loaded as NULL.
 CREATE OR REPLACE FILE FORMAT WORMHOLE.INGESTION.CSV_FORMAT
   TYPE = CSV
   FIELD_DELIMITER = ','
-  SKIP_HEADER = 1
+  PARSE_HEADER = TRUE
   NULL_IF = ('NULL', 'null')
+  EMPTY_FIELD_AS_NULL = true
+  ERROR_ON_COLUMN_COUNT_MISMATCH = false;
+
+-- Columnar and JSON Lines files; COPY_SP loads them with MATCH_BY_COLUMN_NAME
+CREATE OR REPLACE FILE FORMAT WORMHOLE.INGESTION.PARQUET_FORMAT
+  TYPE = PARQUET;
+
+CREATE OR REPLACE FILE FORMAT WORMHOLE.INGESTION.ORC_FORMAT
+  TYPE = ORC;
+
+-- STRIP_OUTER_ARRAY loads each element of a .json file holding an array of objects as a row;
+-- JSON Lines files and files of plain objects have no outer array and load as before
+CREATE OR REPLACE FILE FORMAT WORMHOLE.INGESTION.JSON_FORMAT
+  TYPE = JSON
+  STRIP_OUTER_ARRAY = TRUE;
+
+
+-- Server-side schema inference (SCHEMA_INFERENCE_BACKEND=snowflake): INFER_SCHEMA reads the header names
+-- with CSV_INFER_FORMAT, and the length scan reads the rows with CSV_SCAN_FORMAT. Both treat the values
+-- pandas reads as missing as NULL, so the two backends see the same nulls.
+CREATE OR REPLACE FILE FORMAT WORMHOLE.INGESTION.CSV_INFER_FORMAT
+  TYPE = CSV
+  FIELD_DELIMITER = ','
+  PARSE_HEADER = TRUE
+  FIELD_OPTIONALLY_ENCLOSED_BY = '"'
+  NULL_IF = ('', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null')
   EMPTY_FIELD_AS_NULL = true;
 
+CREATE OR REPLACE FILE FORMAT WORMHOLE.INGESTION.CSV_SCAN_FORMAT
+  TYPE = CSV
+  FIELD_DELIMITER = ','
+  SKIP_HEADER = 1
+  FIELD_OPTIONALLY_ENCLOSED_BY = '"'
+  NULL_IF = ('', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null')
+  EMPTY_FIELD_AS_NULL = true
+  ERROR_ON_COLUMN_COUNT_MISMATCH = false;
+
 
 -- Create external stage
 CREATE or replace STAGE WORMHOLE.INGESTION.S3_STAGE
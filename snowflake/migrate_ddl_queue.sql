@@ -0,0 +1,36 @@
+-- Upgrade an existing deployment to DDL_QUEUE, the DDL_HISTORY_ID_SEQ sequence and the new DDL_HISTORY columns
+-- (new deployments get them from DDL.sql).
+-- Run it once before deploying the new Lambdas, while no DDL is being generated; it keeps the rows of DDL_HISTORY.
+
+alter table WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY add column if not exists ESTIMATED_COST NUMBER(38,0);
+-- Rows without FILES (queued before this column) load all of the table's files not loaded yet when deployed
+alter table WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY add column if not exists FILES VARCHAR(16777216);
+
+-- generate-ddl takes the IDs of new rows from the sequence, so it has to start above the IDs already in DDL_HISTORY.
+-- Snowflake does not enforce primary keys: a reused ID would make DDL_QUEUE updates move two history rows.
+execute immediate $$
+declare
+    next_id number;
+begin
+    select coalesce(max(ID), 0) + 1 into :next_id from WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY;
+    execute immediate 'create or replace sequence WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY_ID_SEQ start = ' || next_id || ' increment = 1 order';
+    return next_id;
+end;
+$$;
+
+create table if not exists WORMHOLE.SCHEMA_MANAGEMENT.DDL_QUEUE (
+	ID NUMBER(38,0) NOT NULL,
+	STATUS VARCHAR(50),
+	LEASE_OWNER VARCHAR(64),
+	LEASE_EXPIRES_AT TIMESTAMP_NTZ(9),
+	ATTEMPTS NUMBER(38,0) DEFAULT 0,
+	ENQUEUED_AT TIMESTAMP_NTZ(9),
+	primary key (ID)
+)
+cluster by (STATUS);
+
+-- Queue the rows that are still open; rows already queued are left alone, so the script can be run again
+insert into WORMHOLE.SCHEMA_MANAGEMENT.DDL_QUEUE (ID, STATUS, ATTEMPTS, ENQUEUED_AT)
+	select h.ID, h.STATUS, 0, h.CREATED_AT from WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY h
+	where h.STATUS in ('pending deployment', 'requesting approval', 'pending approval')
+	and not exists (select 1 from WORMHOLE.SCHEMA_MANAGEMENT.DDL_QUEUE q where q.ID = h.ID);
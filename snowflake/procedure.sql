@@ -1,25 +1,107 @@
 -- Create proc to load data from external stage into table
+-- FILE_TYPE is CSV, PARQUET, ORC or JSON (JSON Lines or .json). FILES lists the files to load, relative to the stage
+-- (e.g. 'EMPLOYEES/20231228.csv'); when it is NULL, all of the files in that format under a directory named after
+-- the table that are not loaded yet are, whatever their date. Deployments pass the files the change held back
+-- (DDL_HISTORY.FILES), since key_prefix and key_pattern can route files from any directory.
+-- Files are never forced: Snowflake's load metadata skips files that were already loaded, so repeated calls
+-- only load new files. Returns the files loaded with their row counts, and the time and query IDs of the COPYs.
+CREATE OR REPLACE PROCEDURE WORMHOLE.INGESTION.COPY_SP(TABLE_NAME varchar, FILE_TYPE varchar, FILES array)
+RETURNS VARIANT
+LANGUAGE JAVASCRIPT
+AS
+$$
+
+
+    // The table's directory at any depth, but not a directory that only ends with its name (OLD_EMPLOYEES/)
+    var prefix = "(.*/)?" + TABLE_NAME.split('.').pop() + "/";
+    // File name patterns and COPY options per format; CSV also covers files without an extension.
+    // Every format is loaded by column name, so the order of the table's columns does not matter
+    var formats = {
+        "CSV": {pattern: prefix + "[^.]*([.]csv)?", options: "file_format = (format_name = 'WORMHOLE.INGESTION.CSV_FORMAT') match_by_column_name = CASE_INSENSITIVE"},
+        "PARQUET": {pattern: prefix + ".*[.]parquet", options: "file_format = (format_name = 'WORMHOLE.INGESTION.PARQUET_FORMAT') match_by_column_name = CASE_INSENSITIVE"},
+        "ORC": {pattern: prefix + ".*[.]orc", options: "file_format = (format_name = 'WORMHOLE.INGESTION.ORC_FORMAT') match_by_column_name = CASE_INSENSITIVE"},
+        "JSON": {pattern: prefix + ".*[.](jsonl|ndjson|json)", options: "file_format = (format_name = 'WORMHOLE.INGESTION.JSON_FORMAT') match_by_column_name = CASE_INSENSITIVE"}
+    };
+    var format = formats[FILE_TYPE.toUpperCase()];
+    if (!format) {
+        throw "Unknown file type " + FILE_TYPE;
+    }
+    var result = {table: TABLE_NAME, file_type: FILE_TYPE.toUpperCase(), files: [], rows_loaded: 0, elapsed_ms: 0, query_ids: []};
+
+    function copy(source) {
+        var started = Date.now();
+        var sql_cmd = "copy into " + TABLE_NAME + " from @wormhole.INGESTION.s3_stage " + source + " " + format.options + ";";
+        var sql_stmt = snowflake.createStatement({sqlText: sql_cmd});
+        var rows = sql_stmt.execute();
+        result.query_ids.push(sql_stmt.getQueryId());
+        // One row per file: file, status, rows_parsed, rows_loaded, error_limit, errors_seen, first_error, ...
+        // ("Copy executed with 0 files processed." has a single column)
+        while (rows.next()) {
+            if (sql_stmt.getColumnCount() < 7) {
+                continue;
+            }
+            var file = {
+                file: rows.getColumnValue(1),
+                status: rows.getColumnValue(2),
+                rows_parsed: rows.getColumnValue(3),
+                rows_loaded: rows.getColumnValue(4),
+                errors_seen: rows.getColumnValue(6),
+                first_error: rows.getColumnValue(7)
+            };
+            result.rows_loaded += file.rows_loaded;
+            result.files.push(file);
+        }
+        result.elapsed_ms += Date.now() - started;
+    }
+
+    if (FILES) {
+        // COPY takes at most 1000 files per statement
+        for (var i = 0; i < FILES.length; i += 1000) {
+            var names = FILES.slice(i, i + 1000).map(function (f) { return "'" + String(f).replace(/'/g, "''") + "'"; });
+            copy("files = (" + names.join(", ") + ")");
+        }
+    } else {
+        copy("pattern = '" + format.pattern + "'");
+    }
+    return result;
+
+$$;
+
+-- Load the table's files not loaded yet in one format
+CREATE OR REPLACE PROCEDURE WORMHOLE.INGESTION.COPY_SP(TABLE_NAME varchar, FILE_TYPE varchar)
+RETURNS VARIANT
+LANGUAGE JAVASCRIPT
+AS
+$$
+
+    var sql_stmt = snowflake.createStatement({sqlText: "call WORMHOLE.INGESTION.COPY_SP(?, ?, NULL)", binds: [TABLE_NAME, FILE_TYPE]});
+    var rows = sql_stmt.execute();
+    rows.next();
+    return rows.getColumnValue(1);
+
+$$;
+
+-- Load the table's files not loaded yet in every format
 CREATE OR REPLACE PROCEDURE WORMHOLE.INGESTION.COPY_SP(TABLE_NAME varchar)
 RETURNS VARIANT
 LANGUAGE JAVASCRIPT
 AS
 $$
 
-   
-    function twoDigit(n) { return (n < 10 ? '0' : '') + n; }
-    var now = new Date(new Date().getTime() + (15 * 60 * 60 * 1000));
-    currentDate = now.getFullYear() + twoDigit(now.getMonth() + 1) + twoDigit(now.getDate());
-    var pattern = ".*" + TABLE_NAME.split('.').pop() + "/" + currentDate + ".*"
-    var return_rows = [];
-
-    var sql_cmd = "copy into " + TABLE_NAME + " from @wormhole.INGESTION.s3_stage pattern='" + pattern + "' FORCE = TRUE; ";
-    var sql_stmt = snowflake.createStatement({sqlText: sql_cmd});
-    var result = sql_stmt.execute();
-    result.next();
-    return_rows.push(result.getColumnValue(1))
-    
-    return return_rows;
-        
+    var result = {table: TABLE_NAME, files: [], rows_loaded: 0, elapsed_ms: 0, query_ids: []};
+    var file_types = ["CSV", "PARQUET", "ORC", "JSON"];
+    for (var i = 0; i < file_types.length; i++) {
+        var sql_stmt = snowflake.createStatement({sqlText: "call WORMHOLE.INGESTION.COPY_SP(?, ?, NULL)", binds: [TABLE_NAME, file_types[i]]});
+        var rows = sql_stmt.execute();
+        rows.next();
+        var loaded = rows.getColumnValue(1);
+        result.files = result.files.concat(loaded.files);
+        result.rows_loaded += loaded.rows_loaded;
+        result.elapsed_ms += loaded.elapsed_ms;
+        result.query_ids = result.query_ids.concat(loaded.query_ids);
+    }
+    return result;
+
 $$;
 
 call INGESTION.COPY_SP('INGESTION.EMPLOYEES');
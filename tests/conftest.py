@@ -0,0 +1,52 @@
+"""Shared setup for the unit tests.
+
+The handlers import the wormhole package from the Lambda layer, and the
+Snowflake-backed tests run against the benchmark's FakeSnowflake, so both
+directories go on sys.path. Handler files have dashes in their names and are
+loaded by path.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LAMBDA_DIR = os.path.join(REPO_DIR, 'aws', 'lambda')
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'layer', 'python'))
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmark'))
+
+# The credentials run_query reads; FakeSnowflake ignores them
+CONFIG = [{'user': 'test', 'password': 'test', 'account': 'local', 'schema': 'INGESTION', 'warehouse': 'TEST_WH',
+           'database': 'WORMHOLE', 'role': 'SYSADMIN'}]
+
+
+def load_lambda(function_name):
+    path = os.path.join(LAMBDA_DIR, f'{function_name}.py')
+    spec = importlib.util.spec_from_file_location(function_name.replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def detect():
+    return load_lambda('detect-schema-change')
+
+
+@pytest.fixture(scope='session')
+def generate_ddl():
+    return load_lambda('generate-ddl')
+
+
+@pytest.fixture
+def snowflake(monkeypatch):
+    # A fresh FakeSnowflake behind snowflake.connector.connect; the pooled session is dropped on both sides
+    import fakes
+    import snowflake.connector
+    from wormhole.sql import close_connection
+    server = fakes.FakeSnowflake()
+    monkeypatch.setattr(snowflake.connector, 'connect', server.connect)
+    close_connection()
+    yield server
+    close_connection()
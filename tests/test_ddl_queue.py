@@ -0,0 +1,82 @@
+import pytest
+from conftest import CONFIG
+
+from wormhole import ddl_queue
+from wormhole.ddl_queue import claim, enqueue, move, next_ids, release
+from wormhole.sql import insert_rows
+
+
+@pytest.fixture
+def queued(snowflake):
+    # Three DDLs as generate-ddl writes them: two for EMPLOYEES waiting for deployment, one waiting for approval
+    def queue(rows):
+        ids = next_ids(len(rows), CONFIG)
+        insert_rows('WORMHOLE.SCHEMA_MANAGEMENT.DDL_HISTORY', ['id', 'database_name', 'schema_name', 'table_name', 'status', 'ddl_statement', 'files'],
+                    [(ddl_id, 'WORMHOLE', 'INGESTION', table, status, f'-- {table} {ddl_id}', '{}') for ddl_id, (table, status) in zip(ids, rows)], CONFIG)
+        enqueue([(ddl_id, status) for ddl_id, (table, status) in zip(ids, rows)], CONFIG)
+        return ids
+    return queue([('EMPLOYEES', 'pending deployment'), ('EMPLOYEES', 'pending deployment'), ('SALES', 'requesting approval')])
+
+
+def history_status(snowflake, ddl_id):
+    return snowflake.db.execute('select STATUS from SCHEMA_MANAGEMENT__DDL_HISTORY where ID = ?', (ddl_id,)).fetchone()[0]
+
+
+def queue_ids(snowflake):
+    return [row[0] for row in snowflake.db.execute('select ID from SCHEMA_MANAGEMENT__DDL_QUEUE order by ID')]
+
+
+def test_claim_leases_the_rows_in_a_status(snowflake, queued):
+    rows = claim('pending deployment', 'worker-1', CONFIG)
+    assert [row['ID'] for row in rows] == queued[:2]
+    assert set(rows[0]) == set(ddl_queue.CLAIM_COLUMNS)
+    # Leased rows are not handed to a second worker
+    assert claim('pending deployment', 'worker-2', CONFIG) == []
+    assert [row['ID'] for row in claim('requesting approval', 'worker-2', CONFIG)] == queued[2:]
+
+
+def test_claim_by_id_takes_only_that_row(snowflake, queued):
+    assert [row['ID'] for row in claim('pending deployment', 'worker-1', CONFIG, ddl_id=queued[1])] == [queued[1]]
+    assert claim('pending deployment', 'worker-2', CONFIG, ddl_id=queued[1]) == []
+    assert claim('requesting approval', 'worker-2', CONFIG, ddl_id=queued[0]) == []
+
+
+def test_move_to_a_final_status_removes_the_row_from_the_queue(snowflake, queued):
+    claim('pending deployment', 'worker-1', CONFIG)
+    assert move([queued[0]], 'worker-1', 'done deployment', CONFIG) == 1
+    assert history_status(snowflake, queued[0]) == 'done deployment'
+    assert queue_ids(snowflake) == queued[1:]
+
+
+def test_move_to_an_open_status_requeues_the_row(snowflake, queued):
+    claim('requesting approval', 'worker-1', CONFIG)
+    move([queued[2]], 'worker-1', 'pending approval', CONFIG)
+    assert history_status(snowflake, queued[2]) == 'pending approval'
+    assert [row['ID'] for row in claim('pending approval', 'worker-2', CONFIG)] == [queued[2]]
+
+
+def test_move_only_touches_rows_leased_to_the_owner(snowflake, queued):
+    claim('pending deployment', 'worker-1', CONFIG)
+    assert move([queued[0]], 'worker-2', 'done deployment', CONFIG) == 0
+    assert history_status(snowflake, queued[0]) == 'pending deployment'
+    assert queue_ids(snowflake) == queued
+
+
+def test_release_lets_another_worker_claim_the_row(snowflake, queued):
+    claim('pending deployment', 'worker-1', CONFIG)
+    assert release([queued[1]], 'worker-1', CONFIG) == 1
+    assert [row['ID'] for row in claim('pending deployment', 'worker-2', CONFIG)] == [queued[1]]
+    assert history_status(snowflake, queued[1]) == 'pending deployment'
+
+
+def test_expired_lease_can_be_claimed_again(snowflake, queued, monkeypatch):
+    monkeypatch.setattr(ddl_queue, 'LEASE_SECONDS', -1)
+    claim('pending deployment', 'worker-1', CONFIG)
+    assert [row['ID'] for row in claim('pending deployment', 'worker-2', CONFIG)] == queued[:2]
+
+
+def test_rows_claimed_too_often_are_left_alone(snowflake, queued, monkeypatch):
+    monkeypatch.setattr(ddl_queue, 'LEASE_SECONDS', -1)
+    for attempt in range(ddl_queue.MAX_ATTEMPTS):
+        assert claim('requesting approval', f'worker-{attempt}', CONFIG)
+    assert claim('requesting approval', 'worker-last', CONFIG) == []
@@ -0,0 +1,47 @@
+"""The fakes have to reject what Snowflake rejects, or the benchmark hides bugs."""
+import datetime
+
+import pandas as pd
+import pytest
+from conftest import CONFIG
+from snowflake.connector.errors import ProgrammingError
+
+from wormhole.sql import insert_rows, run_copy
+
+FILE = 'EMPLOYEES/20231228.csv'
+
+
+def test_binds_the_connector_cannot_send_are_rejected(snowflake):
+    columns = ['database_name', 'created_at']
+    assert insert_rows('WORMHOLE.SCHEMA_MANAGEMENT.CHANGE_HISTORY', columns, [('WORMHOLE', datetime.datetime(2023, 12, 28))], CONFIG) == 1
+    with pytest.raises(ProgrammingError, match='255001'):
+        insert_rows('WORMHOLE.SCHEMA_MANAGEMENT.CHANGE_HISTORY', columns, [('WORMHOLE', pd.Timestamp('2023-12-28'))], CONFIG)
+
+
+@pytest.fixture
+def rewritten_table(snowflake):
+    # SALARY went from NUMBER to VARCHAR through a rewrite, which moved it to the end of the table;
+    # the files keep their own column order
+    snowflake.create_table('INGESTION', 'EMPLOYEES', [('EMPLOYEEID', 'NUMBER', None), ('SALARY', 'NUMBER', None), ('AGE', 'NUMBER', None)])
+    snowflake.alter_table('EMPLOYEES', 'add column SALARY__NEW VARCHAR(20)')
+    snowflake.alter_table('EMPLOYEES', 'drop column SALARY')
+    snowflake.alter_table('EMPLOYEES', 'rename column SALARY__NEW to SALARY')
+    snowflake.stage_reader = lambda path: b'EMPLOYEEID,SALARY,AGE\n1,n/a,40\n2,1200,\n'
+    return snowflake
+
+
+def test_csv_loads_by_column_name(rewritten_table):
+    assert [name for name, data_type, length in rewritten_table.table_columns('INGESTION', 'EMPLOYEES')] == ['EMPLOYEEID', 'AGE', 'SALARY']
+    assert run_copy('INGESTION.EMPLOYEES', CONFIG, 'CSV', [FILE])['rows_loaded'] == 2
+
+
+def test_positional_csv_load_fails_after_a_rewrite(rewritten_table):
+    rewritten_table.csv_match_by_column_name = False
+    with pytest.raises(ValueError, match="Numeric value 'n/a' is not recognized"):
+        run_copy('INGESTION.EMPLOYEES', CONFIG, 'CSV', [FILE])
+
+
+def test_value_longer_than_the_column_fails_the_copy(rewritten_table):
+    rewritten_table.stage_reader = lambda path: b'EMPLOYEEID,SALARY,AGE\n1,' + b'x' * 21 + b',40\n'
+    with pytest.raises(ValueError, match='User character length limit'):
+        run_copy('INGESTION.EMPLOYEES', CONFIG, 'CSV', [FILE])
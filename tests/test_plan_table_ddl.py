@@ -0,0 +1,92 @@
+import pytest
+
+from wormhole.sizing import parse_policy
+
+TABLE = 'WORMHOLE.INGESTION.EMPLOYEES'
+
+
+def added(column, data_type):
+    return {'ChangeType': 'ADD NEW COLUMN', 'NEW_COLUMN_NAME': column, 'NEW_DATA_TYPE': data_type}
+
+
+def removed(column):
+    return {'ChangeType': 'REMOVE COLUMN', 'ORIGINAL_COLUMN_NAME': column}
+
+
+def renamed(column, new_name):
+    return {'ChangeType': 'RENAME COLUMN', 'ORIGINAL_COLUMN_NAME': column, 'NEW_COLUMN_NAME': new_name}
+
+
+def retyped(column, old_type, old_length, new_type, new_length):
+    return {'ChangeType': 'CHANGED DATA TYPE', 'ORIGINAL_COLUMN_NAME': column, 'OLD_DATA_TYPE': old_type,
+            'OLD_DATA_LENGTH': old_length, 'NEW_DATA_TYPE': new_type, 'NEW_DATA_LENGTH': new_length}
+
+
+@pytest.fixture
+def plan(generate_ddl):
+    def plan(rows, policy='exact', history=None):
+        return generate_ddl.plan_table_ddl('WORMHOLE', 'INGESTION', 'EMPLOYEES', rows, parse_policy(policy), history)
+    return plan
+
+
+def test_added_columns_deploy_without_approval(plan):
+    result = plan([added('AGE', 'NUMBER'), added('ACTIVE', 'bool')])
+    assert result['statements'] == [f'alter table {TABLE} add column AGE NUMBER, ACTIVE BOOLEAN']
+    assert not result['need_approval']
+    assert result['cost'] == {'statements': 1, 'rewrites': 0, 'estimated_cost': 1}
+
+
+def test_longer_varchar_is_altered_in_place(plan):
+    result = plan([retyped('NAME', 'TEXT', 50, 'TEXT', 70)])
+    assert result['statements'] == [f'alter table {TABLE} alter column NAME set data type VARCHAR(70)']
+    assert result['need_approval']
+    assert result['cost']['rewrites'] == 0
+
+
+def test_varchar_length_comes_from_the_policy(plan):
+    assert plan([retyped('NAME', 'TEXT', 50, 'TEXT', 70)], 'geometric')['statements'] == [
+        f'alter table {TABLE} alter column NAME set data type VARCHAR(100)']
+    assert plan([retyped('NAME', 'TEXT', 50, 'TEXT', 70)], 'percentile:50:0', {'NAME': [60, 90, 120]})['statements'] == [
+        f'alter table {TABLE} alter column NAME set data type VARCHAR(90)']
+
+
+def test_shorter_values_change_nothing(plan):
+    assert plan([retyped('NAME', 'TEXT', 50, 'TEXT', 20), retyped('PRICE', 'FLOAT', 0, 'NUMBER', 0)])['statements'] == []
+
+
+def test_type_change_rewrites_the_table_once_in_a_valid_order(plan):
+    result = plan([retyped('SALARY', 'NUMBER', 0, 'FLOAT', 0), retyped('CODE', 'NUMBER', 0, 'TEXT', 12), added('AGE', 'NUMBER')])
+    assert result['statements'] == [
+        f'alter table {TABLE} add column AGE NUMBER, SALARY__NEW FLOAT, CODE__NEW VARCHAR(12)',
+        f'update {TABLE} set SALARY__NEW = cast(SALARY as FLOAT), CODE__NEW = cast(CODE as VARCHAR(12))',
+        f'alter table {TABLE} drop column SALARY, CODE',
+        f'alter table {TABLE} rename column SALARY__NEW to SALARY',
+        f'alter table {TABLE} rename column CODE__NEW to CODE',
+    ]
+    assert result['need_approval']
+    assert result['cost'] == {'statements': 5, 'rewrites': 1, 'estimated_cost': 104}
+
+
+def test_rewritten_column_that_is_also_renamed_gets_the_new_name(plan):
+    result = plan([retyped('SALARY', 'NUMBER', 0, 'FLOAT', 0), renamed('SALARY', 'PAY'), removed('POSITION')])
+    assert result['statements'] == [
+        f'alter table {TABLE} add column SALARY__NEW FLOAT',
+        f'update {TABLE} set SALARY__NEW = cast(SALARY as FLOAT)',
+        f'alter table {TABLE} drop column SALARY, POSITION',
+        f'alter table {TABLE} rename column SALARY__NEW to PAY',
+    ]
+    assert 'SALARY is renamed to PAY' in result['changes']
+    assert 'POSITION is removed' in result['changes']
+
+
+def test_removed_column_is_not_retyped(plan):
+    result = plan([retyped('SALARY', 'NUMBER', 0, 'FLOAT', 0), removed('SALARY')])
+    assert result['statements'] == [f'alter table {TABLE} drop column SALARY']
+    assert result['cost']['rewrites'] == 0
+
+
+def test_renames_take_one_statement_each(plan):
+    result = plan([renamed('FIRSTNAME', 'FIRST_NAME'), renamed('LASTNAME', 'LAST_NAME')])
+    assert result['statements'] == [f'alter table {TABLE} rename column FIRSTNAME to FIRST_NAME',
+                                     f'alter table {TABLE} rename column LASTNAME to LAST_NAME']
+    assert result['need_approval']
@@ -0,0 +1,52 @@
+import pytest
+
+
+def table(name, key_prefix='', key_pattern='', varchar_policy='', schema='ingestion'):
+    return {'table_schema': schema, 'table_name': name, 'key_prefix': key_prefix, 'key_pattern': key_pattern, 'varchar_policy': varchar_policy}
+
+
+@pytest.fixture
+def route(detect):
+    def route(tables, file_key):
+        return detect.route_file_key(detect.build_table_index(tables), file_key)
+    return route
+
+
+def test_default_prefix_is_the_table_directory(route):
+    tables = [table('EMPLOYEES'), table('OLD_EMPLOYEES')]
+    assert route(tables, 'data/EMPLOYEES/20231228.csv') == [('INGESTION', 'EMPLOYEES')]
+    assert route(tables, 'data/OLD_EMPLOYEES/20231228.csv') == [('INGESTION', 'OLD_EMPLOYEES')]
+    assert route(tables, 'data/EMPLOYEES/2023/12/28.csv') == [('INGESTION', 'EMPLOYEES')]
+    assert route(tables, 'data/EMPLOYEES.csv') == []
+
+
+def test_key_prefix_routes_another_directory(route):
+    tables = [table('EMPLOYEES', key_prefix='exports/hr/')]
+    assert route(tables, 'exports/hr/employees.csv') == [('INGESTION', 'EMPLOYEES')]
+    assert route(tables, 'data/EMPLOYEES/employees.csv') == []
+
+
+def test_key_pattern_matches_the_whole_key(route):
+    tables = [table('SALES', key_pattern=r'data/sales/\d{8}\.csv'), table('ANY_JSON', key_pattern=r'.*\.json')]
+    assert route(tables, 'data/sales/20231228.csv') == [('INGESTION', 'SALES')]
+    assert route(tables, 'data/sales/20231228.csv.bak') == []
+    assert route(tables, 'data/sales/latest.csv') == []
+    assert route(tables, 'anywhere/deep/file.json') == [('INGESTION', 'ANY_JSON')]
+
+
+def test_key_goes_to_every_matching_table(route):
+    tables = [table('EMPLOYEES'), table('EMPLOYEE_AUDIT', key_prefix='data/EMPLOYEES/'), table('CSV_FILES', key_pattern=r'data/.*\.csv')]
+    assert sorted(route(tables, 'data/EMPLOYEES/20231228.csv')) == [('INGESTION', 'CSV_FILES'), ('INGESTION', 'EMPLOYEES'), ('INGESTION', 'EMPLOYEE_AUDIT')]
+
+
+def test_pattern_directory_is_the_literal_start(detect):
+    assert detect.pattern_directory(r'data/sales/\d+\.csv') == 'data/sales/'
+    assert detect.pattern_directory(r'data/sales?/x\.csv') == 'data/'
+    assert detect.pattern_directory(r'data/(a|b)/x\.csv') == ''
+    assert detect.pattern_directory(r'.*\.json') == ''
+
+
+def test_registry_keeps_valid_varchar_policies_only(detect):
+    registry = detect.build_table_index([table('A', varchar_policy='percentile:90'), table('B', varchar_policy='geometric:0.5'), table('C')])
+    assert registry['varchar_policies'] == {'INGESTION.A': 'percentile:90'}
+    assert registry['tables'] == [('INGESTION', 'A'), ('INGESTION', 'B'), ('INGESTION', 'C')]
@@ -0,0 +1,39 @@
+import pytest
+
+from wormhole.sizing import DEFAULT_POLICY, MAX_VARCHAR_LENGTH, parse_policy, widened_length
+
+
+def test_parse_policy_reads_name_and_arguments():
+    assert parse_policy('percentile:90:0.5') == ('percentile', [90.0, 0.5])
+    assert parse_policy(' Geometric:1.5 ') == ('geometric', [1.5])
+    assert parse_policy('exact') == ('exact', [])
+
+
+def test_parse_policy_defaults_when_empty():
+    assert parse_policy(None) == parse_policy('') == parse_policy(DEFAULT_POLICY)
+
+
+@pytest.mark.parametrize('text', [
+    'fibonacci',
+    'exact:2',
+    'geometric:2:3',
+    'geometric:two',
+    'geometric:1',
+    'geometric:0.5',
+    'geometric:inf',
+    'percentile:0',
+    'percentile:101',
+    'percentile:nan',
+    'percentile:95:-0.1',
+])
+def test_parse_policy_rejects_bad_policies(text):
+    with pytest.raises(ValueError, match='VARCHAR sizing policy'):
+        parse_policy(text)
+
+
+def test_widened_length_per_policy():
+    assert widened_length(parse_policy('exact'), 70, 50) == 70
+    assert widened_length(parse_policy('geometric'), 70, 50) == 100
+    assert widened_length(parse_policy('geometric:1.5'), 70, 50) == 75
+    assert widened_length(parse_policy('percentile:50:0'), 70, 50, [10, 80, 90]) == 80
+    assert widened_length(parse_policy('max'), 70, 50) == MAX_VARCHAR_LENGTH
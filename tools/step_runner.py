@@ -0,0 +1,67 @@
+"""Run the Lambda chain offline from a local queue directory.
+
+With PIPELINE_QUEUE_DIR set, each Lambda writes its hand-off to the next
+stage as a JSON file in that directory instead of invoking it. This runner
+loads the handler files from aws/lambda and drains the queue in order.
+
+Usage:
+    PIPELINE_QUEUE_DIR=/tmp/wormhole-queue python tools/step_runner.py [detect-event.json]
+"""
+import importlib.util
+import json
+import os
+import sys
+import uuid
+from types import SimpleNamespace
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aws', 'lambda')
+# The shared wormhole package is deployed as a Lambda layer (/opt/python); load it from the repo instead
+sys.path.insert(0, os.path.join(LAMBDA_DIR, 'layer', 'python'))
+
+handlers = {}
+
+
+def load_handler(function_name):
+    if function_name not in handlers:
+        path = os.path.join(LAMBDA_DIR, f'{function_name}.py')
+        spec = importlib.util.spec_from_file_location(function_name.replace('-', '_'), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        handlers[function_name] = module.lambda_handler
+    return handlers[function_name]
+
+
+def run_stage(function_name, event):
+    context = SimpleNamespace(function_name=function_name, aws_request_id=str(uuid.uuid4()))
+    return load_handler(function_name)(event, context)
+
+
+def drain(queue_dir, run=run_stage):
+    # Messages are named <time_ns>-<function name>.json, so sorting the names gives the order they were queued in
+    results = []
+    while True:
+        messages = sorted(name for name in os.listdir(queue_dir) if name.endswith('.json'))
+        if not messages:
+            return results
+        path = os.path.join(queue_dir, messages[0])
+        with open(path) as f:
+            event = json.load(f)
+        os.remove(path)
+        function_name = messages[0].split('-', 1)[1][:-len('.json')]
+        results.append((function_name, run(function_name, event)))
+
+
+def main(argv):
+    queue_dir = os.environ.get('PIPELINE_QUEUE_DIR')
+    if not queue_dir:
+        sys.exit('PIPELINE_QUEUE_DIR must be set before the Lambda modules are loaded')
+    os.makedirs(queue_dir, exist_ok=True)
+    if len(argv) > 1:
+        with open(argv[1]) as f:
+            print('detect-schema-change', run_stage('detect-schema-change', json.load(f)))
+    for function_name, result in drain(queue_dir):
+        print(function_name, result)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,59 @@
+"""Replay VARCHAR sizing policies against CHANGE_HISTORY.
+
+For each policy, counts the approvals the recorded detection runs needed and
+how many of them the policy would have saved, because the widened column
+already fitted the next longer value. The history is read from Snowflake with
+the pipeline's config, or from a CSV export of CHANGE_HISTORY.
+
+Usage:
+    python tools/varchar_sizing_report.py [--csv change_history.csv] [--policy geometric:2 --policy max ...]
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+
+# The shared wormhole package is deployed as a Lambda layer (/opt/python); load it from the repo instead
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aws', 'lambda', 'layer', 'python'))
+
+DEFAULT_POLICIES = ['exact', 'geometric:1.5', 'geometric:2', 'percentile:95:0.25', 'max']
+
+
+def read_change_history(path=None):
+    if path:
+        with open(path, newline='') as f:
+            rows = [{key.upper(): value for key, value in row.items()} for row in csv.DictReader(f)]
+        return sorted(rows, key=lambda row: int(row['ID']))
+    from wormhole.config import load_config
+    from wormhole.sql import run_query
+    return run_query("select ID, DATABASE_NAME, SCHEMA_NAME, TABLE_NAME, OLD_COLUMN_NAME, OLD_DATA_TYPE, OLD_DATA_LENGTH, "
+                     "NEW_DATA_TYPE, NEW_DATA_LENGTH, CHANGE_TYPE, CREATED_AT from WORMHOLE.SCHEMA_MANAGEMENT.CHANGE_HISTORY order by ID;",
+                     load_config())
+
+
+def print_report(results):
+    print(f"{'policy':<22}{'approvals':>10}{'replayed':>10}{'saved':>8}{'widenings':>11}{'largest VARCHAR':>17}")
+    for result in results:
+        print(f"{result['policy']:<22}{result['approvals']:>10}{result['replayed_approvals']:>10}{result['approvals_saved']:>8}"
+              f"{result['widenings']:>11}{result['largest_length']:>17}")
+
+
+def main(argv):
+    from wormhole.sizing import parse_policy, replay
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--csv', help='CSV export of CHANGE_HISTORY instead of reading Snowflake')
+    parser.add_argument('--policy', action='append', help=f'policy to replay, repeatable (default: {", ".join(DEFAULT_POLICIES)})')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv[1:])
+    change_history = read_change_history(args.csv)
+    results = [replay(change_history, parse_policy(policy)) for policy in args.policy or DEFAULT_POLICIES]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{len(change_history)} changes in {results[0]['runs'] if results else 0} detection runs")
+        print_report(results)
+
+
+if __name__ == '__main__':
+    main(sys.argv)